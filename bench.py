@@ -0,0 +1,942 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2015, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Benchmarks for httq. Each benchmark talks to a local server running in a
+background thread, so no network access is required::
+
+    $ python bench.py               # run all benchmarks
+    $ python bench.py idle_wait     # run selected benchmarks by name
+
+"""
+
+from __future__ import print_function
+
+from collections import deque
+import json
+from socket import socket, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY, error as socket_error
+from threading import Condition, Lock, Thread
+import sys
+from tempfile import TemporaryFile
+from time import sleep, time
+import zlib
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    from time import process_time
+except ImportError:
+    from time import clock as process_time
+
+import httq
+from httq import HTTP, HTTPSocket, ResponseParser, NEED_DATA, END_OF_MESSAGE, bstr, gather
+
+
+BENCHMARKS = []
+
+
+def benchmark(f):
+    BENCHMARKS.append(f)
+    return f
+
+
+def report(name, **metrics):
+    print("%-32s %s" % (name, "  ".join("%s=%s" % (key, metrics[key]) for key in sorted(metrics))))
+
+
+# Local server
+
+
+class Server(Thread):
+    """ Minimal HTTP/1.1 server for benchmarking. For each request received,
+    `handler` is called with the connection, method, target and body; it
+    should write a complete response to the connection and may return
+    :const:`False` to close the connection afterwards. Unless `keep_body`
+    is true, request bodies are read and discarded in pieces.
+    """
+
+    def __init__(self, handler, keep_body=True):
+        Thread.__init__(self)
+        self.daemon = True
+        self.handler = handler
+        self.keep_body = keep_body
+        self.listener = socket()
+        self.listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1024)
+        self.authority = b"127.0.0.1:" + bstr(self.listener.getsockname()[1])
+        self.start()
+
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except socket_error:
+                return
+            connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            thread = Thread(target=self.serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, connection):
+        reader = connection.makefile("rb")
+        try:
+            while True:
+                request_line = reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.split(b" ", 2)
+                length = 0
+                while True:
+                    header = reader.readline()
+                    if header in (b"\r\n", b""):
+                        break
+                    name, _, value = header.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                if self.keep_body:
+                    body = reader.read(length) if length else b""
+                else:
+                    while length:
+                        length -= len(reader.read(min(length, 65536)))
+                    body = b""
+                if self.handler(connection, method, target, body) is False:
+                    break
+        except socket_error:
+            pass
+        finally:
+            reader.close()
+            connection.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def send_sized(connection, body, content_type=b"application/octet-stream"):
+    connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: " + content_type +
+                       b"\r\nContent-Length: " + bstr(len(body)) + b"\r\n\r\n")
+    connection.sendall(body)
+
+
+def send_chunked(connection, body, chunk_size, content_type=b"application/octet-stream"):
+    connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: " + content_type +
+                       b"\r\nTransfer-Encoding: chunked\r\n\r\n")
+    view = memoryview(body)
+    for offset in range(0, len(body), chunk_size):
+        chunk = view[offset:(offset + chunk_size)]
+        connection.sendall(("%x\r\n" % len(chunk)).encode("ASCII"))
+        connection.sendall(chunk)
+        connection.sendall(b"\r\n")
+    connection.sendall(b"0\r\n\r\n")
+
+
+def send_until_closed(connection, body, content_type=b"application/octet-stream"):
+    connection.sendall(b"HTTP/1.0 200 OK\r\nContent-Type: " + content_type + b"\r\n\r\n")
+    connection.sendall(body)
+    return False
+
+
+def body_server(body, chunk_size=65536):
+    """ Server for `body` as sized (/sized), chunked (/chunked) or
+    read-until-close (/closed) content.
+    """
+
+    def handler(connection, method, target, _):
+        if target.startswith(b"/sized"):
+            send_sized(connection, body)
+        elif target.startswith(b"/chunked"):
+            send_chunked(connection, body, chunk_size)
+        else:
+            return send_until_closed(connection, body)
+
+    return Server(handler)
+
+
+def measure(f, *args):
+    """ Call `f` and return its result along with the elapsed wall clock time
+    and, if tracemalloc is available, the peak traced allocation in a
+    second call.
+    """
+    t0 = time()
+    result = f(*args)
+    elapsed = time() - t0
+    peak = None
+    if tracemalloc:
+        tracemalloc.start()
+        f(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def mb(size):
+    return "%.1f" % (size / 1048576.0)
+
+
+# Benchmarks
+
+
+@benchmark
+def idle_wait(requests=10, delay=0.2):
+    """ CPU time consumed per request while the client is idle, waiting
+    on a server that takes `delay` seconds to respond.
+    """
+
+    def handler(connection, method, target, body):
+        sleep(delay)
+        send_sized(connection, b"hello, world")
+
+    server = Server(handler)
+    http = HTTP(server.authority)
+    cpu, wall = process_time(), time()
+    for _ in range(requests):
+        http.get(b"/").response().readall()
+    cpu, wall = process_time() - cpu, time() - wall
+    http.close()
+    server.close()
+    report("idle_wait", cpu_ms_per_request="%.2f" % (1000 * cpu / requests),
+           wall_ms_per_request="%.1f" % (1000 * wall / requests))
+
+
+@benchmark
+def receive_content(size=33554432, chunk_size=1048576):
+    """ Throughput and peak allocation when receiving sized, chunked and
+    read-until-close bodies at socket level, discarding each chunk.
+    """
+    server = body_server(b"x" * size, chunk_size)
+    host, _, port = server.authority.partition(b":")
+
+    def receive(target):
+        s = HTTPSocket()
+        s.connect((host, int(port)))
+        s.send_x(b"GET " + target + b" HTTP/1.1\r\nHost: " + server.authority + b"\r\n\r\n")
+        s.recv_headers()
+        if target == b"/sized":
+            chunks = s.recv_content(size)
+        elif target == b"/chunked":
+            chunks = s.recv_chunked_content()
+        else:
+            chunks = s.recv_content()
+        received = 0
+        for chunk in chunks:
+            received += len(chunk)
+        s.close()
+        return received
+
+    for target in [b"/sized", b"/chunked", b"/closed"]:
+        received, elapsed, peak = measure(receive, target)
+        assert received == size
+        report("receive_content" + target.decode("ASCII"), mb_per_s=mb(size / elapsed),
+               peak_alloc_mb=mb(peak) if peak is not None else "n/a")
+    server.close()
+
+
+@benchmark
+def read_content(size=33554432):
+    """ Throughput and peak allocation when reading a whole sized or chunked
+    body through HTTP.readall, HTTP.read in 64 KiB pieces, or HTTP.readinto
+    into a buffer allocated by the caller.
+    """
+    server = body_server(b"x" * size)
+    http = HTTP(server.authority)
+    buffer = bytearray(size)
+
+    def readall(target):
+        return len(http.get(target).response().readall())
+
+    def read(target):
+        http.get(target).response()
+        count = 0
+        while http.readable():
+            count += len(http.read(65536))
+        return count
+
+    def readinto(target):
+        http.get(target).response()
+        view = memoryview(buffer)
+        count = 0
+        while count < size and http.readable():
+            count += http.readinto(view[count:])
+        return count
+
+    for f in [readall, read, readinto]:
+        for target in [b"/sized", b"/chunked"]:
+            try:
+                received, elapsed, peak = measure(f, target)
+            except NotImplementedError:
+                continue
+            assert received == size
+            report("read_content/%s%s" % (f.__name__, target.decode("ASCII")), mb_per_s=mb(size / elapsed),
+                   peak_alloc_mb=mb(peak) if peak is not None else "n/a")
+    http.close()
+    server.close()
+
+
+@benchmark
+def receive_pipelined(requests=2000):
+    """ Time to read a long run of small pipelined responses, all of which
+    arrive together and are buffered.
+    """
+
+    def handler(connection, method, target, _):
+        send_sized(connection, b"hello, world")
+
+    server = Server(handler)
+    http = HTTP(server.authority)
+
+    def run():
+        for _ in range(requests):
+            http.get(b"/hello")
+        for _ in range(requests):
+            http.response().readall()
+
+    _, elapsed, peak = measure(run)
+    report("receive_pipelined", us_per_response="%.1f" % (1000000 * elapsed / requests),
+           peak_alloc_mb=mb(peak) if peak is not None else "n/a")
+    http.close()
+    server.close()
+
+
+@benchmark
+def parse_responses(responses=20000):
+    """ Time for the response parser alone to parse a run of small sized
+    and chunked responses, fed in pieces of 4 KiB.
+    """
+    sized = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 12\r\n\r\nhello, world"
+    chunked = (b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n\r\n"
+               b"7\r\nhello, \r\n5\r\nworld\r\n0\r\n\r\n")
+    for name, response in [("sized", sized), ("chunked", chunked)]:
+        data = response * responses
+        pieces = [data[i:(i + 4096)] for i in range(0, len(data), 4096)]
+
+        def run():
+            parser = ResponseParser()
+            pieces_iter = iter(pieces)
+            for _ in range(responses):
+                parser.start()
+                event = None
+                while event is not END_OF_MESSAGE:
+                    event = parser.next_event()
+                    if event is NEED_DATA:
+                        parser.feed(next(pieces_iter))
+
+        _, elapsed, _ = measure(run)
+        report("parse_responses/" + name, us_per_response="%.2f" % (1000000 * elapsed / responses))
+
+
+@benchmark
+def held_responses(responses=20000):
+    """ Time and memory taken to parse a run of small responses and hold
+    each in full, either in an HTTP instance of its own (as pipelined and
+    multiplexed responses were once held) or in a detached Response.
+    """
+    data = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 12\r\n\r\nhello, world" * responses
+
+    def hold(new):
+        parser = ResponseParser()
+        parser.feed(data)
+        held = []
+        for _ in range(responses):
+            parser.start()
+            response = new(parser.next_event())
+            response._raw_content = bytearray()
+            event = parser.next_event()
+            while event is not END_OF_MESSAGE:
+                response._append(event)
+                event = parser.next_event()
+            held.append(response)
+        return held
+
+    def new_http(head):
+        http = HTTP()
+        http._start_response(head)
+        return http
+
+    for name, new in [("http", new_http), ("response", httq.Response)]:
+        _, elapsed, peak = measure(hold, new)
+        metrics = {"us_per_response": "%.2f" % (1000000 * elapsed / responses)}
+        if peak is not None:
+            metrics["bytes_per_response"] = "%.0f" % (peak / float(responses))
+        report("held_responses/" + name, **metrics)
+
+
+class CountingSocket(HTTPSocket):
+    """ Socket that counts the send calls made on it.
+    """
+
+    calls = 0
+
+    def send(self, *args):
+        self.calls += 1
+        return super(CountingSocket, self).send(*args)
+
+    def sendmsg(self, *args):
+        self.calls += 1
+        return super(CountingSocket, self).sendmsg(*args)
+
+
+@benchmark
+def send_request(sizes=(100, 65536, 33554432)):
+    """ Send calls, bytes copied and time taken to send a request with a
+    small, medium and huge body, with the fragments joined up front or
+    gathered by send_x.
+    """
+
+    def handler(connection, method, target, body):
+        send_sized(connection, b"")
+
+    server = Server(handler)
+    host, _, port = server.authority.partition(b":")
+    for size in sizes:
+        body = b"x" * size
+        data = [b"POST / HTTP/1.1\r\n", b"Host: ", server.authority, b"\r\n",
+                b"Content-Length: ", bstr(size), b"\r\n\r\n", body]
+        for name, prepare in [("joined", lambda: b"".join(data)), ("gathered", lambda: data)]:
+            s = CountingSocket()
+            s.connect((host, int(port)))
+            t0 = time()
+            prepared = prepare()
+            s.send_x(prepared)
+            s.recv_headers()
+            elapsed = time() - t0
+            buffers = gather(prepared) if isinstance(prepared, list) else [prepared]
+            copied = sum(len(b) for b in buffers if not any(b is fragment for fragment in data))
+            report("send_request/%s/%d" % (name, size), send_calls=s.calls, copied_kb="%.1f" % (copied / 1024.0),
+                   ms="%.2f" % (1000 * elapsed))
+            s.close()
+    server.close()
+
+
+@benchmark
+def upload_file(size=67108864):
+    """ Throughput and peak allocation when uploading a file, sent by the
+    kernel or copied through a buffer, against reading it into memory
+    first.
+    """
+
+    def handler(connection, method, target, body):
+        send_sized(connection, b"")
+
+    server = Server(handler, keep_body=False)
+    with TemporaryFile() as f:
+        f.write(b"x" * size)
+
+        def upload(http, body):
+            f.seek(0)
+            http.put(b"/", body(f)).response().readall()
+
+        for name, zero_copy, body in [("sendfile", True, lambda f: f), ("buffered", False, lambda f: f),
+                                      ("read", True, lambda f: f.read())]:
+            HTTPSocket.zero_copy, default = zero_copy, HTTPSocket.zero_copy
+            try:
+                http = HTTP(server.authority)
+            finally:
+                HTTPSocket.zero_copy = default
+            _, elapsed, peak = measure(upload, http, body)
+            report("upload_file/" + name, mb_per_s=mb(size / elapsed),
+                   peak_alloc_mb=mb(peak) if peak is not None else "n/a")
+            http.close()
+    server.close()
+
+
+@benchmark
+def save_content(size=67108864):
+    """ Throughput and peak allocation when saving a sized or chunked body
+    to a file with HTTP.save, against writing out HTTP.readall.
+    """
+    server = body_server(b"x" * size)
+    http = HTTP(server.authority)
+
+    def save(target, f):
+        f.seek(0)
+        return http.get(target).response().save(f)
+
+    def readall(target, f):
+        f.seek(0)
+        content = http.get(target).response().readall()
+        f.write(content)
+        return len(content)
+
+    with TemporaryFile() as f:
+        for method in [save, readall]:
+            for target in [b"/sized", b"/chunked"]:
+                saved, elapsed, peak = measure(method, target, f)
+                assert saved == size
+                report("save_content/%s%s" % (method.__name__, target.decode("ASCII")), mb_per_s=mb(size / elapsed),
+                       peak_alloc_mb=mb(peak) if peak is not None else "n/a")
+    http.close()
+    server.close()
+
+
+@benchmark
+def spill_content(size=67108864, threshold=1048576):
+    """ Peak allocation when reading a whole sized or chunked body through
+    HTTP.readall, held in memory or spilled to a memory-mapped temporary
+    file past `threshold` bytes.
+    """
+    server = body_server(b"x" * size)
+    for name, spill_threshold in [("memory", None), ("spilled", threshold)]:
+        http = HTTP(server.authority, spill_threshold=spill_threshold)
+        for target in [b"/sized", b"/chunked"]:
+            received, elapsed, peak = measure(lambda: len(http.get(target).response().readall()))
+            assert received == size
+            report("spill_content/%s%s" % (name, target.decode("ASCII")), mb_per_s=mb(size / elapsed),
+                   peak_alloc_mb=mb(peak) if peak is not None else "n/a")
+        http.close()
+    server.close()
+
+
+@benchmark
+def decompress_json(rows=100000):
+    """ Bytes received and time taken to fetch a large JSON document, sent
+    plain or gzip-encoded and decoded by HTTP with `decompress` set.
+    """
+    body = json.dumps({"results": [{"row": [i, "node %d" % i]} for i in range(rows)]}).encode("UTF-8")
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    encoded = compressor.compress(body) + compressor.flush()
+
+    def handler(connection, method, target, _):
+        if target == b"/gzip":
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Encoding: gzip\r\n"
+                               b"Content-Length: " + bstr(len(encoded)) + b"\r\n\r\n" + encoded)
+        else:
+            send_sized(connection, body, b"application/json")
+
+    server = Server(handler)
+    for name, decompress in [("plain", False), ("gzip", True)]:
+        http = HTTP(server.authority, decompress=decompress)
+        t0 = time()
+        assert len(http.get(b"/" + name.encode("ASCII")).response().content["results"]) == rows
+        elapsed = time() - t0
+        report("decompress_json/" + name, received_kb="%.1f" % (int(http.headers[b"Content-Length"]) / 1024.0),
+               ms="%.1f" % (1000 * elapsed))
+        http.close()
+    server.close()
+
+
+@benchmark
+def compress_upload(rows=500000):
+    """ Bytes sent and time taken to POST a large JSON document, sent plain
+    or gzip-compressed by HTTP with `compress` set.
+    """
+
+    def handler(connection, method, target, body):
+        send_sized(connection, b"")
+
+    server = Server(handler, keep_body=False)
+    body = {"statements": [{"statement": "CREATE (n {id: $id, name: $name})",
+                            "parameters": {"id": i, "name": "node %d" % i}} for i in range(rows)]}
+    for name, compress in [("plain", None), ("gzip", b"gzip")]:
+        http = HTTP(server.authority, compress=compress)
+        t0 = time()
+        http.post(b"/ingest", body)
+        sent = int(http.request_headers[b"Content-Length"])
+        http.response().readall()
+        elapsed = time() - t0
+        report("compress_upload/" + name, sent_mb=mb(sent), ms="%.1f" % (1000 * elapsed))
+        http.close()
+    server.close()
+
+
+@benchmark
+def json_codecs(items=200000):
+    """ Time taken and peak allocation for each registered JSON codec to
+    encode documents of different shapes and decode them again from the
+    bytes received, as HTTP.content does.
+    """
+    shapes = [
+        ("rows", [{"id": i, "name": "node %d" % i, "active": i % 2 == 0} for i in range(items)]),
+        ("numbers", [i * 0.5 for i in range(items)]),
+        ("strings", [u"caf\xe9 %d " % i * 8 for i in range(items // 4)]),
+        ("nested", [{"a": {"b": {"c": [i, {"d": [str(i), None]}]}}} for i in range(items // 2)]),
+    ]
+    for shape, value in shapes:
+        for name in sorted(httq.JSON_CODECS):
+            codec = httq.get_json_codec(name)
+            data, encode_time, _ = measure(codec.dumps, value)
+            _, decode_time, peak = measure(codec.loads, data)
+            report("json_codecs/%s/%s" % (shape, name), size_mb=mb(len(data)), encode_ms="%.1f" % (1000 * encode_time),
+                   decode_ms="%.1f" % (1000 * decode_time), peak_mb=mb(peak) if peak is not None else "-")
+
+
+@benchmark
+def stream_json(rows=1000000):
+    """ Time to the first row, total time and peak allocation when reading
+    the rows of a large Neo4j-style result through HTTP.content, against
+    HTTP.iter_json.
+    """
+    body = json.dumps({"results": [{"columns": ["id", "name"],
+                                    "data": [{"row": [i, "node %d" % i], "meta": [None, None]}
+                                             for i in range(rows)]}],
+                       "errors": []}).encode("UTF-8")
+
+    def handler(connection, method, target, _):
+        send_chunked(connection, body, 65536, b"application/json")
+
+    def read_content(http):
+        t0 = time()
+        data = http.get(b"/").response().content["results"][0]["data"]
+        first = time() - t0
+        return first, len(data)
+
+    def read_iter_json(http):
+        t0 = time()
+        first = None
+        count = 0
+        for _ in http.get(b"/").response().iter_json(("results", 0, "data")):
+            if first is None:
+                first = time() - t0
+            count += 1
+        return first, count
+
+    server = Server(handler)
+    for name, f in [("content", read_content), ("iter_json", read_iter_json)]:
+        http = HTTP(server.authority)
+        (first, count), elapsed, peak = measure(f, http)
+        assert count == rows
+        report("stream_json/" + name, first_row_ms="%.1f" % (1000 * first), ms="%.1f" % (1000 * elapsed),
+               peak_mb=mb(peak) if peak is not None else "-")
+        http.close()
+    server.close()
+
+
+@benchmark
+def stream_ndjson(records=1000000):
+    """ Time to the first record, total time and peak allocation when
+    reading a large NDJSON response, as a list decoded
+    from HTTP.readall, through HTTP.content or through HTTP.iter_ndjson.
+    """
+    body = b"".join(json.dumps({"id": i, "name": "node %d" % i}).encode("UTF-8") + b"\n" for i in range(records))
+
+    def handler(connection, method, target, _):
+        send_sized(connection, body, b"application/x-ndjson")
+
+    def read_list(http):
+        loads = httq.get_json_codec().loads
+        return (loads(line) for line in [line for line in http.readall().split(b"\n") if line])
+
+    def read(http, f):
+        t0 = time()
+        first = None
+        count = 0
+        for _ in f(http.get(b"/").response()):
+            if first is None:
+                first = time() - t0
+            count += 1
+        return first, count
+
+    server = Server(handler)
+    for name, f in [("readall", read_list), ("content", lambda http: http.content),
+                    ("iter_ndjson", lambda http: http.iter_ndjson())]:
+        http = HTTP(server.authority)
+        (first, count), elapsed, peak = measure(read, http, f)
+        assert count == records
+        report("stream_ndjson/" + name, first_record_ms="%.1f" % (1000 * first), ms="%.1f" % (1000 * elapsed),
+               peak_mb=mb(peak) if peak is not None else "-")
+        http.close()
+    server.close()
+
+
+@benchmark
+def event_latency(events=500, interval=0.002):
+    """ Mean and worst delay between a server sending a small event and the
+    client receiving it, through HTTP.events or by parsing the content
+    read in fixed-size pieces with HTTP.read.
+    """
+
+    def handler(connection, method, target, _):
+        connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+        for i in range(events):
+            connection.sendall(("id: %d\ndata: %r\n\n" % (i, time())).encode("ASCII"))
+            sleep(interval)
+        return False
+
+    def read_events(http):
+        http.get(b"/events").response()
+        parser = httq.EventStreamParser()
+        data = http.read(4096)
+        while data:
+            for event in parser.feed(data):
+                yield event
+            data = http.read(4096)
+
+    server = Server(handler)
+    for name, f in [("events", lambda http: http.events(b"/events", reconnect=False)), ("read", read_events)]:
+        http = HTTP(server.authority)
+        delays = [time() - float(event.data) for event in f(http)]
+        assert len(delays) == events
+        report("event_latency/" + name, mean_ms="%.2f" % (1000 * sum(delays) / len(delays)),
+               max_ms="%.2f" % (1000 * max(delays)))
+        http.close()
+    server.close()
+
+
+@benchmark
+def websocket_messages(messages=100000, size=200):
+    """ Masking throughput for payloads of different sizes, in bulk and
+    byte by byte, then the rate at which small messages are sent through
+    WebSocket.send (each masked with its own key) and received through
+    WebSocket.receive.
+    """
+
+    def mask_bytewise(data, key):
+        key = bytearray(key)
+        masked = bytearray(data)
+        for i in range(len(masked)):
+            masked[i] ^= key[i & 3]
+        return bytes(masked)
+
+    key = b"\x12\x34\x56\x78"
+    for payload_size in [125, 4096, 1048576]:
+        payload = bytes(bytearray(i % 256 for i in range(payload_size)))
+        repeat = max(1, 4194304 // payload_size)
+        for name, f in [("bulk", httq.mask), ("bytewise", mask_bytewise)]:
+            t0 = time()
+            for _ in range(repeat if name == "bulk" else max(1, repeat // 32)):
+                f(payload, key)
+            elapsed = (time() - t0) / (repeat if name == "bulk" else max(1, repeat // 32))
+            report("websocket_messages/mask/%d/%s" % (payload_size, name),
+                   mb_per_s="%.1f" % (payload_size / elapsed / 1048576))
+
+    # A raw peer stands in for the server, the handshake being skipped
+    message = b"x" * size
+    frame = b"\x82" + bytearray([size]) if size < 126 else b"\x82\x7e" + bytes(bytearray([size >> 8, size & 0xFF]))
+    listener = socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    def peer(send):
+        connection, _ = listener.accept()
+        if send:
+            connection.sendall((bytes(frame) + message) * messages + b"\x88\x02\x03\xe8")
+        else:
+            while connection.recv(262144):
+                pass
+        connection.close()
+
+    for name in ["send", "receive"]:
+        thread = Thread(target=peer, args=(name == "receive",))
+        thread.start()
+        s = HTTPSocket()
+        s.connect(listener.getsockname())
+        ws = httq.WebSocket(s)
+        t0 = time()
+        if name == "send":
+            for _ in range(messages):
+                ws.send(message)
+            ws._disconnect()
+        else:
+            count = sum(1 for _ in ws)
+            assert count == messages
+        elapsed = time() - t0
+        thread.join()
+        report("websocket_messages/" + name, messages_per_s="%.0f" % (messages / elapsed),
+               mb_per_s="%.1f" % (messages * size / elapsed / 1048576))
+    listener.close()
+
+
+@benchmark
+def fan_out(requests=2000, latency=0.01):
+    """ Rate at which requests to a server that takes a fixed time to
+    respond are completed: one after another over one connection, from a
+    number of threads with a connection each, and through an
+    HTTPMultiplexer from a single thread.
+    """
+
+    def handler(connection, method, target, _):
+        sleep(latency)
+        send_sized(connection, b"hello, world")
+
+    server = Server(handler)
+    url = b"http://" + server.authority + b"/hello"
+
+    http = HTTP(server.authority)
+    count = requests // 20
+    t0 = time()
+    for _ in range(count):
+        http.get(b"/hello").response().content
+    report("fan_out/sequential", requests_per_s="%.0f" % (count / (time() - t0)))
+    http.close()
+
+    for threads in [32, 256]:
+        remaining = [requests]
+
+        def work():
+            http = HTTP(server.authority)
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        break
+                    remaining[0] -= 1
+                http.get(b"/hello").response().content
+            http.close()
+
+        lock = Lock()
+        t0 = time()
+        workers = [Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        report("fan_out/threads/%d" % threads, requests_per_s="%.0f" % (requests / (time() - t0)))
+
+    for connections in [32, 256]:
+        with httq.HTTPMultiplexer(max_connections_per_host=connections) as mux:
+            t0 = time()
+            futures = [mux.submit(b"GET", url) for _ in range(requests)]
+            mux.run()
+            elapsed = time() - t0
+            assert all(future.result().content == b"hello, world" for future in futures)
+        report("fan_out/multiplexer/%d" % connections, requests_per_s="%.0f" % (requests / elapsed))
+    server.close()
+
+
+@benchmark
+def pipeline_depth(requests=5000, threads=8, latency=0.002):
+    """ Rate at which small requests from a number of threads are
+    completed over a single connection with a simulated round trip time,
+    either taking turns to make each request and read its response or
+    sharing the connection through an HTTPPipeline of different depths.
+    """
+    delayed = {}    # queue of responses to send, and condition, for each connection
+
+    def send_delayed(connection, queue, condition):
+        while True:
+            with condition:
+                while not queue:
+                    condition.wait()
+                due, data = queue.popleft()
+            if data is None:
+                return
+            sleep(max(due - time(), 0))
+            connection.sendall(data)
+
+    def handler(connection, method, target, _):
+        # Each response is held back for the round trip time, without
+        # holding up the requests behind it
+        if connection not in delayed:
+            delayed[connection] = deque(), Condition()
+            Thread(target=send_delayed, args=(connection,) + delayed[connection]).start()
+        queue, condition = delayed[connection]
+        with condition:
+            queue.append((time() + latency, b"HTTP/1.1 200 OK\r\nContent-Length: 12\r\n\r\nhello, world"))
+            condition.notify()
+
+    def run(name, request):
+        remaining = [requests]
+        lock = Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        break
+                    remaining[0] -= 1
+                request()
+
+        t0 = time()
+        workers = [Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        report("pipeline_depth/" + name, requests_per_s="%.0f" % (requests / (time() - t0)))
+
+    server = Server(handler)
+    http = HTTP(server.authority)
+    turn = Lock()
+
+    def take_turns():
+        with turn:
+            http.get(b"/hello").response().content
+
+    run("turns", take_turns)
+    http.close()
+    for depth in [1, 8, 32]:
+        with httq.HTTPPipeline(server.authority, max_depth=depth) as pipeline:
+            run("pipeline/%d" % depth, lambda: pipeline.submit(b"GET", b"/hello").result().content)
+    for queue, condition in delayed.values():
+        with condition:
+            queue.append((0, None))
+            condition.notify()
+    server.close()
+
+
+@benchmark
+def deferred_burst(bursts=2000, size=10):
+    """ Rate at which bursts of small pipelined requests are completed over
+    a single connection, and the number of send calls (and therefore, with
+    TCP_NODELAY, segments) needed per request, with each request sent as
+    it is made or all deferred until the burst is flushed.
+    """
+    def handler(connection, method, target, _):
+        connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 12\r\n\r\nhello, world")
+
+    server = Server(handler)
+    for name, flush in [("immediate", True), ("deferred", False), ("deferred/cork", False)]:
+        http = HTTP(server.authority, cork=name.endswith("cork"))
+        sends = [0]
+        send_x = http._socket.send_x
+
+        def counting_send_x(data, timeout=None):
+            sends[0] += 1
+            send_x(data, timeout)
+
+        http._socket.send_x = counting_send_x
+        t0 = time()
+        for _ in range(bursts):
+            for i in range(size):
+                http.get(b"/hello", flush=flush)
+            for i in range(size):
+                http.response().content
+        t = time() - t0
+        report("deferred_burst/" + name, requests_per_s="%.0f" % (bursts * size / t),
+               sends_per_request="%.2f" % (sends[0] / float(bursts * size)))
+        http.close()
+    server.close()
+
+
+@benchmark
+def module_get(requests=2000):
+    """ Time per request made through the module-level get function, which
+    draws connections from the default pool.
+    """
+
+    def handler(connection, method, target, _):
+        send_sized(connection, b"hello, world")
+
+    server = Server(handler)
+    url = b"http://" + server.authority + b"/hello"
+    t0 = time()
+    for _ in range(requests):
+        httq.get(url).content
+    elapsed = time() - t0
+    report("module_get", us_per_request="%.1f" % (1000000 * elapsed / requests))
+    server.close()
+
+
+def main():
+    names = sys.argv[1:]
+    for f in BENCHMARKS:
+        if not names or f.__name__ in names:
+            f()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,10 +16,11 @@ except (IndexError, ValueError):
     loops = 1
 
 body = json.dumps({"statements": [{"statement": "RETURN 1"}]}, ensure_ascii=True, separators=",:").encode("UTF-8")
+commit = http.prepare(b"POST", b"/db/data/transaction/commit", body)
 
 
 def query():
-    if http.request(b"POST", b"/db/data/transaction/commit", body).response().status_code == 200:
+    if http.send(commit).response().status_code == 200:
         if loops == 1:
             print(http.content)
     else:
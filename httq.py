@@ -17,26 +17,70 @@
 
 
 from base64 import b64encode
+import codecs
 from collections import deque
+from errno import EAGAIN, EINPROGRESS, EWOULDBLOCK
+from hashlib import sha1
 from io import DEFAULT_BUFFER_SIZE
 from json import dumps as json_dumps, loads as json_loads
+from mmap import mmap
+import os
+from os import fstat, urandom
 import re
 from select import select
-from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY, SHUT_RDWR, error as socket_error
+from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY, SHUT_RDWR, SOL_SOCKET, SO_ERROR, \
+    error as socket_error, timeout as socket_timeout
+from struct import pack, unpack_from
 import sys
+from tempfile import TemporaryFile
+import zlib
+from threading import Condition, Event, Lock, RLock, Thread
+from time import sleep
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+try:
+    from socket import TCP_CORK
+except ImportError:
+    TCP_CORK = None     # Linux only
+
+try:
+    from os import PathLike, fspath
+except ImportError:
+    PathLike = ()
+
+try:
+    from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+except ImportError:
+    DefaultSelector = None
 
 try:
     from bs4 import BeautifulSoup
 except ImportError:
     BeautifulSoup = None
 
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 __author__ = "Nigel Small"
 __copyright__ = "2015, Nigel Small"
 __email__ = "nigel@nigelsmall.com"
 __license__ = "Apache License, Version 2.0"
 __version__ = "0.0.2"
-__all__ = ["HTTP", "Resource", "get", "head", "put", "patch", "post", "delete", "SocketError"]
+__all__ = ["HTTP", "Response", "PreparedRequest", "HTTPPool", "Resource", "JSONCodec", "register_json_codec",
+           "get_json_codec", "set_json_codec", "WebSocket", "HTTPMultiplexer", "HTTPPipeline", "ResponseFuture", "get",
+           "head", "put", "patch", "post", "delete", "SocketError", "SocketTimeout", "MessageTooBig"]
 
 
 try:
@@ -49,6 +93,7 @@ METHODS = dict(
     (method.decode("UTF-8"), method)
     for method in [b"OPTIONS", b"GET", b"HEAD", b"POST", b"PUT", b"DELETE", b"TRACE"]
 )
+IDEMPOTENT_METHODS = frozenset([b"OPTIONS", b"GET", b"HEAD", b"PUT", b"DELETE", b"TRACE"])
 HTTP_VERSIONS = dict(
     (_version, _version.decode("UTF-8"))
     for _version in [b"HTTP/0.9", b"HTTP/1.0", b"HTTP/1.1"]
@@ -108,6 +153,7 @@ REASONS = dict(
 
 if sys.version_info >= (3,):
     jsonable = (type(None), bool, int, float, str, list, dict)
+    text_type = str
 
     SPACE = ord(' ')
 
@@ -124,8 +170,16 @@ if sys.version_info >= (3,):
     def hexb(n):
         return hex(n)[2:].encode("UTF-8")
 
+    def mask(data, key):
+        # XOR `data` with the 4-byte `key`, repeated, as a single operation
+        # on two integers the size of the data
+        size = len(data)
+        keys = memoryview(key * (size // 4 + 1))[:size]
+        return (int.from_bytes(data, "little") ^ int.from_bytes(keys, "little")).to_bytes(size, "little")
+
 else:
     jsonable = (type(None), bool, int, long, float, unicode, list, dict)
+    text_type = unicode
 
     SPACE = b' '
 
@@ -140,6 +194,17 @@ else:
     def hexb(n):
         return hex(n)[2:]
 
+    from binascii import hexlify, unhexlify
+
+    def mask(data, key):
+        # XOR `data` with the 4-byte `key`, repeated, as a single operation
+        # on two integers the size of the data
+        size = len(data)
+        if not size:
+            return b""
+        keys = (key * (size // 4 + 1))[:size]
+        return unhexlify("%0*x" % (2 * size, long(hexlify(data), 16) ^ long(hexlify(keys), 16)))
+
 
 REQUEST_HEADERS = {
     "accept": b"Accept",
@@ -161,12 +226,16 @@ REQUEST_HEADERS = {
     "if_none_match": b"If-None-Match",
     "if_range": b"If-Range",
     "if_unmodified_since": b"If-Unmodified-Since",
+    "last_event_id": b"Last-Event-ID",
     "max_forwards": b"Max-Forwards",
     "origin": b"Origin",
     "pragma": b"Pragma",
     "proxy_authorization": b"Proxy-Authorization",
     "range": b"Range",
     "referer": b"Referer",
+    "sec_websocket_key": b"Sec-WebSocket-Key",
+    "sec_websocket_protocol": b"Sec-WebSocket-Protocol",
+    "sec_websocket_version": b"Sec-WebSocket-Version",
     "te": b"TE",
     "user_agent": b"User-Agent",
     "upgrade": b"Upgrade",
@@ -181,6 +250,34 @@ READ_CHUNKED = object()
 READ_SIZED = object()
 READ_UNTIL_CLOSED = object()
 
+MIN_RECV_SIZE = DEFAULT_BUFFER_SIZE
+MAX_RECV_SIZE = 262144
+
+CONTENT_ENCODINGS = [b"gzip", b"deflate"] + ([b"zstd"] if zstd else [])
+ACCEPT_ENCODING = b", ".join(CONTENT_ENCODINGS)
+
+MAX_COALESCE_SIZE = 16384
+MAX_SEND_BUFFERS = 64
+
+SEND_FILE_BLOCK_SIZE = 16777216
+SEND_FILE_BUFFER_SIZE = 1048576
+
+NDJSON_CONTENT_TYPES = ["application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines",
+                        "application/jsonlines"]
+
+# Marks NDJSON content that was streamed from the connection without being held
+STREAMED = object()
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WEBSOCKET_CONTINUATION = 0x0
+WEBSOCKET_TEXT = 0x1
+WEBSOCKET_BINARY = 0x2
+WEBSOCKET_CLOSE = 0x8
+WEBSOCKET_PING = 0x9
+WEBSOCKET_PONG = 0xA
+WEBSOCKET_MESSAGE_TOO_BIG = 1009
+MAX_WEBSOCKET_MESSAGE_SIZE = 16777216
+
 
 # Log functions
 
@@ -201,15 +298,117 @@ def log_dump(out=sys.stdout):
         out.write("\r\n")
 
 
+# JSON codecs
+
+
+class JSONCodec(object):
+    """ A named pair of JSON functions: `dumps` turns a value into UTF-8
+    encoded bytes and `loads` turns text, or UTF-8 encoded bytes in any
+    bytes-like object, back into a value.
+    """
+
+    __slots__ = ["name", "dumps", "loads"]
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return "<JSONCodec %s>" % self.name
+
+
+JSON_CODECS = {}
+
+
+def register_json_codec(name, dumps, loads):
+    """ Register a :class:`JSONCodec` under `name`, for selection by
+    :func:`set_json_codec` or the `json_codec` option of :class:`HTTP`.
+    """
+    codec = JSON_CODECS[name] = JSONCodec(name, dumps, loads)
+    return codec
+
+
+def get_json_codec(codec=None):
+    """ Return the codec registered under the name `codec`, `codec` itself
+    if already a :class:`JSONCodec`, or the default codec for
+    :const:`None`.
+    """
+    if codec is None:
+        return _json_codec
+    elif isinstance(codec, JSONCodec):
+        return codec
+    try:
+        return JSON_CODECS[codec]
+    except KeyError:
+        raise ValueError("No JSON codec registered as %r" % codec)
+
+
+def set_json_codec(codec):
+    """ Make `codec` (a :class:`JSONCodec` or a registered name) the
+    default, used wherever no other is chosen.
+    """
+    global _json_codec
+    _json_codec = get_json_codec(codec)
+
+
+def _stdlib_json_dumps(value):
+    return json_dumps(value, ensure_ascii=True).encode("ASCII")
+
+
+def _stdlib_json_loads(data):
+    if not isinstance(data, text_type):
+        data = codecs.decode(data, "UTF-8")
+    return json_loads(data)
+
+
+_json_codec = register_json_codec("json", _stdlib_json_dumps, _stdlib_json_loads)
+
+if orjson:
+
+    def _orjson_dumps(value):
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Integers beyond 64 bits, for example
+            return _stdlib_json_dumps(value)
+
+    def _orjson_loads(data):
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            # Let the standard library accept NaN and Infinity or report the error
+            return _stdlib_json_loads(data)
+
+    # Reads bytes-like content without copying, but reads integers beyond 64 bits as floats
+    _json_codec = register_json_codec("orjson", _orjson_dumps, _orjson_loads)
+
+
 # Exported helper functions
 
 
 def json_encode(value):
-    return json_dumps(value, ensure_ascii=True).encode("ASCII")
+    return _json_codec.dumps(value)
 
 
 def json_decode(b):
-    return json_loads(b.decode("UTF-8"))
+    return _json_codec.loads(b)
+
+
+def split_lines(data, pending):
+    """ Split `data` into lines, returning those that are complete without
+    their line endings (either :code:`b"\\n"` or :code:`b"\\r\\n"`). The
+    list `pending` carries an incomplete final line over to the next call.
+    """
+    lines = data.split(b"\n")
+    if pending:
+        pending.append(lines[0])
+        lines[0] = b"".join(pending)
+        del pending[:]
+    last = lines.pop()
+    if last:
+        pending.append(last)
+    return [line[:-1] if line.endswith(b"\r") else line for line in lines]
 
 
 def basic_auth(*args):
@@ -335,285 +534,2662 @@ class SocketError(IOError):
         super(SocketError, self).__init__(*args, **kwargs)
 
 
-def not_implemented(*args, **kwargs):
-    raise NotImplementedError()
-
+class SocketTimeout(SocketError):
+    """ Raised when a connect, read or write operation, or a whole request,
+    does not complete within the time allowed.
+    """
 
-class HTTPSocket(socket):
+    def __init__(self, *args, **kwargs):
+        super(SocketTimeout, self).__init__(*args, **kwargs)
 
-    send_x = not_implemented
-    recv_headers = not_implemented
-    recv_content = not_implemented
-    recv_chunked_content = not_implemented
 
-    def __init__(self):
-        socket.__init__(self, AF_INET, SOCK_STREAM)
+class MessageTooBig(IOError):
+    """ Raised when a WebSocket frame or message exceeds the size limit.
+    """
 
-    def connect(self, address):
-        socket.connect(self, address)
-        socket.setsockopt(self, IPPROTO_TCP, TCP_NODELAY, 1)
+    def __init__(self, *args, **kwargs):
+        super(MessageTooBig, self).__init__(*args, **kwargs)
+
+
+def gather(data):
+    """ Return the buffers in which to send the list of fragments `data`,
+    joining each run of small fragments together so that only large ones
+    are sent directly from their own buffers.
+    """
+    buffers = []
+    run = []
+    for fragment in data:
+        if len(fragment) < MAX_COALESCE_SIZE:
+            run.append(fragment)
+        else:
+            if run:
+                buffers.append(b"".join(run))
+                run = []
+            buffers.append(fragment)
+    if run:
+        buffers.append(b"".join(run))
+    return buffers
+
+
+def file_size(f):
+    """ Return the number of bytes remaining in file object `f` from its
+    current position.
+    """
+    position = f.tell()
+    try:
+        return fstat(f.fileno()).st_size - position
+    except (AttributeError, IOError, ValueError):
+        f.seek(0, 2)
+        size = f.tell() - position
+        f.seek(position)
+        return size
+
+
+class ContentWriter(object):
+    """ Destination for response content saved to a file, given either as
+    a path or as an open file object. Content is written straight to the
+    underlying file descriptor where there is one. Where that descriptor
+    is also seekable, pieces of content can be written into place from
+    several threads at once with :meth:`write_at`.
+    """
+
+    def __init__(self, file, size=None, progress=None):
+        self.file = file if hasattr(file, "write") else open(file, "wb")
+        self.opened = self.file is not file
+        #: The file descriptor written to, if any.
+        self.fd = None
+        #: The file position at which content starts, if the file is seekable.
+        self.position = None
+        try:
+            self.fd = self.file.fileno()
+        except (AttributeError, IOError, ValueError):
+            try:
+                self.position = self.file.tell()
+            except (AttributeError, IOError, ValueError):
+                pass
+        else:
+            self.file.flush()
+            try:
+                self.position = os.lseek(self.fd, 0, os.SEEK_CUR)
+            except OSError:
+                pass
+            else:
+                if size:
+                    self._preallocate(size)
+        self.progress = progress
+        self.written = 0
+        self.started = clock()
+        self._lock = Lock()
+
+    def _preallocate(self, size):
+        # Reserve space for `size` bytes from the start position, where the
+        # platform and file system allow
+        try:
+            os.posix_fallocate(self.fd, self.position, size)
+        except (AttributeError, OSError):
+            pass
 
-        raw_send = self.send
+    def _wrote(self, size):
+        with self._lock:
+            self.written += size
+            if self.progress is not None:
+                elapsed = clock() - self.started
+                self.progress(self.written, self.written / elapsed if elapsed > 0 else 0.0)
 
-        def send_x(data, timeout=0):
+    def write(self, data):
+        if self.fd is None:
+            self.file.write(data)
+        else:
             view = memoryview(data)
-            size = len(view)
-            offset = 0
-            while offset < size:
-                _, ready_to_write, _ = select((), (self,), (), timeout)
-                while not ready_to_write:
-                    _, ready_to_write, _ = select((), (self,), (), timeout)
-                sent = raw_send(view[offset:])
-                if sent == 0:
-                    raise SocketError("Peer closed connection")
-                offset += sent
+            while view:
+                view = view[os.write(self.fd, view):]
+        self._wrote(len(data))
+
+    def rewind(self):
+        # Discard all content written so far, ready to start again
+        if self.position is None:
+            raise IOError("Cannot rewind an unseekable file")
+        if self.fd is None:
+            self.file.seek(self.position)
+            self.file.truncate()
+        else:
+            os.ftruncate(self.fd, self.position)
+            os.lseek(self.fd, self.position, os.SEEK_SET)
+        with self._lock:
+            self.written = 0
+
+    def write_at(self, data, offset):
+        # Write `data` at `offset` bytes from the start position, leaving
+        # the file position unchanged
+        view = memoryview(data)
+        offset += self.position
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+        self._wrote(len(data))
+
+    def close(self, fsync=False):
+        try:
+            if fsync:
+                if self.fd is None:
+                    self.file.flush()
+                else:
+                    os.fsync(self.fd)
+        finally:
+            if self.opened:
+                self.file.close()
 
-        raw_recv = self.recv
-        received = [b""]  # the functions below assume exactly one item in this list on entry and exit
 
-        def recv_headers(timeout=0):
-            end = received[0].find(b"\r\n\r\n")
-            while end == -1:
-                ready_to_read, _, _ = select((self,), (), (), timeout)
-                while not ready_to_read:
-                    ready_to_read, _, _ = select((self,), (), (), timeout)
-                data = raw_recv(8192)
-                received[0] += data
-                end = received[0].find(b"\r\n\r\n")
-                if data == b"" and end == -1:
-                    raise SocketError("Peer closed connection")
-            data, received[0] = received[0][:end], received[0][(end + 4):]
-            return data.split(b"\r\n")
+def not_implemented(*args, **kwargs):
+    raise NotImplementedError()
 
-        def recv_content(length=None, timeout=0):
-            if length is None:
-                # receive until closed
-                if received[0]:
-                    yield received[0]
-                    received[0] = b""
-                more = True
-                while more:
-                    ready_to_read, _, _ = select((self,), (), (), timeout)
-                    while not ready_to_read:
-                        ready_to_read, _, _ = select((self,), (), (), timeout)
-                    data = raw_recv(8192)
-                    if data == b"":
-                        more = False
-                    else:
-                        yield data
-            else:
-                assert length >= 0
-                # receive fixed amount
-                while length != 0:
-                    data, received[0] = received[0][:length], received[0][length:]
-                    size = len(data)
-                    if size != 0:
-                        yield data
-                        length -= size
-                    if length != 0:
-                        ready_to_read, _, _ = select((self,), (), (), timeout)
-                        while not ready_to_read:
-                            ready_to_read, _, _ = select((self,), (), (), timeout)
-                        data = raw_recv(8192)
-                        if data == b"":
-                            raise SocketError("Peer closed connection")
-                        received[0] += data
-
-        def recv_line(timeout=0):
-            end = received[0].find(b"\r\n")
-            while end == -1:
-                ready_to_read, _, _ = select((self,), (), (), timeout)
-                while not ready_to_read:
-                    ready_to_read, _, _ = select((self,), (), (), timeout)
-                data = raw_recv(8192)
-                received[0] += data
-                end = received[0].find(b"\r\n")
-                if data == b"" and end == -1:
-                    raise SocketError("Peer closed connection")
-            data, received[0] = received[0][:end], received[0][(end + 2):]
-            return data
 
-        def recv_exact(length, timeout=0):
-            available = len(received[0])
-            while available < length:
-                ready_to_read, _, _ = select((self,), (), (), timeout)
-                while not ready_to_read:
-                    ready_to_read, _, _ = select((self,), (), (), timeout)
-                data = raw_recv(8192)
-                received[0] += data
-                available += len(data)
-                if data == b"" and available < length:
-                    raise SocketError("Peer closed connection")
-            data, received[0] = received[0][:length], received[0][length:]
-            return data
+class ReceiveBuffer(object):
+    """ Holds data that has been received but not yet consumed, within a
+    single bytearray. New data is received straight into the free space at
+    the end (see :meth:`get_buffer` and :meth:`buffer_updated`) and is
+    consumed from the front. Space is reclaimed by rewinding once all data
+    has been consumed or, if more room is needed, by moving the unconsumed
+    remainder to the front. Appending never copies existing data.
+    """
 
-        def recv_chunked_content(timeout=0):
-            chunk_size = -1
-            while chunk_size != 0:
-                chunk_size = int(recv_line(timeout=timeout), 16)
-                if chunk_size != 0:
-                    yield recv_exact(chunk_size, timeout=timeout)
-                recv_exact(2, timeout=timeout)
+    __slots__ = ["_data", "_view", "_start", "_end"]
 
-        self.send_x = send_x
-        self.recv_headers = recv_headers
-        self.recv_content = recv_content
-        self.recv_chunked_content = recv_chunked_content
+    def __init__(self, capacity=MIN_RECV_SIZE):
+        self._data = bytearray(capacity)
+        self._view = memoryview(self._data)
+        self._start = 0
+        self._end = 0
 
-    def close(self):
-        socket.close(self)
-        self.send_x = not_implemented
-        self.recv_headers = not_implemented
-        self.recv_content = not_implemented
-        self.recv_chunked_content = not_implemented
+    def __len__(self):
+        return self._end - self._start
 
+    def get_buffer(self, size):
+        """ Return a writable view of at least `size` bytes of free space.
+        """
+        start, end = self._start, self._end
+        if start == end:
+            start = end = self._start = self._end = 0
+            if len(self._data) > MAX_RECV_SIZE >= size:
+                self._data = bytearray(MIN_RECV_SIZE if size <= MIN_RECV_SIZE else size)
+                self._view = memoryview(self._data)
+        capacity = len(self._data)
+        if capacity - end < size:
+            used = end - start
+            if capacity - used >= size:
+                self._view[:used] = self._view[start:end]
+            else:
+                data = bytearray(max(2 * capacity, used + size))
+                data[:used] = self._view[start:end]
+                self._data = data
+                self._view = memoryview(data)
+            self._start, self._end = 0, used
+        return self._view[self._end:]
+
+    def buffer_updated(self, size):
+        """ Mark `size` bytes, written into the view returned by
+        :meth:`get_buffer`, as received.
+        """
+        self._end += size
 
-class HTTP(object):
+    def find(self, sub, offset=0):
+        """ Return the offset of `sub` within the unconsumed data, starting
+        the search `offset` bytes in, or -1 if not found.
+        """
+        start = self._start
+        p = self._data.find(sub, start + offset, self._end)
+        return p if p == -1 else p - start
 
-    #: The default port for HTTP traffic.
-    DEFAULT_PORT = 80
+    def read(self, size):
+        """ Consume and return up to `size` bytes.
+        """
+        start = self._start
+        end = min(start + size, self._end)
+        self._start = end
+        return self._view[start:end].tobytes()
 
-    _socket = None
-    _user_info = None
-    _host = None
-    _port = None
-    _connection_headers = {}
+    def peek(self, size):
+        """ Return up to `size` bytes without consuming them.
+        """
+        start = self._start
+        return self._view[start:min(start + size, self._end)].tobytes()
 
-    _writable = False
-    _requests = []
+    def readinto(self, b):
+        """ Consume data into the writable buffer `b`, returning the number
+        of bytes copied.
+        """
+        start = self._start
+        size = min(len(b), self._end - start)
+        end = start + size
+        b[:size] = self._view[start:end]
+        self._start = end
+        return size
+
+    def skip(self, size):
+        """ Consume and discard up to `size` bytes.
+        """
+        self._start = min(self._start + size, self._end)
 
-    _receiver = None
-    _version = None
-    _status_code = None
-    _reason = None
-    _response_headers = {}
-    _offset = 0     # read offset for content
-    _raw_content = b""
-    _typed_content = None
-    _content_type = None
-    _encoding = None
 
-    def __init__(self, authority=None, **headers):
-        self._connection_headers = {}
-        self._requests = []
-        self._response_headers = {}
-        if authority:
-            self.connect(authority)
-        if headers:
-            self._add_connection_headers(**headers)
+# Response parser states
+EXPECT_NOTHING = 0
+EXPECT_HEAD = 1
+EXPECT_SIZED_DATA = 2
+EXPECT_CHUNK_HEAD = 3
+EXPECT_CHUNK_DATA = 4
+EXPECT_CHUNK_END = 5
+EXPECT_TRAILER = 6
+EXPECT_DATA_UNTIL_CLOSED = 7
+EXPECT_END = 8
 
-    def __del__(self):
-        try:
-            self.close()
-        except socket_error:
-            pass
+#: Parser event: more data must be fed in before parsing can continue.
+NEED_DATA = object()
 
-    def __repr__(self):
-        params = [b"HTTP"]
-        try:
-            host = self._connection_headers[b"Host"]
-        except KeyError:
-            pass
-        else:
-            params.append(host)
-            for i, (method, url, _) in enumerate(self._requests):
-                if i == 0 and self.readable():
-                    params.append(b"(" + method + b" " + url + b")->(" + bstr(self.status_code) + b")")
-                else:
-                    params.append(b"(" + method + b" " + url + b")->()")
-        if sys.version_info >= (3,):
-            return "<%s>" % " ".join(param.decode("UTF-8") for param in params)
-        else:
-            return "<%s>" % b" ".join(params)
+#: Parser event: the end of the current response has been reached.
+END_OF_MESSAGE = object()
 
-    def __enter__(self):
-        return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        # finish reading or writing
-        pass
+class ResponseHead(object):
+    """ Parser event carrying the status line and headers of a response,
+    along with the framing of any content that follows (one of
+    :const:`READ_CHUNKED`, :const:`READ_SIZED` and :const:`READ_UNTIL_CLOSED`,
+    or :const:`None` if no content follows).
+    """
 
-    def _add_connection_headers(self, **headers):
-        for name, value in headers.items():
-            try:
-                name = REQUEST_HEADERS[name]
-            except KeyError:
-                name = bstr(name).replace(b"_", b"-").title()
-            if not isinstance(value, bytes):
-                value = bstr(value)
-            self._connection_headers[name] = value
+    __slots__ = ["version", "status_code", "reason", "headers", "framing", "content_length"]
 
-    def _connect(self, host, port):
-        self._socket = HTTPSocket()
-        self._socket.connect((host, port))
-        self._received = b""
-        del self._requests[:]
+    def __init__(self, version, status_code, reason, headers, framing, content_length):
+        self.version = version
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.framing = framing
+        self.content_length = content_length
 
-    def connect(self, authority, **headers):
-        """ Establish a connection to a remote host.
 
-        :param authority: the URI authority to which to connect
-        :param headers: headers to pass into each request for this connection
-        """
-        user_info, host, port = parse_uri_authority(authority)
+class Trailers(object):
+    """ Parser event carrying the headers that follow chunked content.
+    """
 
-        # Reset connection attributes and headers
-        connection_headers = self._connection_headers
-        connection_headers.clear()
-        if user_info:
-            connection_headers[b"Authorization"] = basic_auth(user_info)
-        if port:
-            connection_headers[b"Host"] = host + b":" + bstr(port)
-        else:
-            connection_headers[b"Host"] = host
+    __slots__ = ["headers"]
 
-        if headers:
-            self._add_connection_headers(**headers)
+    def __init__(self, headers):
+        self.headers = headers
 
-        self._user_info = user_info
-        self._host = host
-        self._port = port or self.DEFAULT_PORT
 
-        self._connect(self._host, self._port)
+def parse_header_lines(header_lines, headers):
+    # Add each "Key: value" line to the headers dictionary, returning the
+    # dictionary. Keys are title-cased and leading space is removed from
+    # values.
+    for header_line in header_lines:
+        if __debug__:
+            log_write((b"< ", header_line))
+        delimiter = header_line.find(b":")
+        key = header_line[:delimiter].title()
+        p = delimiter + 1
+        while header_line[p] == SPACE:
+            p += 1
+        headers[key] = header_line[p:]
+    return headers
+
+
+class ResponseParser(object):
+    """ Incremental HTTP/1.1 response parser that carries out no I/O of its
+    own, so that the same parser can sit behind any transport. Received
+    data is pushed in with :meth:`feed`, or written straight into
+    :attr:`buffer`, and parsed by calling :meth:`next_event` until it
+    returns :const:`NEED_DATA`. Events are returned in the order:
+
+    - a :class:`ResponseHead`
+    - zero or more pieces of content, as byte strings
+    - :class:`Trailers`, if any follow chunked content
+    - :const:`END_OF_MESSAGE`
+
+    Each response must be announced with :meth:`start` (or, to parse bare
+    content, :meth:`start_content`). Content is only copied once, out of
+    the buffer; larger pieces can bypass the buffer altogether by being
+    received straight into the caller's memory (see :meth:`direct`).
+    """
+
+    __slots__ = ["buffer", "_state", "_no_content", "_remaining", "_scanned", "_trailers", "_eof"]
 
-    def reconnect(self):
-        """ Re-establish a connection to the same remote host.
+    def __init__(self):
+        #: The :class:`ReceiveBuffer` holding data not yet parsed.
+        self.buffer = ReceiveBuffer()
+        self._state = EXPECT_NOTHING
+        self._no_content = False
+        self._remaining = 0     # bytes left in sized content or the current chunk
+        self._scanned = 0       # bytes already searched for the next delimiter
+        self._trailers = None
+        self._eof = False
+
+    def start(self, no_content=False):
+        """ Expect the head of a response next. If `no_content` is true, as
+        it is for a response to a HEAD request, no content will be parsed
+        after the head, whatever its headers declare.
         """
-        if self._socket:
-            self._socket.shutdown(SHUT_RDWR)
-            self._socket.close()
-        self._connect(self._host, self._port)
-
-    def close(self):
-        """ Close the current connection.
+        self._state = EXPECT_HEAD
+        self._no_content = no_content
+        self._scanned = 0
+
+    def start_content(self, framing, length=None):
+        """ Expect content next, without a head, framed as either
+        :const:`READ_CHUNKED`, :const:`READ_SIZED` (with `length` bytes)
+        or :const:`READ_UNTIL_CLOSED`.
         """
-        if self._socket:
-            self._socket.shutdown(SHUT_RDWR)
-            self._socket.close()
-        self._socket = None
-        del self._requests[:]
+        if framing is READ_CHUNKED:
+            self._state = EXPECT_CHUNK_HEAD
+            self._scanned = 0
+        elif framing is READ_SIZED:
+            assert length >= 0
+            self._state = EXPECT_SIZED_DATA
+            self._remaining = length
+        else:
+            self._state = EXPECT_DATA_UNTIL_CLOSED
 
-        self._connection_headers.clear()
+    def feed(self, data):
+        """ Add received data to the buffer. An empty byte string signals
+        that the peer has closed the connection.
+        """
+        size = len(data)
+        if size:
+            buffer = self.buffer
+            buffer.get_buffer(size)[:size] = data
+            buffer.buffer_updated(size)
+        else:
+            self._eof = True
 
     @property
-    def host(self):
-        """ The remote host to which this client is connected.
+    def remaining(self):
+        """ Number of bytes of sized content still to be parsed, or
+        :const:`None` if the content is not sized.
         """
-        return self._connection_headers[b"Host"]
+        if self._state == EXPECT_SIZED_DATA:
+            return self._remaining
+        return None
+
+    def direct(self):
+        """ Return the number of content bytes that may be received straight
+        into the caller's memory, bypassing the buffer, and then reported
+        with :meth:`content_received`. This is zero unless content is
+        expected next and the buffer is empty, or -1 for content that runs
+        until the connection closes.
+        """
+        if self.buffer or self._eof:
+            return 0
+        state = self._state
+        if state == EXPECT_SIZED_DATA or state == EXPECT_CHUNK_DATA:
+            return self._remaining
+        elif state == EXPECT_DATA_UNTIL_CLOSED:
+            return -1
+        return 0
+
+    def content_received(self, size):
+        """ Account for `size` bytes of content received directly, where zero
+        signals that the peer has closed the connection.
+        """
+        if size == 0:
+            self._eof = True
+        elif self._state != EXPECT_DATA_UNTIL_CLOSED:
+            self._remaining -= size
 
-    def request(self, method, url, body=None, **headers):
-        """ Make or initiate a request to the remote host.
+    def readinto(self, b):
+        """ Copy buffered content into the writable buffer `b`, returning the
+        number of bytes copied. If none is available, zero is returned and
+        :meth:`next_event` should be called instead.
+        """
+        state = self._state
+        if state == EXPECT_SIZED_DATA or state == EXPECT_CHUNK_DATA:
+            remaining = self._remaining
+            if len(b) > remaining:
+                b = b[:remaining]
+            size = self.buffer.readinto(b)
+            self._remaining = remaining - size
+            return size
+        elif state == EXPECT_DATA_UNTIL_CLOSED:
+            return self.buffer.readinto(b)
+        return 0
+
+    def next_event(self, max_size=MAX_RECV_SIZE):
+        """ Parse and return the next event. Content is returned in pieces of
+        no more than `max_size` bytes.
+        """
+        buffer = self.buffer
+        while True:
+            state = self._state
+            if state == EXPECT_SIZED_DATA or state == EXPECT_CHUNK_DATA:
+                remaining = self._remaining
+                if remaining == 0:
+                    if state == EXPECT_SIZED_DATA:
+                        self._state = EXPECT_NOTHING
+                        return END_OF_MESSAGE
+                    self._state = EXPECT_CHUNK_END
+                elif buffer:
+                    data = buffer.read(min(remaining, max_size))
+                    self._remaining = remaining - len(data)
+                    return data
+                else:
+                    return self._need_data()
+            elif state == EXPECT_DATA_UNTIL_CLOSED:
+                if buffer:
+                    return buffer.read(max_size)
+                elif self._eof:
+                    self._state = EXPECT_NOTHING
+                    return END_OF_MESSAGE
+                else:
+                    return NEED_DATA
+            elif state == EXPECT_CHUNK_END:
+                if len(buffer) < 2:
+                    return self._need_data()
+                buffer.skip(2)
+                self._state = EXPECT_CHUNK_HEAD
+            elif state == EXPECT_CHUNK_HEAD:
+                line = self._read_until(b"\r\n")
+                if line is None:
+                    return self._need_data()
+                p = line.find(b";")
+                chunk_size = int(line if p == -1 else line[:p], 16)
+                if chunk_size:
+                    self._state = EXPECT_CHUNK_DATA
+                    self._remaining = chunk_size
+                else:
+                    self._state = EXPECT_TRAILER
+                    self._trailers = []
+            elif state == EXPECT_TRAILER:
+                line = self._read_until(b"\r\n")
+                if line is None:
+                    return self._need_data()
+                elif line:
+                    self._trailers.append(line)
+                else:
+                    trailers, self._trailers = self._trailers, None
+                    if trailers:
+                        self._state = EXPECT_END
+                        return Trailers(parse_header_lines(trailers, {}))
+                    self._state = EXPECT_NOTHING
+                    return END_OF_MESSAGE
+            elif state == EXPECT_HEAD:
+                data = self._read_until(b"\r\n\r\n")
+                if data is None:
+                    return self._need_data()
+                return self._parse_head(data.split(b"\r\n"))
+            else:
+                self._state = EXPECT_NOTHING
+                return END_OF_MESSAGE
+
+    def _need_data(self):
+        if self._eof:
+            raise SocketError("Peer closed connection")
+        return NEED_DATA
+
+    def _read_until(self, delimiter):
+        # Consume and return data up to `delimiter`, or None if the delimiter
+        # has not yet been received
+        buffer = self.buffer
+        end = buffer.find(delimiter, self._scanned)
+        if end == -1:
+            self._scanned = max(len(buffer) - len(delimiter) + 1, 0)
+            return None
+        self._scanned = 0
+        data = buffer.read(end)
+        buffer.skip(len(delimiter))
+        return data
 
-        For simple (non-chunked) requests, pass the `method`, `url` and
-        `body` plus any extra `headers`, if required. An empty body can
-        be specified by passing :code:`b''` as the `body` argument::
+    def _parse_head(self, header_lines):
+        status_line = header_lines.pop(0)
+        if __debug__:
+            log_write((b"< ", status_line))
 
-        >>> http.request(b'GET', '/foo/1', b'')
+        # HTTP version
+        p = status_line.find(b" ")
+        version = status_line[:p]
 
-        >>> http.request(b'POST', '/foo/', {"foo": "bar"})
+        # Status code
+        p += 1
+        q = status_line.find(b" ", p)
+        status_code = STATUS_CODES[status_line[p:q]]
 
-        Chunked requests can be initiated by passing :const:`None` to
-        the `body` argument (either explicitly or using the default
+        # Reason phrase
+        reason = status_line[(q + 1):]
+
+        headers = parse_header_lines(header_lines, {})
+
+        # Content framing
+        content_length = None
+        if self._no_content or status_code in NO_CONTENT_STATUS_CODES:
+            framing = None
+            self._state = EXPECT_END
+        elif headers.get(b"Transfer-Encoding") == b"chunked":
+            framing = READ_CHUNKED
+            self._state = EXPECT_CHUNK_HEAD
+        elif b"Content-Length" in headers:
+            try:
+                content_length = int(headers[b"Content-Length"])
+            except (TypeError, ValueError):
+                raise RuntimeError("Unparseable content length %r" % headers[b"Content-Length"])
+            framing = READ_SIZED
+            self._state = EXPECT_SIZED_DATA
+            self._remaining = content_length
+        else:
+            framing = READ_UNTIL_CLOSED
+            self._state = EXPECT_DATA_UNTIL_CLOSED
+
+        return ResponseHead(version, status_code, reason, headers, framing, content_length)
+
+
+class ContentDecoder(object):
+    """ Incremental decoder for content with a Content-Encoding of gzip,
+    deflate or (where the standard library provides it) zstd. Compressed
+    data is passed in as it is received and decoded output is returned in
+    pieces of limited size, so that content need never be fully decoded
+    in memory. This class carries out no I/O of its own.
+
+    If `max_ratio` is given, an :class:`IOError` is raised once more than
+    :const:`MAX_RECV_SIZE` bytes have been decoded at a ratio of decoded
+    to compressed size greater than `max_ratio`.
+    """
+
+    __slots__ = ["encoding", "max_ratio", "_decompressor", "_received", "_decoded"]
+
+    def __init__(self, encoding, max_ratio=None):
+        if encoding not in CONTENT_ENCODINGS:
+            raise ValueError("Unsupported content encoding %r" % encoding)
+        self.encoding = encoding
+        self.max_ratio = max_ratio
+        if encoding == b"zstd":
+            self._decompressor = zstd.ZstdDecompressor()
+        elif encoding == b"gzip":
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = None   # zlib or raw deflate, decided by the first data
+        self._received = 0
+        self._decoded = 0
+
+    def _output(self, data):
+        self._decoded += len(data)
+        max_ratio = self.max_ratio
+        if max_ratio is not None and self._decoded > MAX_RECV_SIZE and self._decoded > max_ratio * self._received:
+            raise IOError("Content decodes to more than %s times its compressed size" % max_ratio)
+        return data
+
+    def decode(self, data, size):
+        """ Pass in compressed `data` and return up to `size` bytes of
+        decoded output, which may be empty if more data is needed.
+        """
+        self._received += len(data)
+        decompressor = self._decompressor
+        try:
+            if decompressor is None:
+                # Most servers send zlib data for deflate, but some send raw deflate data
+                decompressor = self._decompressor = zlib.decompressobj()
+                try:
+                    return self._output(decompressor.decompress(data, size))
+                except zlib.error:
+                    decompressor = self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            if self.encoding == b"zstd" and decompressor.eof:
+                return b""
+            return self._output(decompressor.decompress(data, size))
+        except (zlib.error, EOFError) + ((zstd.ZstdError,) if zstd else ()) as error:
+            raise IOError("Invalid %s content (%s)" % (self.encoding.decode("ASCII"), error))
+
+    def more(self, size):
+        """ Return up to `size` bytes of output still held from data passed
+        in earlier, or :code:`b""` if more data is needed.
+        """
+        decompressor = self._decompressor
+        if decompressor is None:
+            return b""
+        if self.encoding == b"zstd":
+            if decompressor.needs_input or decompressor.eof:
+                return b""
+            return self._output(decompressor.decompress(b"", size))
+        tail = decompressor.unconsumed_tail
+        if not tail:
+            return b""
+        return self._output(decompressor.decompress(tail, size))
+
+    def flush(self):
+        """ Return any output left once all data has been passed in.
+        """
+        decompressor = self._decompressor
+        if decompressor is None or self.encoding == b"zstd":
+            return b""
+        return self._output(decompressor.flush())
+
+
+class ContentEncoder(object):
+    """ Incremental encoder for request content, with a Content-Encoding of
+    gzip or (where the standard library provides it) zstd. This class
+    carries out no I/O of its own.
+    """
+
+    __slots__ = ["encoding", "_compressor"]
+
+    def __init__(self, encoding):
+        if encoding == b"gzip":
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == b"zstd" and zstd:
+            self._compressor = zstd.ZstdCompressor()
+        else:
+            raise ValueError("Unsupported content encoding %r" % encoding)
+        self.encoding = encoding
+
+    def encode(self, data):
+        """ Pass in `data` and return whatever encoded output is ready, which
+        may be empty.
+        """
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """ Return the remainder of the encoded output, ending the content.
+        """
+        return self._compressor.flush()
+
+
+JSON_WHITESPACE = re.compile(b"[ \t\r\n]*")
+JSON_SCALAR = re.compile(br'[^ \t\r\n,:\[\]{}"]*')
+JSON_SKIP = re.compile(br'(?:[^\[\]{}"]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.S)
+JSON_SKIP_ITEM = re.compile(br'(?:[^\[\]{}",]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.S)
+JSON_STRING_BODY = re.compile(br'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+JSON_MAX_ITEM_DEPTH = 4
+
+if sys.version_info >= (3, 11):
+    # Possessive quantifiers let a whole run of items, each followed by a
+    # comma and nested no deeper than JSON_MAX_ITEM_DEPTH, be matched in
+    # one go without the backtracking that would otherwise blow up on an
+    # incomplete final item
+    def _json_items_pattern():
+        string = br'"[^"\\]*+(?:\\.[^"\\]*+)*+"'
+        nested = br'(?:[^\[\]{}"]++|' + string + br')*+'
+        for _ in range(JSON_MAX_ITEM_DEPTH - 1):
+            nested = br'(?:[^\[\]{}"]++|' + string + br'|[\[{]' + nested + br'[\]}])*+'
+        return br'(?:(?:[^\[\]{}",]++|' + string + br'|[\[{]' + nested + br'[\]}])*+,)*+'
+
+    JSON_ITEMS = re.compile(_json_items_pattern(), re.S)
+else:
+    JSON_ITEMS = None
+
+
+class JSONArraySplitter(object):
+    """ Incremental splitter for a JSON document, picking out the items of
+    the array found at `path`: a sequence of object keys and array
+    indexes leading from the top of the document, e.g.
+    :code:`("results", 0, "data")`. The document is passed in as it is
+    received and the text of each run of completed items is returned,
+    separated by commas, so that a whole run can be parsed as one array.
+    Nothing outside the array is kept, and nothing after it is examined.
+    This class carries out no I/O and decodes nothing itself.
+    """
+
+    __slots__ = ["path", "_buffer", "_pos", "_state", "_stack", "_on_path", "_depth", "_start", "_resume"]
+
+    def __init__(self, path=()):
+        self.path = tuple(path)
+        self._buffer = bytearray()
+        self._pos = 0           # scan position within _buffer
+        self._state = "value"
+        self._stack = []        # for each container entered: an array index, or None for an object
+        self._on_path = True    # whether the value expected next lies on the path
+        self._depth = 0         # nesting within a value being skipped or an item being scanned
+        self._start = None      # start of the items not yet returned
+        self._resume = None     # where to resume scanning an incomplete string, if at one
+
+    @property
+    def found(self):
+        """ Whether the array at `path` has been found.
+        """
+        return self._start is not None or self._state == "end"
+
+    def feed(self, data):
+        """ Pass in the next piece of the document and return the text of
+        any items it completes, which may be empty.
+        """
+        state = self._state
+        if state in ("done", "end"):
+            return b""
+        # Drop what has been dealt with, in place, so that the text of a
+        # large item is not copied again as each piece of it arrives
+        buffer = self._buffer
+        keep = self._pos if self._start is None else self._start
+        if keep:
+            del buffer[:keep]
+            self._pos -= keep
+            if self._start is not None:
+                self._start -= keep
+            if self._resume is not None:
+                self._resume -= keep
+        buffer += data
+        while state != "items":
+            if not self._step():
+                return b""
+            state = self._state
+            if state == "done":
+                del buffer[:]
+                return b""
+        return self._split()
+
+    def close(self):
+        """ Signal the end of the document, raising :class:`ValueError` if
+        it ended partway through the array.
+        """
+        if self._state == "items":
+            raise ValueError("JSON document ended inside the array")
+
+    def _step(self):
+        # Move towards the array by one token (or one skipped value),
+        # returning False if more data is needed to do so
+        buffer = self._buffer
+        pos = self._pos = JSON_WHITESPACE.match(buffer, self._pos).end()
+        if pos == len(buffer):
+            return False
+        state = self._state
+        stack = self._stack
+        c = buffer[pos:(pos + 1)]
+        if state == "skip":
+            end = self._skip(pos)
+            if end is None:
+                return False
+            self._pos = end
+            self._state = "next"
+        elif state == "value":
+            if not self._on_path:
+                self._state = "skip"
+                return True
+            path = self.path
+            level = len(stack)
+            if level == len(path):
+                if c == b"[":
+                    self._pos = self._start = pos + 1
+                    self._state = "items"
+                else:
+                    self._state = "done"
+            elif isinstance(path[level], int) and c == b"[":
+                stack.append(0)
+                self._on_path = path[level] == 0
+                self._pos = pos + 1
+                self._state = "first"
+            elif not isinstance(path[level], int) and c == b"{":
+                stack.append(None)
+                self._pos = pos + 1
+                self._state = "key"
+            else:
+                self._state = "done"
+        elif state == "first":
+            # First item of an array, if not empty
+            self._state = "done" if c == b"]" else "value"
+        elif state == "key":
+            if c == b"}":
+                self._state = "done"
+            elif c == b'"':
+                end = self._string_end(pos)
+                if end is None:
+                    return False
+                key = json_loads(buffer[pos:end].decode("UTF-8"))
+                self._on_path = key == self.path[len(stack) - 1]
+                self._pos = end
+                self._state = "colon"
+            else:
+                raise ValueError("Invalid JSON at %r" % buffer[pos:(pos + 20)])
+        elif state == "colon":
+            if c != b":":
+                raise ValueError("Invalid JSON at %r" % buffer[pos:(pos + 20)])
+            self._pos = pos + 1
+            self._state = "value"
+        elif c == b",":
+            # state == "next"
+            self._pos = pos + 1
+            if stack[-1] is None:
+                self._state = "key"
+            else:
+                index = stack[-1] = stack[-1] + 1
+                self._on_path = index == self.path[len(stack) - 1]
+                self._state = "value"
+        elif c in (b"]", b"}"):
+            # The container on the path ended without the array being found
+            self._state = "done"
+        else:
+            raise ValueError("Invalid JSON at %r" % buffer[pos:(pos + 20)])
+        return True
+
+    def _string_end(self, pos):
+        # Return the end of the string that starts at `pos`, or None if more
+        # data is needed to find it, in which case scanning resumes from
+        # where it left off on the next call
+        buffer = self._buffer
+        resume = self._resume
+        end = JSON_STRING_BODY.match(buffer, pos + 1 if resume is None else resume).end()
+        if buffer[end:(end + 1)] == b'"':
+            self._resume = None
+            return end + 1
+        self._resume = end
+        return None
+
+    def _skip(self, pos):
+        # Return the end of the value that starts (or resumes) at `pos`, or
+        # None if more data is needed to find it
+        buffer = self._buffer
+        depth = self._depth
+        if not depth:
+            c = buffer[pos:(pos + 1)]
+            if c == b'"':
+                return self._string_end(pos)
+            elif c not in (b"[", b"{"):
+                end = JSON_SCALAR.match(buffer, pos).end()
+                if end == pos:
+                    raise ValueError("Invalid JSON at %r" % buffer[pos:(pos + 20)])
+                return None if end == len(buffer) else end
+        size = len(buffer)
+        resuming = self._resume is not None
+        while True:
+            if resuming:
+                resuming = False
+            elif depth:
+                pos = JSON_SKIP.match(buffer, pos).end()
+            if pos == size:
+                self._pos = pos
+                self._depth = depth
+                return None
+            c = buffer[pos:(pos + 1)]
+            if c == b'"':
+                # A string left incomplete by the pattern above
+                end = self._string_end(pos)
+                if end is None:
+                    self._pos = pos
+                    self._depth = depth
+                    return None
+                pos = end
+                continue
+            depth += 1 if c in (b"[", b"{") else -1
+            pos += 1
+            if not depth:
+                self._depth = 0
+                return pos
+
+    def _split(self):
+        # Scan the items of the array, returning the text of those completed
+        buffer = self._buffer
+        size = len(buffer)
+        pos = self._pos
+        depth = self._depth
+        cut = None
+        resuming = self._resume is not None
+        while True:
+            if resuming:
+                resuming = False
+            elif depth:
+                pos = JSON_SKIP.match(buffer, pos).end()
+            else:
+                if JSON_ITEMS is not None:
+                    end = JSON_ITEMS.match(buffer, pos).end()
+                    if end > pos:
+                        cut = end - 1
+                        pos = end
+                pos = JSON_SKIP_ITEM.match(buffer, pos).end()
+            if pos == size:
+                break
+            c = buffer[pos:(pos + 1)]
+            if c == b'"':
+                # A string left incomplete by the patterns above
+                end = self._string_end(pos)
+                if end is None:
+                    break
+                pos = end
+                continue
+            elif c == b",":
+                cut = pos
+            elif c in (b"[", b"{"):
+                depth += 1
+            elif depth:
+                depth -= 1
+            else:
+                # The end of the array
+                cut = pos
+                self._state = "end"
+                pos += 1
+                break
+            pos += 1
+        self._pos = pos
+        self._depth = depth
+        if cut is None:
+            return b""
+        items = bytes(buffer[self._start:cut])
+        self._start = cut + 1
+        if self._state == "end":
+            del buffer[:]
+            self._start = None
+        return items
+
+
+LINE_BREAK = re.compile(b"\r\n|\r|\n")
+
+
+class ServerSentEvent(object):
+    """ An event received from a :code:`text/event-stream`.
+    """
+
+    __slots__ = ["event", "data", "id"]
+
+    def __init__(self, event, data, id):
+        #: The event type, :code:`"message"` unless the stream named one.
+        self.event = event
+        #: The event data, with the lines of multi-line data joined by
+        #: :code:`"\\n"`.
+        self.data = data
+        #: The last event ID set by the stream when the event arrived.
+        self.id = id
+
+    def __repr__(self):
+        return "<ServerSentEvent %s id=%r data=%r>" % (self.event, self.id, self.data)
+
+
+class EventStreamParser(object):
+    """ Incremental parser for :code:`text/event-stream` content, as used
+    by Server-Sent Events. Content is passed in as it is received and
+    each event is returned as soon as the blank line ending it arrives.
+    The last event ID and any reconnection time set by the stream are
+    tracked across connections. This class carries out no I/O.
+    """
+
+    __slots__ = ["last_event_id", "retry", "_pending", "_cr", "_start", "_event", "_data"]
+
+    def __init__(self, last_event_id=""):
+        #: The last event ID set by the stream, to send on reconnection.
+        self.last_event_id = last_event_id
+        #: The reconnection time in milliseconds set by the stream, if any.
+        self.retry = None
+        self._pending = []      # pieces of an incomplete line
+        self._cr = False        # whether the last data passed in ended with CR
+        self._start = True      # whether at the start of the stream, where a BOM may appear
+        self._event = None
+        self._data = []
+
+    def feed(self, data):
+        """ Pass in the next piece of content and return a list of the
+        events it completes, which may be empty.
+        """
+        if self._start:
+            if self._pending:
+                data = b"".join(self._pending) + data
+                del self._pending[:]
+            if len(data) < 3 and b"\xef\xbb\xbf".startswith(data):
+                # Too little to tell whether a BOM is present
+                self._pending.append(data)
+                return []
+            if data.startswith(b"\xef\xbb\xbf"):
+                data = data[3:]
+            self._start = False
+        if self._cr and data[:1] == b"\n":
+            # The second half of a CRLF split between pieces
+            data = data[1:]
+        self._cr = data[-1:] == b"\r"
+        lines = LINE_BREAK.split(data)
+        pending = self._pending
+        if pending:
+            pending.append(lines[0])
+            lines[0] = b"".join(pending)
+            del pending[:]
+        last = lines.pop()
+        if last:
+            pending.append(last)
+        events = []
+        for line in lines:
+            if line:
+                self._field(line)
+            elif self._data:
+                data = b"\n".join(self._data).decode("UTF-8", "replace")
+                event = self._event.decode("UTF-8", "replace") if self._event else "message"
+                events.append(ServerSentEvent(event, data, self.last_event_id))
+                self._event = None
+                del self._data[:]
+            else:
+                self._event = None
+        return events
+
+    def _field(self, line):
+        # Process a non-blank line
+        name, colon, value = line.partition(b":")
+        if not name:
+            return  # comment
+        if value[:1] == b" ":
+            value = value[1:]
+        if name == b"data":
+            self._data.append(value)
+        elif name == b"event":
+            self._event = value
+        elif name == b"id":
+            if b"\x00" not in value:
+                self.last_event_id = value.decode("UTF-8", "replace")
+        elif name == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+
+    def reset(self):
+        """ Discard any incomplete line or event, as when a connection ends.
+        The last event ID and reconnection time are kept.
+        """
+        del self._pending[:]
+        del self._data[:]
+        self._event = None
+        self._cr = False
+        self._start = True
+
+
+class WebSocketParser(object):
+    """ Incremental parser for WebSocket frames (RFC 6455). Frames are
+    parsed straight out of a :class:`ReceiveBuffer`, which may be the one
+    left behind by the :class:`ResponseParser` that read a 101 response,
+    so that frames arriving along with the handshake are not lost. Each
+    call to :meth:`next_frame` returns a complete frame or
+    :const:`NEED_DATA`. This class carries out no I/O.
+    """
+
+    __slots__ = ["buffer"]
+
+    def __init__(self, buffer=None):
+        #: The :class:`ReceiveBuffer` holding data not yet parsed.
+        self.buffer = ReceiveBuffer() if buffer is None else buffer
+
+    def feed(self, data):
+        """ Add received data to the buffer.
+        """
+        size = len(data)
+        if size:
+            buffer = self.buffer
+            buffer.get_buffer(size)[:size] = data
+            buffer.buffer_updated(size)
+
+    def next_frame(self, max_size=MAX_WEBSOCKET_MESSAGE_SIZE):
+        """ Parse the next frame, returning a tuple of (fin, opcode,
+        payload), with the payload unmasked, or :const:`NEED_DATA` if the
+        whole frame has not yet been received.
+
+        :param max_size: largest payload to accept, checked as soon as the
+                         frame length is known so that nothing more of an
+                         oversized frame need be received
+        :raise IOError: if reserved bits are set, as no extensions are
+                        supported
+        :raise MessageTooBig: if the payload exceeds `max_size`
+        """
+        buffer = self.buffer
+        available = len(buffer)
+        if available < 2:
+            return NEED_DATA
+        head = buffer.peek(14)
+        first, second = bytearray(head[:2])
+        if first & 0x70:
+            raise IOError("WebSocket frame has reserved bits set")
+        size = second & 0x7F
+        offset = 2
+        if size == 126:
+            if available < 4:
+                return NEED_DATA
+            size, = unpack_from("!H", head, 2)
+            offset = 4
+        elif size == 127:
+            if available < 10:
+                return NEED_DATA
+            size, = unpack_from("!Q", head, 2)
+            offset = 10
+        if max_size is not None and size > max_size:
+            raise MessageTooBig("WebSocket frame of %d bytes exceeds limit of %d bytes" % (size, max_size))
+        key = None
+        if second & 0x80:
+            key = head[offset:(offset + 4)]
+            offset += 4
+        if available < offset + size:
+            return NEED_DATA
+        buffer.skip(offset)
+        payload = buffer.read(size)
+        if key is not None:
+            payload = mask(payload, key)
+        return bool(first & 0x80), first & 0x0F, payload
+
+
+class DecodedContent(object):
+    """ Iterator over decoded response content, wrapping a :class:`Content`
+    iterator over the encoded content as received.
+    """
+
+    __slots__ = ["_content", "_decoder", "_done"]
+
+    def __init__(self, content, decoder):
+        self._content = content
+        self._decoder = decoder
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.read(MAX_RECV_SIZE)
+        if not data:
+            raise StopIteration()
+        return data
+
+    def next(self):
+        return self.__next__()
+
+    @property
+    def remaining(self):
+        """ Number of content bytes still to be received, which is not known
+        for decoded content.
+        """
+        return None
+
+    def read(self, size):
+        """ Receive and return between one and `size` bytes of decoded
+        content, as soon as any are available, or :code:`b""` if the
+        content is exhausted.
+        """
+        decoder = self._decoder
+        data = decoder.more(size)
+        while not data and not self._done:
+            encoded = self._content.read(MAX_RECV_SIZE)
+            if encoded:
+                data = decoder.decode(encoded, size)
+            else:
+                self._done = True
+                data = decoder.flush()
+        return data
+
+    def readinto(self, b):
+        """ Receive decoded content into the writable buffer `b`, returning
+        the number of bytes received or zero if the content is exhausted.
+        """
+        data = self.read(len(b))
+        size = len(data)
+        b[:size] = data
+        return size
+
+
+class Content(object):
+    """ Iterator over response content as it is received through an
+    :class:`HTTPSocket`, yielding chunks of bytes. Content can instead be
+    received straight into a caller-owned buffer with :meth:`readinto`.
+    """
+
+    __slots__ = ["_socket", "_timeout"]
+
+    def __init__(self, socket, timeout=None):
+        self._socket = socket
+        self._timeout = timeout
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.read(MAX_RECV_SIZE)
+        if not data:
+            raise StopIteration()
+        return data
+
+    def next(self):
+        return self.__next__()
+
+    @property
+    def remaining(self):
+        """ Number of content bytes still to be received, if known.
+        """
+        return self._socket._parser.remaining
+
+    def read(self, size):
+        """ Receive and return between one and `size` bytes of content, as
+        soon as any are available, or :code:`b""` if the content is exhausted.
+        """
+        return self._socket._recv_data(size, self._timeout)
+
+    def readinto(self, b):
+        """ Receive content into the writable buffer `b`, returning the
+        number of bytes received or zero if the content is exhausted.
+        """
+        return self._socket._recv_data_into(memoryview(b), self._timeout)
+
+
+class HTTPSocket(socket):
+
+    send_x = not_implemented
+    send_file = not_implemented
+    recv_headers = not_implemented
+    recv_response = not_implemented
+    recv_content = not_implemented
+    recv_chunked_content = not_implemented
+    recv_frame = not_implemented
+    _recv_data = not_implemented
+    _recv_data_into = not_implemented
+    _parser = None
+
+    #: Whether a list of buffers can be sent in a single call (not the case for SSL).
+    vectored = hasattr(socket, "sendmsg")
+    #: Whether files can be sent by the kernel without copying (not the case for SSL).
+    zero_copy = hasattr(socket, "sendfile")
+
+    #: Seconds to wait for the connection to be established (:const:`None` to wait indefinitely).
+    connect_timeout = None
+    #: Seconds to wait for each piece of incoming data (:const:`None` to wait indefinitely).
+    read_timeout = None
+    #: Seconds to wait for outgoing data to be accepted (:const:`None` to wait indefinitely).
+    write_timeout = None
+    #: Clock time by which the current exchange must complete (:const:`None` for no deadline).
+    deadline = None
+
+    def __init__(self, connect_timeout=None, read_timeout=None, write_timeout=None):
+        socket.__init__(self, AF_INET, SOCK_STREAM)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+
+    def connect(self, address):
+        self.settimeout(self.connect_timeout)
+        try:
+            super(HTTPSocket, self).connect(address)
+        except socket_timeout:
+            raise SocketTimeout("Timed out connecting to %r" % (address,))
+        self.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+        # All waiting is done within blocking socket calls, bounded by the
+        # socket timeout. That timeout is only changed when the effective
+        # value differs from the one last applied.
+        applied_timeout = [self.connect_timeout]
+
+        def apply_timeout(timeout):
+            deadline = self.deadline
+            if deadline is not None:
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    raise SocketTimeout("Request deadline exceeded")
+                if timeout is None or remaining < timeout:
+                    timeout = remaining
+            if timeout != applied_timeout[0]:
+                self.settimeout(timeout)
+                applied_timeout[0] = timeout
+
+        raw_send = self.send
+        raw_sendmsg = self.sendmsg if self.vectored else None
+
+        def send_all(data, timeout):
+            view = memoryview(data)
+            size = len(view)
+            offset = 0
+            while offset < size:
+                apply_timeout(timeout)
+                try:
+                    sent = raw_send(view[offset:])
+                except socket_timeout:
+                    raise SocketTimeout("Timed out sending data")
+                except socket_error as error:
+                    raise SocketError("Connection failed while sending data: %s" % error)
+                if sent == 0:
+                    raise SocketError("Peer closed connection")
+                offset += sent
+
+        def send_vectored(buffers, timeout):
+            buffers = [memoryview(b) for b in buffers]
+            count = len(buffers)
+            i = 0
+            while i < count:
+                apply_timeout(timeout)
+                try:
+                    sent = raw_sendmsg(buffers[i:(i + MAX_SEND_BUFFERS)])
+                except socket_timeout:
+                    raise SocketTimeout("Timed out sending data")
+                except socket_error as error:
+                    raise SocketError("Connection failed while sending data: %s" % error)
+                if sent == 0:
+                    raise SocketError("Peer closed connection")
+                # Skip whatever was sent in full and trim a partial send
+                while sent:
+                    size = len(buffers[i])
+                    if sent < size:
+                        buffers[i] = buffers[i][sent:]
+                        break
+                    sent -= size
+                    i += 1
+
+        def send_x(data, timeout=None):
+            # Send `data`, which is either a single bytes-like object or a
+            # list of them. The list is gathered into as few buffers as
+            # possible without copying large fragments.
+            if timeout is None:
+                timeout = self.write_timeout
+            if isinstance(data, list):
+                buffers = gather(data)
+                if len(buffers) == 1:
+                    send_all(buffers[0], timeout)
+                elif raw_sendmsg is None:
+                    for buffer in buffers:
+                        send_all(buffer, timeout)
+                else:
+                    send_vectored(buffers, timeout)
+            else:
+                send_all(data, timeout)
+
+        raw_sendfile = self.sendfile if self.zero_copy else None
+
+        def send_file(f, size, timeout=None):
+            # Send `size` bytes from the current position of file object `f`
+            if timeout is None:
+                timeout = self.write_timeout
+            try:
+                f.fileno()
+            except (AttributeError, IOError, ValueError):
+                zero_copy = False
+            else:
+                zero_copy = raw_sendfile is not None
+            if zero_copy:
+                while size:
+                    apply_timeout(timeout)
+                    try:
+                        sent = raw_sendfile(f, f.tell(), min(size, SEND_FILE_BLOCK_SIZE))
+                    except socket_timeout:
+                        raise SocketTimeout("Timed out sending data")
+                    except socket_error as error:
+                        raise SocketError("Connection failed while sending data: %s" % error)
+                    if sent == 0:
+                        raise IOError("File ended with %d bytes still to send" % size)
+                    size -= sent
+            else:
+                view = memoryview(bytearray(min(size, SEND_FILE_BUFFER_SIZE)))
+                while size:
+                    read = f.readinto(view[:min(size, len(view))])
+                    if not read:
+                        raise IOError("File ended with %d bytes still to send" % size)
+                    send_all(view[:read], timeout)
+                    size -= read
+
+        raw_recv = self.recv
+        raw_recv_into = self.recv_into
+        parser = self._parser = ResponseParser()
+        buffer = parser.buffer
+        recv_size = [MIN_RECV_SIZE]  # adapts to the rate at which data arrives
+
+        def adapt(received, requested):
+            if received == requested:
+                if requested < MAX_RECV_SIZE:
+                    recv_size[0] = 2 * requested
+            elif 4 * received < requested and requested > MIN_RECV_SIZE:
+                recv_size[0] = requested // 2
+
+        def recv(size, timeout):
+            # Receive into a new bytes object, bypassing the buffer
+            apply_timeout(self.read_timeout if timeout is None else timeout)
+            try:
+                data = raw_recv(size)
+            except socket_timeout:
+                raise SocketTimeout("Timed out receiving data")
+            except socket_error as error:
+                raise SocketError("Connection failed while receiving data: %s" % error)
+            adapt(len(data), size)
+            return data
+
+        def fill(timeout):
+            # Receive into free space at the end of the buffer
+            size = recv_size[0]
+            apply_timeout(self.read_timeout if timeout is None else timeout)
+            try:
+                received = raw_recv_into(buffer.get_buffer(size), size)
+            except socket_timeout:
+                raise SocketTimeout("Timed out receiving data")
+            except socket_error as error:
+                raise SocketError("Connection failed while receiving data: %s" % error)
+            buffer.buffer_updated(received)
+            adapt(received, size)
+            return received
+
+        def recv_until(delimiter, timeout):
+            end = buffer.find(delimiter)
+            while end == -1:
+                searched = max(len(buffer) - len(delimiter) + 1, 0)
+                if fill(timeout) == 0:
+                    raise SocketError("Peer closed connection")
+                end = buffer.find(delimiter, searched)
+            data = buffer.read(end)
+            buffer.skip(len(delimiter))
+            return data
+
+        def next_event(size, timeout):
+            event = parser.next_event(size)
+            while event is NEED_DATA:
+                if fill(timeout) == 0:
+                    parser.feed(b"")
+                event = parser.next_event(size)
+            return event
+
+        def recv_headers(timeout=None):
+            return recv_until(b"\r\n\r\n", timeout).split(b"\r\n")
+
+        def recv_response(no_content=False, timeout=None):
+            # Return the head of the next response along with its content,
+            # or None if no content follows
+            parser.start(no_content)
+            head = next_event(MAX_RECV_SIZE, timeout)
+            if head.framing is None:
+                next_event(MAX_RECV_SIZE, timeout)
+                return head, None
+            return head, Content(self, timeout)
+
+        def recv_data(size, timeout=None):
+            # Return between 1 and `size` bytes of content, or b"" at the end
+            # of the content. Small reads are served through the buffer
+            # (which reads ahead) while larger ones bypass it.
+            while True:
+                direct = parser.direct()
+                if direct and (size if direct < 0 else min(size, direct)) >= recv_size[0]:
+                    data = recv(recv_size[0], timeout)
+                    parser.content_received(len(data))
+                    if data:
+                        return data
+                event = next_event(size, timeout)
+                if event is END_OF_MESSAGE:
+                    return b""
+                elif isinstance(event, bytes):
+                    return event
+
+        def recv_data_into(view, timeout=None):
+            # As recv_data, but copies into the writable view supplied,
+            # returning the number of bytes copied.
+            size = len(view)
+            while size:
+                direct = parser.direct()
+                if direct:
+                    if 0 < direct < size:
+                        size = direct
+                    if size >= recv_size[0]:
+                        apply_timeout(self.read_timeout if timeout is None else timeout)
+                        try:
+                            received = raw_recv_into(view, size)
+                        except socket_timeout:
+                            raise SocketTimeout("Timed out receiving data")
+                        except socket_error as error:
+                            raise SocketError("Connection failed while receiving data: %s" % error)
+                        parser.content_received(received)
+                        if received:
+                            return received
+                received = parser.readinto(view)
+                if received:
+                    return received
+                event = next_event(size, timeout)
+                if event is END_OF_MESSAGE:
+                    return 0
+                elif isinstance(event, bytes):
+                    received = len(event)
+                    view[:received] = event
+                    return received
+            return 0
+
+        def recv_content(length=None, timeout=None):
+            if length is None:
+                parser.start_content(READ_UNTIL_CLOSED)
+            else:
+                parser.start_content(READ_SIZED, length)
+            return Content(self, timeout)
+
+        def recv_chunked_content(timeout=None):
+            parser.start_content(READ_CHUNKED)
+            return Content(self, timeout)
+
+        frames = WebSocketParser(buffer)
+
+        def recv_frame(timeout=None, max_size=MAX_WEBSOCKET_MESSAGE_SIZE):
+            # Return the next WebSocket frame, once the connection has been
+            # upgraded, as a tuple of (fin, opcode, payload)
+            frame = frames.next_frame(max_size)
+            while frame is NEED_DATA:
+                if fill(timeout) == 0:
+                    raise SocketError("Peer closed connection")
+                frame = frames.next_frame(max_size)
+            return frame
+
+        self.send_x = send_x
+        self.send_file = send_file
+        self.recv_headers = recv_headers
+        self.recv_response = recv_response
+        self.recv_content = recv_content
+        self.recv_chunked_content = recv_chunked_content
+        self.recv_frame = recv_frame
+        self._recv_data = recv_data
+        self._recv_data_into = recv_data_into
+
+    def cork(self, corked):
+        """ Hold back (or release) partially filled segments of outgoing
+        data, so that data sent by several calls leaves in full segments.
+        This is only supported on Linux.
+
+        :param corked: :const:`True` to hold back data, :const:`False` to release it
+        :return: :const:`True` if supported, :const:`False` otherwise
+        """
+        if TCP_CORK is None:
+            return False
+        self.setsockopt(IPPROTO_TCP, TCP_CORK, 1 if corked else 0)
+        return True
+
+    def close(self):
+        super(HTTPSocket, self).close()
+        self.send_x = not_implemented
+        self.send_file = not_implemented
+        self.recv_headers = not_implemented
+        self.recv_response = not_implemented
+        self.recv_content = not_implemented
+        self.recv_chunked_content = not_implemented
+        self.recv_frame = not_implemented
+        self._recv_data = not_implemented
+        self._recv_data_into = not_implemented
+
+
+class WebSocket(object):
+    """ A WebSocket connection (RFC 6455), taken over from an :class:`HTTP`
+    connection by :meth:`HTTP.websocket`. Text messages are sent and
+    received as strings and binary messages as bytes. Every frame sent is
+    masked, as required of a client, and pings from the server are
+    answered while receiving. Iterating yields each message received until
+    the connection is closed.
+
+    A message larger than `max_size` bytes, or a frame announcing one, is
+    refused: the connection is closed with status 1009 and
+    :class:`MessageTooBig` is raised, so that a peer cannot make the
+    client buffer without limit.
+    """
+
+    def __init__(self, socket, subprotocol=None, max_size=MAX_WEBSOCKET_MESSAGE_SIZE):
+        self._socket = socket
+        self._send_lock = Lock()
+        self._opcode = None     # opcode of the message being reassembled
+        self._fragments = []    # payloads received so far for that message
+        self._size = 0          # number of bytes in those payloads
+        self._closing = False   # whether a close frame has been sent
+        #: Largest message to accept, in bytes (:const:`None` for no limit).
+        self.max_size = max_size
+        #: The subprotocol selected by the server, if any.
+        self.subprotocol = subprotocol
+        #: The status code sent by the server on closing, if any.
+        self.close_code = None
+        #: The reason sent by the server on closing, if any.
+        self.close_reason = None
+
+    def __repr__(self):
+        return "<WebSocket %s>" % ("closed" if self.closed else "open")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            message = self.receive()
+            if message is None:
+                return
+            yield message
+
+    @property
+    def closed(self):
+        """ Whether the underlying connection has been closed.
+        """
+        return self._socket is None
+
+    @staticmethod
+    def _frame(opcode, payload, fin=True):
+        # Return the buffers making up a masked frame
+        size = len(payload)
+        first = 0x80 | opcode if fin else opcode
+        if size < 126:
+            head = pack("!BB", first, 0x80 | size)
+        elif size < 65536:
+            head = pack("!BBH", first, 0xFE, size)
+        else:
+            head = pack("!BBQ", first, 0xFF, size)
+        key = urandom(4)
+        return [head + key, mask(payload, key)]
+
+    def _send(self, data, timeout=None):
+        # Send whole frames, so that frames sent from other threads (such
+        # as pongs) cannot be interleaved with them
+        with self._send_lock:
+            if self._socket is None:
+                raise SocketError("WebSocket is closed")
+            self._socket.send_x(data, timeout)
+
+    def send(self, message, fragment_size=None, timeout=None):
+        """ Send a message.
+
+        :param message: a string, to send as a text message, or bytes-like
+                        object, to send as a binary message
+        :param fragment_size: if given, the most bytes of the message to
+                              send in each frame
+        :param timeout: seconds to wait for the message to be accepted
+        """
+        if isinstance(message, text_type):
+            opcode, payload = WEBSOCKET_TEXT, message.encode("UTF-8")
+        else:
+            opcode, payload = WEBSOCKET_BINARY, message
+        size = len(payload)
+        if fragment_size is None or size <= fragment_size:
+            data = self._frame(opcode, payload)
+        else:
+            view = memoryview(payload)
+            data = []
+            for offset in range(0, size, fragment_size):
+                end = offset + fragment_size
+                data.extend(self._frame(opcode, view[offset:end], end >= size))
+                opcode = WEBSOCKET_CONTINUATION
+        self._send(data, timeout)
+
+    def ping(self, data=b"", timeout=None):
+        """ Send a ping, which the server will answer with a pong.
+
+        :param data: up to 125 bytes to be echoed back in the pong
+        :param timeout: seconds to wait for the ping to be accepted
+        """
+        if len(data) > 125:
+            raise ValueError("Ping data cannot exceed 125 bytes")
+        self._send(self._frame(WEBSOCKET_PING, data), timeout)
+
+    def receive(self, timeout=None):
+        """ Receive the next message, reassembling it from its fragments if
+        need be. Pings arriving in the meantime are answered and pongs are
+        discarded. A message interrupted by a timeout carries on from where
+        it left off on the next call.
+
+        :param timeout: seconds to wait for each piece of incoming data
+        :return: the message, as a string or bytes, or :const:`None` once
+                 the connection has been closed
+        :raise MessageTooBig: if the message exceeds :attr:`max_size`,
+                              after closing the connection
+        """
+        socket = self._socket
+        if socket is None:
+            return None
+        fragments = self._fragments
+        max_size = self.max_size
+        while True:
+            try:
+                fin, opcode, payload = socket.recv_frame(timeout, max_size)
+            except MessageTooBig:
+                self._abandon(WEBSOCKET_MESSAGE_TOO_BIG)
+                raise
+            if opcode & 0x8:
+                if opcode == WEBSOCKET_PING:
+                    self._send(self._frame(WEBSOCKET_PONG, payload))
+                elif opcode == WEBSOCKET_CLOSE:
+                    self._closed(payload)
+                    return None
+                continue
+            if opcode == WEBSOCKET_CONTINUATION:
+                if self._opcode is None:
+                    raise IOError("Unexpected WebSocket continuation frame")
+            elif self._opcode is None:
+                self._opcode = opcode
+            else:
+                raise IOError("Expected a WebSocket continuation frame")
+            if max_size is not None and self._size + len(payload) > max_size:
+                self._abandon(WEBSOCKET_MESSAGE_TOO_BIG)
+                raise MessageTooBig("WebSocket message exceeds limit of %d bytes" % max_size)
+            if not fin:
+                fragments.append(payload)
+                self._size += len(payload)
+                continue
+            if fragments:
+                fragments.append(payload)
+                payload = b"".join(fragments)
+                del fragments[:]
+                self._size = 0
+            opcode, self._opcode = self._opcode, None
+            return payload.decode("UTF-8") if opcode == WEBSOCKET_TEXT else payload
+
+    def _closed(self, payload):
+        # Complete the closing handshake on receipt of a close frame
+        if len(payload) >= 2:
+            self.close_code, = unpack_from("!H", payload)
+            self.close_reason = payload[2:].decode("UTF-8", "replace")
+        if not self._closing:
+            self._closing = True
+            try:
+                self._send(self._frame(WEBSOCKET_CLOSE, payload[:2]))
+            except (SocketError, socket_error):
+                pass    # already disconnected
+        self._disconnect()
+
+    def _abandon(self, code):
+        # Close the connection with status `code` without waiting for the
+        # server to answer, as anything still to arrive cannot be read
+        if self._socket is None:
+            return
+        if not self._closing:
+            self._closing = True
+            try:
+                self._send(self._frame(WEBSOCKET_CLOSE, pack("!H", code)))
+            except (SocketError, socket_error):
+                pass    # already disconnected
+        self._disconnect()
+
+    def close(self, code=1000, reason="", timeout=None):
+        """ Close the connection, sending a close frame and waiting for the
+        server to send one back. Messages received in the meantime are
+        discarded.
+
+        :param code: the status code to send
+        :param reason: the reason to send
+        :param timeout: seconds to wait for each piece of incoming data
+        """
+        if self._socket is None:
+            return
+        try:
+            if not self._closing:
+                self._closing = True
+                self._send(self._frame(WEBSOCKET_CLOSE, pack("!H", code) + reason.encode("UTF-8")), timeout)
+            while self.receive(timeout) is not None:
+                pass
+        except (SocketError, socket_error):
+            pass    # already disconnected
+        finally:
+            self._disconnect()
+
+    def _disconnect(self):
+        with self._send_lock:
+            socket, self._socket = self._socket, None
+        if socket is not None:
+            try:
+                socket.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass    # already disconnected
+            socket.close()
+
+
+URL_PARAMETER = re.compile(b"{([A-Za-z_][0-9A-Za-z_]*)}")
+
+
+class PreparedRequest(object):
+    """ A request compiled ahead of time into the bytes to be sent, so that
+    an endpoint requested over and over again costs little more than a
+    single send. Instances are created by :meth:`HTTP.prepare` and sent
+    with :meth:`HTTP.send`.
+
+    The URL may contain ``{name}`` placeholders, which are filled in from
+    keyword arguments on each send, and the body may be replaced on each
+    send. All headers, including any Content-Type, are fixed when the
+    request is prepared.
+
+    If `compress` names a Content-Encoding, the prepared body is compressed
+    once, here, unless it is smaller than `compress_threshold`. Once
+    chosen, the encoding applies to every body sent with the request,
+    including replacement bodies and chunked content.
+    """
+
+    __slots__ = ["method", "url", "headers", "body", "_url_parts", "_head", "_tail", "_data", "_json_codec",
+                 "_compress"]
+
+    def __init__(self, method, url, body=None, headers=None, json_codec=None, compress=None, compress_threshold=1024):
+        if not isinstance(method, bytes):
+            try:
+                method = METHODS[method]
+            except KeyError:
+                method = bstr(method)
+        if not url:
+            url = b"/"
+        elif not isinstance(url, bytes):
+            url = bstr(url)
+        request_headers = dict(headers or {})
+        if isinstance(body, jsonable) and body is not None:
+            request_headers[b"Content-Type"] = b"application/json; charset=UTF-8"
+        self._json_codec = get_json_codec(json_codec)
+        self._compress = None   # Content-Encoding applied to each body
+        body = self._encode(body)
+        if compress and b"Content-Encoding" not in request_headers and \
+                (body is None or len(body) >= compress_threshold):
+            request_headers[b"Content-Encoding"] = compress
+            self._compress = compress
+            body = self._encode(body)
+
+        #: The request method, as bytes.
+        self.method = method
+        #: The URL, as bytes, including any placeholders.
+        self.url = url
+        #: The full dictionary of headers sent with the request.
+        self.headers = self._framed(request_headers, body)
+        #: The encoded body, or :const:`None` for a chunked request.
+        self.body = body
+
+        parts = URL_PARAMETER.split(url)
+        self._url_parts = parts if len(parts) > 1 else None
+        self._head = method + b" "
+        self._tail = b"".join([b" HTTP/1.1\r\n"] + [key + b": " + value + b"\r\n"
+                                                    for key, value in request_headers.items()])
+        self._data = None if self._url_parts else b"".join(self._compile(url, body))
+
+    def __repr__(self):
+        return "<PreparedRequest %s %s>" % (self.method.decode("ISO-8859-1"), self.url.decode("ISO-8859-1"))
+
+    def _encode(self, body):
+        if body is None:
+            return None
+        elif isinstance(body, bytes):
+            pass
+        elif isinstance(body, jsonable):
+            body = self._json_codec.dumps(body)
+        else:
+            body = bstr(body)
+        if body and self._compress:
+            encoder = ContentEncoder(self._compress)
+            body = encoder.encode(body) + encoder.flush()
+        return body
+
+    @staticmethod
+    def _framed(headers, body):
+        # Return a copy of `headers` plus those that frame `body`
+        headers = dict(headers)
+        if body is None:
+            headers[b"Transfer-Encoding"] = b"chunked"
+        elif body:
+            headers[b"Content-Length"] = bstr(len(body))
+        return headers
+
+    def _compile(self, url, body):
+        # Returns the list of byte strings that make up the request
+        if body is None:
+            framing = [b"Transfer-Encoding: chunked\r\n\r\n"]
+        elif body:
+            framing = [b"Content-Length: ", bstr(len(body)), b"\r\n\r\n", body]
+        else:
+            framing = [b"\r\n"]
+        return [self._head, url, self._tail] + framing
+
+    def render(self, body=None, **params):
+        """ Return the URL, the data to send (as bytes or a list of byte
+        strings) and the full dictionary of headers for this request, with
+        `body` (if not :const:`None`) in place of the prepared body and URL
+        placeholders filled in from `params`.
+        """
+        parts = self._url_parts
+        if parts:
+            url_parts = parts[:]
+            for i in range(1, len(parts), 2):
+                value = params[parts[i].decode("ASCII")]
+                url_parts[i] = value if isinstance(value, bytes) else bstr(value)
+            url = b"".join(url_parts)
+        else:
+            url = self.url
+        if body is None:
+            if self._data is not None:
+                return url, self._data, self.headers
+            body, headers = self.body, self.headers
+        else:
+            body = self._encode(body)
+            headers = self._framed(self.headers, body)
+            if self.body is None:
+                del headers[b"Transfer-Encoding"]
+            elif not body:
+                headers.pop(b"Content-Length", None)
+        return url, self._compile(url, body), headers
+
+
+class ResponseReader(object):
+    """ Reading and decoding of response content, shared by :class:`HTTP`,
+    for the current response on its connection, and :class:`Response`.
+    Each calls :meth:`_finish` once all content has been received and
+    :meth:`_release` whenever content has been read.
+    """
+
+    __slots__ = ()
+
+    def _start_response(self, head):
+        # Apply the parsed head of a response and reset the content state
+        self._version = head.version
+        self._status_code = head.status_code
+        self._reason = head.reason
+        self._response_headers = head.headers
+        self._offset = 0
+        self._filled = 0
+        self._raw_content = b""
+        if self._spill is not None:
+            # Any mapping still in use remains valid
+            self._spill.close()
+            self._spill = None
+        self._content_type = None
+        self._encoding = None
+        self._typed_content = None if head.framing is None else NotImplemented
+
+    def _persistent(self):
+        # Determines whether the connection remains open after the last response
+        if self.version == "HTTP/1.0":
+            connection = self._response_headers.get(b"Connection", b"close")
+        else:
+            connection = self._response_headers.get(b"Connection", b"keep-alive")
+        return connection.lower() != b"close"
+
+    def readable(self):
+        """ Determine whether a response is currently open for reading. Responses
+        can be opened with the :func:`response` method.
+
+        :return: :const:`True` if a response is open, :const:`False` otherwise
+        """
+        return self._receiver is not None or self._offset < self._filled
+
+    def _receive(self, size=-1):
+        # Receive content into _raw_content until it holds at least `size`
+        # unread bytes, or until all content has been received if `size` is
+        # -1. Content of known length is received into a buffer allocated
+        # up front (and mapped from a temporary file if larger than the
+        # spill threshold); otherwise the buffer is extended chunk by chunk.
+        receiver = self._receiver
+        raw = self._raw_content
+        filled = self._filled
+        if not filled:
+            remaining = receiver.remaining or 0
+            threshold = self.spill_threshold
+            if threshold is not None and remaining > threshold:
+                raw = self._raw_content = self._spill_buffer(0, remaining)
+            else:
+                raw = self._raw_content = bytearray(remaining)
+        end = None if size == -1 else self._offset + size
+        if receiver.remaining is not None and filled < len(raw):
+            view = memoryview(raw)
+            capacity = len(raw)
+            while filled < capacity and (end is None or filled < end):
+                filled += receiver.readinto(view[filled:])
+            view.release()
+            more = filled < capacity
+            self._filled = filled
+        else:
+            more = True
+            while more and (end is None or self._filled < end):
+                data = receiver.read(MAX_RECV_SIZE)
+                if data:
+                    self._append(data)
+                else:
+                    more = False
+        if not more:
+            self._receiver = None
+            self._finish()
+
+    def _append(self, data):
+        # Append received content to _raw_content, moving it to a memory-
+        # mapped temporary file once it grows beyond the spill threshold
+        raw = self._raw_content
+        filled = self._filled
+        end = filled + len(data)
+        if self._spill is None:
+            raw[filled:end] = data
+            threshold = self.spill_threshold
+            if threshold is not None and end > threshold:
+                self._raw_content = self._spill_buffer(end, 2 * end)
+        else:
+            if end > len(raw):
+                raw = self._raw_content = self._spill_buffer(filled, 2 * end)
+            raw[filled:end] = data
+        self._filled = end
+
+    def _spill_buffer(self, filled, capacity):
+        # Return a buffer of `capacity` bytes, mapped from a temporary file,
+        # that starts with the first `filled` bytes of received content
+        spill = self._spill
+        if spill is None:
+            spill = self._spill = TemporaryFile()
+            os.ftruncate(spill.fileno(), capacity)
+            buffer = mmap(spill.fileno(), capacity)
+            buffer[:filled] = memoryview(self._raw_content)[:filled]
+        else:
+            # Content already written to the file is kept as it grows
+            os.ftruncate(spill.fileno(), capacity)
+            buffer = mmap(spill.fileno(), capacity)
+        return buffer
+
+    def _take(self, size=-1):
+        # Consume and return up to `size` bytes (or all) of received content.
+        # All of the content of a spilled response is returned as a view
+        # of the temporary file, rather than copied into memory.
+        offset = self._offset
+        filled = self._filled
+        end = filled if size == -1 else min(offset + size, filled)
+        if end == offset:
+            return b""
+        self._offset = end
+        if size == -1 and self._spill is not None:
+            return memoryview(self._raw_content)[offset:end]
+        return memoryview(self._raw_content)[offset:end].tobytes()
+
+    def read(self, size=-1):
+        """ Read and return up to `size` bytes of response content, blocking
+        until that much is available or the content is exhausted.
+        """
+        if size == -1:
+            return self.readall()
+        if self._receiver is not None and self._filled - self._offset < size:
+            self._receive(size)
+        data = self._take(size)
+        self._release()
+        return data
+
+    def readall(self):
+        """ Read and return all available response content.
+        """
+        if self._receiver is not None:
+            self._receive()
+        data = self._take()
+        self._release()
+        return data
+
+    def iter_content(self, chunk_size=None, retain=False):
+        """ Iterate through response content as it is received, yielding each
+        chunk as soon as it is available. Chunks are passed straight from
+        the socket to the caller and are not retained unless `retain` is
+        :const:`True`, so the content of arbitrarily large responses can
+        be streamed within a fixed amount of memory.
+
+        ::
+
+            for chunk in http.get(b"/export").response().iter_content():
+                out.write(chunk)
+
+        :param chunk_size: maximum number of bytes per chunk, or
+                           :const:`None` for no limit
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        size = chunk_size or MAX_RECV_SIZE
+
+        # Any content already received by read()
+        while self._offset < self._filled:
+            yield self._take(size)
+
+        receiver = self._receiver
+        while receiver is not None:
+            data = receiver.read(size)
+            if data:
+                if retain:
+                    self._retain(data)
+                yield data
+            else:
+                self._receiver = receiver = None
+                self._finish()
+        self._release()
+
+    def iter_lines(self, retain=False):
+        """ Iterate through lines of response content as it is received.
+        Each line is yielded as a byte string, without its line ending
+        (either :code:`b"\\n"` or :code:`b"\\r\\n"`), as soon as it
+        is complete.
+
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        pending = []
+        for chunk in self.iter_content(retain=retain):
+            for line in split_lines(chunk, pending):
+                yield line
+        if pending:
+            for line in split_lines(b"\n", pending):
+                yield line
+
+    def iter_ndjson(self, retain=False):
+        """ Iterate through the records of NDJSON (newline-delimited JSON,
+        also known as JSON Lines) response content as it is received,
+        decoding each as soon as its line is complete. Blank lines are
+        skipped.
+
+        ::
+
+            for event in http.get(b"/events").response().iter_ndjson():
+                handle(event)
+
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        loads = get_json_codec(self.json_codec).loads
+        pending = []
+        for chunk in self.iter_content(retain=retain):
+            # Any trailing carriage return is whitespace to the decoder
+            lines = chunk.split(b"\n")
+            if pending:
+                pending.append(lines[0])
+                lines[0] = b"".join(pending)
+                del pending[:]
+            last = lines.pop()
+            if last:
+                pending.append(last)
+            for line in lines:
+                if line and not line.isspace():
+                    yield loads(line)
+        if pending:
+            line = b"".join(pending)
+            if not line.isspace():
+                yield loads(line)
+
+    def iter_events(self, last_event_id=""):
+        """ Iterate through the events of a :code:`text/event-stream`
+        response as it is received, yielding each
+        :class:`ServerSentEvent` as soon as the blank line ending it
+        arrives. See :meth:`events` for a stream that reconnects.
+
+        :param last_event_id: the ID given to events before the stream
+                              sets one
+        """
+        parser = EventStreamParser(last_event_id)
+        for chunk in self.iter_content():
+            for event in parser.feed(chunk):
+                yield event
+
+    def iter_json(self, path=(), retain=False):
+        """ Iterate through the items of an array within JSON response
+        content as it is received. Items are decoded in runs, as soon as
+        each run is complete, so that the first can be had long before
+        the whole document arrives and only a run at a time is held in
+        memory. Content after the end of the array is received but not
+        examined, and no items are yielded if the array is not found.
+
+        ::
+
+            http.post(b"/db/data/transaction/commit", body).response()
+            for row in http.iter_json(("results", 0, "data")):
+                process(row)
+
+        :param path: sequence of object keys and array indexes leading to
+                     the array, or empty for a top-level array
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        splitter = JSONArraySplitter(path)
+        loads = get_json_codec(self.json_codec).loads
+        for chunk in self.iter_content(retain=retain):
+            items = splitter.feed(chunk)
+            if items:
+                for item in loads(b"[" + items + b"]"):
+                    yield item
+        splitter.close()
+
+    def _retain(self, data):
+        # Append data to the retained content, as already read
+        if not self._filled:
+            self._raw_content = bytearray()
+        self._append(data)
+        self._offset = self._filled
+
+    def readinto(self, b):
+        """ Read response content into a pre-allocated, writable bytes-like
+        object, such as a :class:`bytearray`, :class:`memoryview` or
+        :class:`mmap`, until it is full or the content is exhausted.
+
+        Content is received straight into `b` from the socket and is not
+        retained, so it will not subsequently be available through
+        :attr:`content`.
+
+        :param b: the buffer to fill
+        :return: the number of bytes read
+        """
+        view = memoryview(b)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast("B")
+        size = len(view)
+        count = 0
+
+        # Any content already received by read()
+        offset = self._offset
+        if offset < self._filled:
+            count = min(size, self._filled - offset)
+            view[:count] = memoryview(self._raw_content)[offset:(offset + count)]
+            self._offset = offset + count
+
+        receiver = self._receiver
+        while count < size and receiver is not None:
+            received = receiver.readinto(view[count:])
+            if received == 0:
+                self._receiver = receiver = None
+                self._finish()
+            else:
+                count += received
+        if receiver is not None and receiver.remaining == 0:
+            self._receiver = None
+            self._finish()
+        self._release()
+        return count
+
+    def _content_remaining(self):
+        # Number of content bytes still to be read, if known
+        remaining = self._filled - self._offset
+        receiver = self._receiver
+        if receiver is not None:
+            if receiver.remaining is None:
+                return None
+            remaining += receiver.remaining
+        return remaining
+
+    def save(self, file, fsync=False, progress=None):
+        """ Save the remaining response content to a file, within a fixed
+        amount of memory. Content is received into a reusable buffer and
+        written from there straight to the file descriptor. Where the
+        content length is known, space for the content is allocated up
+        front. Content saved is not retained.
+
+        ::
+
+            http.get(b"/artifacts/build.tar").response()
+            http.save("build.tar", progress=lambda saved, rate: print(saved, rate))
+
+        :param file: path of a file to create, or an open binary file object
+                     (written to from its current position and left open)
+        :param fsync: if :const:`True`, flush the file to disk before returning
+        :param progress: a callable, passed the number of bytes saved so far
+                         and the mean rate in bytes per second after each write
+        :return: the number of bytes saved
+        """
+        writer = ContentWriter(file, self._content_remaining(), progress)
+        try:
+            self._save(writer)
+        finally:
+            writer.close(fsync)
+        return writer.written
+
+    def _save(self, writer):
+        view = memoryview(bytearray(MAX_RECV_SIZE))
+        received = self.readinto(view)
+        while received:
+            writer.write(view[:received])
+            received = self.readinto(view)
+
+    @property
+    def version(self):
+        """ HTTP version from the last response.
+        """
+        _version = self._version
+        if isinstance(_version, bytes):
+            try:
+                _version = HTTP_VERSIONS[_version]
+            except KeyError:
+                _version = _version.decode("ISO-8859-1")
+            finally:
+                self._version = _version
+        return _version
+
+    @property
+    def status_code(self):
+        """ Status code from the last response.
+        """
+        return self._status_code
+
+    @property
+    def reason(self):
+        """ Reason phrase from the last response.
+        """
+        _reason = self._reason
+        if isinstance(_reason, bytes):
+            try:
+                _reason = REASONS[_reason]
+            except KeyError:
+                _reason = _reason.decode("ISO-8859-1")
+            finally:
+                self._reason = _reason
+        return _reason
+
+    @property
+    def headers(self):
+        """ Headers from the last response.
+        """
+        return self._response_headers
+
+    def _parse_content_type(self):
+        try:
+            content_type, params = parse_header(self._response_headers[b"Content-Type"])
+        except KeyError:
+            self._content_type = "application/octet-stream"
+            self._encoding = "ISO-8859-1"
+        else:
+            self._content_type = content_type.decode("ISO-8859-1")
+            # JSON text is UTF-8 unless a charset says otherwise
+            default_charset = b"UTF-8" if self._content_type == "application/json" else b"ISO-8859-1"
+            self._encoding = params.get(b"charset", default_charset).decode("ISO-8859-1")
+
+    @property
+    def content_type(self):
+        """ Content type of the last response.
+        """
+        if self._content_type is None:
+            self._parse_content_type()
+        return self._content_type
+
+    @property
+    def encoding(self):
+        """ Character encoding of the last response.
+        """
+        if self._encoding is None:
+            self._parse_content_type()
+        return self._encoding
+
+    @property
+    def content(self):
+        """ Full, typed content from the last response. For NDJSON content,
+        this is an iterator that decodes each record only when reached.
+        Content already received is held, and each access returns a new
+        iterator over it. Otherwise, records are streamed from the
+        connection and not held, so they can only be iterated once.
+
+        :raise IOError: if NDJSON content has already been streamed
+        """
+        if self._typed_content is STREAMED:
+            raise IOError("NDJSON content has already been streamed")
+        if self._receiver is not None:
+            if self._typed_content is NotImplemented and self.content_type in NDJSON_CONTENT_TYPES:
+                self._typed_content = STREAMED
+                return self.iter_ndjson()
+            self._receive()
+        self._offset = self._filled
+        if self._typed_content is NotImplemented:
+            raw_content = self._raw_content
+            spilled = self._spill is not None
+            if spilled:
+                raw_content = memoryview(raw_content)[:self._filled]
+            content_type = self.content_type
+            if content_type == "text/html" and BeautifulSoup:
+                self._typed_content = BeautifulSoup(bytes(raw_content))
+            elif content_type.startswith("text/"):
+                self._typed_content = codecs.decode(raw_content, self.encoding)
+            elif content_type in NDJSON_CONTENT_TYPES:
+                # Not kept, as each iterator can only be used once
+                self._release()
+                return self._ndjson_records(self._raw_content, self._filled, get_json_codec(self.json_codec).loads)
+            elif content_type == "application/json":
+                encoding = self.encoding
+                if codecs.lookup(encoding).name != "utf-8":
+                    raw_content = codecs.decode(raw_content, encoding)
+                self._typed_content = get_json_codec(self.json_codec).loads(raw_content)
+            elif spilled:
+                # A view of the temporary file, rather than a copy
+                self._typed_content = raw_content
+            else:
+                self._typed_content = bytes(raw_content)
+            self._release()
+        return self._typed_content
+
+    @staticmethod
+    def _ndjson_records(raw, size, loads):
+        # Decode the records of NDJSON content already held, one line at a
+        # time and without copying the content
+        view = memoryview(raw)
+        start = 0
+        while start < size:
+            end = raw.find(b"\n", start, size)
+            if end == -1:
+                end = size
+            if JSON_WHITESPACE.match(raw, start, end).end() < end:
+                yield loads(view[start:end])
+            start = end + 1
+
+
+class Response(ResponseReader):
+    """ A response held apart from the connection that received it, with
+    its own status, headers and content. Responses are returned in this
+    form by :meth:`HTTP.response` when detached, and delivered in this
+    form by :class:`HTTPMultiplexer` and :class:`HTTPPipeline`, so that
+    any number can be held at once.
+
+    While its content is still arriving, a detached response reads from
+    the connection it came from. Any content not yet read when the next
+    response is read from that connection is first received in full
+    into this response, so none is lost.
+
+    The connection is shared without locking, so a response may only be
+    handed to another thread once it has been received in full: after
+    its content has been read, or the next response has been read from
+    the same connection. Responses from :class:`HTTPMultiplexer` and
+    :class:`HTTPPipeline` are always received in full before delivery.
+    """
+
+    __slots__ = ["spill_threshold", "json_codec", "_http", "_version", "_status_code", "_reason",
+                 "_response_headers", "_receiver", "_offset", "_filled", "_raw_content", "_spill",
+                 "_typed_content", "_content_type", "_encoding"]
+
+    def __init__(self, head, receiver=None, http=None, spill_threshold=None, json_codec=None):
+        #: As for :attr:`HTTP.spill_threshold`.
+        self.spill_threshold = spill_threshold
+        #: As for :attr:`HTTP.json_codec`.
+        self.json_codec = json_codec
+        self._http = http       # connection from which content is still to be received, if any
+        self._receiver = receiver
+        self._spill = None
+        self._start_response(head)
+
+    def __repr__(self):
+        return "<Response %s %s>" % (self.status_code, self.reason)
+
+    def close(self):
+        """ Stop receiving this response, closing the connection on which
+        the rest of its content would have arrived.
+        """
+        self._receiver = None
+        http = self._http
+        if http is not None:
+            self._http = None
+            http._detached = None
+            http.close()
+
+    def _finish(self):
+        http = self._http
+        if http is not None:
+            self._http = None
+            http._finish_detached(self)
+
+    def _release(self):
+        # The connection is handed back as soon as all content is received
+        pass
+
+
+class HTTP(ResponseReader):
+
+    #: The default port for HTTP traffic.
+    DEFAULT_PORT = 80
+
+    #: Seconds to wait for each connection to be established.
+    connect_timeout = None
+    #: Seconds to wait for each piece of incoming response data.
+    read_timeout = None
+    #: Seconds to wait for outgoing request data to be accepted.
+    write_timeout = None
+    #: Seconds allowed for each complete request-response exchange,
+    #: measured from when the request is sent.
+    timeout = None
+    #: Number of bytes of content beyond which a response body is held in
+    #: a memory-mapped temporary file rather than in memory
+    #: (:const:`None` to always hold content in memory).
+    spill_threshold = None
+    #: Whether to ask for compressed responses and transparently decode them.
+    decompress = False
+    #: Greatest ratio of decoded to compressed size allowed for compressed
+    #: content (:const:`None` for no limit).
+    max_decompression_ratio = 100
+    #: Content-Encoding with which to compress request bodies (:code:`b"gzip"`
+    #: or :code:`b"zstd"`), or :const:`None` to send them as they are.
+    compress = None
+    #: Size in bytes below which fixed-length request bodies are sent
+    #: uncompressed, as not worth the time taken to compress them.
+    compress_threshold = 1024
+    #: :class:`JSONCodec`, or the name of one, for encoding request bodies
+    #: and decoding JSON content (:const:`None` for the default codec).
+    json_codec = None
+    #: Number of bytes of deferred request data (see :meth:`flush`) at
+    #: which it is sent without waiting to be flushed.
+    flush_threshold = 65536
+    #: Whether to cork the connection (Linux only) while flushing deferred
+    #: request data or sending a file upload, so that it leaves in full
+    #: segments despite :code:`TCP_NODELAY`.
+    cork = False
+
+    _socket = None
+    _pool = None
+    _pool_key = None
+    _idle_since = None
+    _user_info = None
+    _host = None
+    _port = None
+    _connection_headers = {}
+
+    _writable = False
+    _encoder = None     # ContentEncoder for chunked request content
+    _requests = deque()
+    _deferred = False   # whether the current request is held back until flushed
+    _output = []        # request data held back until flushed
+    _output_size = 0
+
+    _receiver = None
+    _detached = None    # detached Response still receiving content
+    _version = None
+    _status_code = None
+    _reason = None
+    _response_headers = {}
+    _offset = 0     # read offset for content
+    _filled = 0     # number of content bytes held in _raw_content
+    _raw_content = b""
+    _spill = None   # temporary file backing _raw_content, if spilled
+    _typed_content = None
+    _content_type = None
+    _encoding = None
+
+    def __init__(self, authority=None, connect_timeout=None, read_timeout=None, write_timeout=None,
+                 timeout=None, spill_threshold=None, decompress=False, compress=None, compress_threshold=1024,
+                 json_codec=None, flush_threshold=65536, cork=False, **headers):
+        self._connection_headers = {}
+        self._requests = deque()
+        self._output = []
+        self._response_headers = {}
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.timeout = timeout
+        self.spill_threshold = spill_threshold
+        self.decompress = decompress
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+        self.json_codec = json_codec
+        self.flush_threshold = flush_threshold
+        self.cork = cork
+        if authority:
+            self.connect(authority)
+        if headers:
+            self._add_connection_headers(**headers)
+
+    def __del__(self):
+        try:
+            self.close()
+        except socket_error:
+            pass
+
+    def __repr__(self):
+        params = [b"HTTP"]
+        try:
+            host = self._connection_headers[b"Host"]
+        except KeyError:
+            pass
+        else:
+            params.append(host)
+            for i, (method, url, _) in enumerate(self._requests):
+                if i == 0 and self.readable():
+                    params.append(b"(" + method + b" " + url + b")->(" + bstr(self.status_code) + b")")
+                else:
+                    params.append(b"(" + method + b" " + url + b")->()")
+        if sys.version_info >= (3,):
+            return "<%s>" % " ".join(param.decode("UTF-8") for param in params)
+        else:
+            return "<%s>" % b" ".join(params)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # finish reading or writing
+        pass
+
+    def _add_connection_headers(self, **headers):
+        for name, value in headers.items():
+            try:
+                name = REQUEST_HEADERS[name]
+            except KeyError:
+                name = bstr(name).replace(b"_", b"-").title()
+            if not isinstance(value, bytes):
+                value = bstr(value)
+            self._connection_headers[name] = value
+
+    def _connect(self, host, port):
+        self._socket = HTTPSocket(self.connect_timeout, self.read_timeout, self.write_timeout)
+        self._socket.connect((host, port))
+        self._reset()
+
+    def connect(self, authority, **headers):
+        """ Establish a connection to a remote host. The timeouts configured
+        for this instance are applied to the new connection.
+
+        :param authority: the URI authority to which to connect
+        :param headers: headers to pass into each request for this connection
+        """
+        self._set_authority(authority, headers)
+        self._connect(self._host, self._port)
+
+    def _set_authority(self, authority, headers):
+        user_info, host, port = parse_uri_authority(authority)
+        self._set_connection_headers(user_info, host, port, headers)
+
+        self._user_info = user_info
+        self._host = host
+        self._port = port or self.DEFAULT_PORT
+
+    def _set_connection_headers(self, user_info, host, port, headers):
+        connection_headers = self._connection_headers
+        connection_headers.clear()
+        if user_info:
+            connection_headers[b"Authorization"] = basic_auth(user_info)
+        if port:
+            connection_headers[b"Host"] = host + b":" + bstr(port)
+        else:
+            connection_headers[b"Host"] = host
+
+        if headers:
+            self._add_connection_headers(**headers)
+
+    def reconnect(self):
+        """ Re-establish a connection to the same remote host.
+        """
+        if self._socket:
+            try:
+                self._socket.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass    # already disconnected
+            self._socket.close()
+        self._connect(self._host, self._port)
+
+    def close(self):
+        """ Close the current connection.
+        """
+        if self._socket:
+            try:
+                self._socket.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass    # already disconnected
+            self._socket.close()
+        self._socket = None
+        self._reset()
+        self._detached = None
+
+        self._connection_headers.clear()
+
+        if self._pool is not None:
+            self._pool.release(self)
+
+    @property
+    def host(self):
+        """ The remote host to which this client is connected.
+        """
+        return self._connection_headers[b"Host"]
+
+    def request(self, method, url, body=None, flush=True, **headers):
+        """ Make or initiate a request to the remote host.
+
+        For simple (non-chunked) requests, pass the `method`, `url` and
+        `body` plus any extra `headers`, if required. An empty body can
+        be specified by passing :code:`b''` as the `body` argument::
+
+        >>> http.request(b'GET', '/foo/1', b'')
+
+        >>> http.request(b'POST', '/foo/', {"foo": "bar"})
+
+        Chunked requests can be initiated by passing :const:`None` to
+        the `body` argument (either explicitly or using the default
         value) and following the :func:`request` with one or more
         :func:`write` operations::
 
@@ -622,15 +3198,68 @@ class HTTP(object):
         >>> http.write(b'data chunk 2')
         >>> http.write(b'')
 
+        A file can be uploaded by passing an open binary file object (which
+        is sent from its current position and left open) or a path (which
+        is opened, sent and closed). On plain connections, the file is sent
+        by the kernel without being copied through Python::
+
+        >>> http.request(b'PUT', '/artifacts/build.tar', pathlib.Path('build.tar'))
+
+        If a :attr:`timeout` is set, the whole exchange (sending the request
+        and receiving the full response) must complete within that time or
+        a :class:`SocketTimeout` will be raised.
+
+        Passing :code:`flush=False` holds the request back, along with any
+        chunks written for it, until :meth:`flush` is called, the
+        :attr:`flush_threshold` is reached or a response is read. A burst
+        of pipelined requests can then leave in as few packets as
+        possible::
+
+        >>> for i in range(10):
+        ...     http.get('/foo/%d' % i, flush=False)
+        >>> http.flush()
+
         :param method: request method, e.g. :code:`b'GET'`
         :param url: relative URL for this request
-        :param body: the byte content to send with this request
-                     or :const:`None` for separate, chunked data
+        :param body: the byte content to send with this request, a file
+                     object or path for file content, or :const:`None`
+                     for separate, chunked data
+        :param flush: :const:`False` to defer sending the request
         :param headers:
         """
         if self._writable:
             self.write(b"")
 
+        method, url, data, request_headers = self._build_request(method, url, body, headers)
+        upload = None if isinstance(data[-1], bytes) else data.pop()
+
+        # Send
+        if self.timeout is not None and not self._requests:
+            self._socket.deadline = clock() + self.timeout
+        self._deferred = not flush
+        if upload is None:
+            self._put(data)
+        else:
+            # File content is never deferred, but anything already held
+            # back leaves with the head of this request
+            corked = self.cork and self._socket.cork(True)
+            try:
+                self._socket.send_x(self._take_output() + data)
+                self._socket.send_file(upload, int(request_headers[b"Content-Length"]))
+            finally:
+                if corked:
+                    self._socket.cork(False)
+                if upload is not body:
+                    upload.close()
+        self._requests.append((method, url, request_headers))
+
+        return self
+
+    def _build_request(self, method, url, body, headers):
+        # Returns the method and URL (as bytes), the list of byte strings that
+        # make up the request (followed by a file object, for file content)
+        # and the full dictionary of request headers. A file opened here from
+        # a path should be closed once sent.
         if not isinstance(method, bytes):
             try:
                 method = METHODS[method]
@@ -662,20 +3291,44 @@ class HTTP(object):
             request_headers[name] = value
             data += [name, b": ", value, b"\r\n"]
 
+        if self.decompress and b"Accept-Encoding" not in request_headers:
+            request_headers[b"Accept-Encoding"] = ACCEPT_ENCODING
+            data += [b"Accept-Encoding: ", ACCEPT_ENCODING, b"\r\n"]
+
+        compress = self.compress if b"Content-Encoding" not in request_headers else None
+
         if body is None:
-            # Chunked content
+            # Chunked content, compressed as it is written if required
+            self._encoder = ContentEncoder(compress) if compress else None
+            if compress:
+                request_headers[b"Content-Encoding"] = compress
+                data += [b"Content-Encoding: ", compress, b"\r\n"]
             request_headers[b"Transfer-Encoding"] = b"chunked"
             data.append(b"Transfer-Encoding: chunked\r\n\r\n")
             self._writable = True
 
+        elif isinstance(body, PathLike) or hasattr(body, "read"):
+            # File content, sent separately from the current position
+            if isinstance(body, PathLike):
+                body = open(fspath(body), "rb")
+            content_length_bytes = bstr(file_size(body))
+            request_headers[b"Content-Length"] = content_length_bytes
+            data += [b"Content-Length: ", content_length_bytes, b"\r\n\r\n", body]
+            self._writable = False
+
         else:
             # Fixed-length content
             if isinstance(body, jsonable):
                 request_headers[b"Content-Type"] = b"application/json; charset=UTF-8"
                 data.append(b"Content-Type: application/json; charset=UTF-8\r\n")
-                body = json_dumps(body, ensure_ascii=True).encode("UTF-8")
+                body = get_json_codec(self.json_codec).dumps(body)
             elif not isinstance(body, bytes):
                 body = bstr(body)
+            if compress and len(body) >= self.compress_threshold:
+                encoder = ContentEncoder(compress)
+                body = encoder.encode(body) + encoder.flush()
+                request_headers[b"Content-Encoding"] = compress
+                data += [b"Content-Encoding: ", compress, b"\r\n"]
             content_length = len(body)
             if content_length == 0:
                 data.append(b"\r\n")
@@ -685,9 +3338,71 @@ class HTTP(object):
                 data += [b"Content-Length: ", content_length_bytes, b"\r\n\r\n", body]
             self._writable = False
 
+        return method, url, data, request_headers
+
+    def prepare(self, method, url, body=None, **headers):
+        """ Compile a request ahead of time for sending repeatedly with
+        :meth:`send`. The connection headers for this instance are
+        included as they stand when the request is prepared, and the
+        body is compressed as set by :attr:`compress`.
+
+        ::
+
+            commit = http.prepare(b"POST", b"/db/data/transaction/commit", body)
+            for _ in range(1000):
+                http.send(commit).response()
+
+            user = http.prepare(b"GET", b"/user/{id}")
+            http.send(user, id=42).response()
+
+        :param method: request method, e.g. :code:`b'GET'`
+        :param url: relative URL for the request, optionally containing
+                    ``{name}`` placeholders
+        :param body: the default content for the request, or :const:`None`
+                     for separate, chunked data
+        :param headers: extra headers for the request
+        :return: a :class:`PreparedRequest`
+        """
+        request_headers = dict(self._connection_headers)
+        for name, value in headers.items():
+            try:
+                name = REQUEST_HEADERS[name]
+            except KeyError:
+                name = bstr(name).replace(b"_", b"-").title()
+            if not isinstance(value, bytes):
+                value = bstr(value)
+            request_headers[name] = value
+        if self.decompress and b"Accept-Encoding" not in request_headers:
+            request_headers[b"Accept-Encoding"] = ACCEPT_ENCODING
+        return PreparedRequest(method, url, body, request_headers, self.json_codec, self.compress,
+                               self.compress_threshold)
+
+    def send(self, prepared, body=None, flush=True, **params):
+        """ Make or initiate a request prepared earlier by :meth:`prepare`.
+        Any `body` given replaces the prepared one and `params` fill in
+        placeholders in the URL. As for :meth:`request`, a chunked
+        request is followed by one or more :meth:`write` operations and
+        sending can be deferred until :meth:`flush` is called.
+
+        :param prepared: a :class:`PreparedRequest`
+        :param body: content to send in place of the prepared body
+        :param flush: :const:`False` to defer sending the request
+        :param params: values for placeholders in the URL
+        :return: this HTTP instance
+        """
+        if self._writable:
+            self.write(b"")
+
+        url, data, request_headers = prepared.render(body, **params)
+        self._writable = b"Transfer-Encoding" in request_headers
+        self._encoder = ContentEncoder(prepared._compress) if self._writable and prepared._compress else None
+
         # Send
-        self._socket.send_x(b"".join(data))
-        self._requests.append((method, url, request_headers))
+        if self.timeout is not None and not self._requests:
+            self._socket.deadline = clock() + self.timeout
+        self._deferred = not flush
+        self._put(data)
+        self._requests.append((prepared.method, url, request_headers))
 
         return self
 
@@ -789,6 +3504,46 @@ class HTTP(object):
         """
         return self.request(b"TRACE", url, body, **headers)
 
+    def websocket(self, url, protocols=(), max_size=MAX_WEBSOCKET_MESSAGE_SIZE, **headers):
+        """ Open a WebSocket (RFC 6455) by upgrading the connection. Once
+        the server has agreed, the connection is handed over to the
+        :class:`WebSocket` returned and this instance is left without one,
+        ready to :meth:`reconnect`.
+
+        ::
+
+            with http.websocket(b"/telemetry") as ws:
+                for reading in readings:
+                    ws.send(json_encode(reading))
+
+        :param url: relative URL of the WebSocket endpoint
+        :param protocols: subprotocols to offer, in order of preference
+        :param max_size: largest message to accept, in bytes
+                         (:const:`None` for no limit)
+        :param headers: extra headers for the handshake request
+        :return: a :class:`WebSocket`
+        :raise IOError: if the server does not agree to the upgrade
+        """
+        key = b64encode(urandom(16))
+        headers.update(upgrade=b"websocket", connection=b"Upgrade", sec_websocket_key=key,
+                       sec_websocket_version=b"13")
+        if protocols:
+            headers["sec_websocket_protocol"] = b", ".join(bstr(protocol) for protocol in protocols)
+        self.get(url, **headers).response()
+        if self.status_code != 101:
+            raise IOError("WebSocket upgrade refused with %s %s" % (self.status_code, self.reason))
+        response_headers = self._response_headers
+        if response_headers.get(b"Upgrade", b"").lower() != b"websocket" or \
+                response_headers.get(b"Sec-Websocket-Accept") != b64encode(sha1(key + WEBSOCKET_GUID).digest()):
+            self.close()
+            raise IOError("Invalid WebSocket handshake response")
+        protocol = response_headers.get(b"Sec-Websocket-Protocol")
+        s, self._socket = self._socket, None
+        s.deadline = None
+        if self._pool is not None:
+            self._pool.release(self)
+        return WebSocket(s, protocol.decode("ISO-8859-1") if protocol else None, max_size)
+
     def writable(self):
         """ Determine whether a chunked request is currently open for writing. Requests
         can be opened with the :func:`request` method or one of its aliases, such as
@@ -816,245 +3571,275 @@ class HTTP(object):
             # Write four chunks and a final empty chunk over three calls
             http.write(b"line 1\\r\\n", b"line 2\\r\\n")
             http.write(b"line 3\\r\\n", b"line 4\\r\\n")
-            http.write(b"")
-
-        :param chunks: chunks of byte data to add to the request
-        :return: this HTTP instance
-        """
-        assert self._writable, "No chunked request sent"
-
-        data = []
-        for chunk in chunks:
-            assert isinstance(chunk, bytes)
-            chunk_length = len(chunk)
-            if chunk_length == 0:
-                data += [hexb(chunk_length), b"\r\n\r\n"]
-                self._writable = False
-                break
-            else:
-                data += [hexb(chunk_length), b"\r\n", chunk, b"\r\n"]
-
-        self._socket.send_x(b"".join(data))
-
-        return self
-
-    def response(self):
-        """ Read the status line and headers for the next response.
-
-        :return: this HTTP instance
-        """
-        if not self._requests:
-            raise IOError("No requests outstanding")
-
-        if self._receiver is not None:
-            self.readall()
-
-        header_lines = self._socket.recv_headers()
-
-        status_line = header_lines.pop(0)
-        if __debug__:
-            log_write((b"< ", status_line))
-
-        # HTTP version
-        p = status_line.find(b" ")
-        self._version = status_line[:p]
-
-        # Status code
-        p += 1
-        q = status_line.find(b" ", p)
-        status_code = STATUS_CODES[status_line[p:q]]
-        self._status_code = status_code
-
-        # Reason phrase
-        self._reason = status_line[(q + 1):]
-
-        # Flag to indicate no response content expected
-        no_content = self.request_method == b"HEAD" or status_code in NO_CONTENT_STATUS_CODES
-
-        # Headers
-        headers = self._response_headers
-        headers.clear()
-        content_length = None
-        transfer_encoding = None
-        for header_line in header_lines:
-            if __debug__:
-                log_write((b"< ", header_line))
-            delimiter = header_line.find(b":")
-            key = header_line[:delimiter].title()
-            p = delimiter + 1
-            while header_line[p] == SPACE:
-                p += 1
-            value = header_line[p:]
-            headers[key] = value
-            if no_content:
-                pass
-            elif key == b"Content-Length":
-                try:
-                    content_length = int(value)
-                except (TypeError, ValueError):
-                    raise RuntimeError("Unparseable content length %r" % value)
-            elif key == b"Transfer-Encoding":
-                transfer_encoding = value
-
-        if no_content:
-            self._receiver = None
-            self._finish()
-        else:
-            if transfer_encoding == b"chunked":
-                self._receiver = self._socket.recv_chunked_content()
-            elif content_length is not None:
-                self._receiver = self._socket.recv_content(content_length)
-            else:
-                self._receiver = self._socket.recv_content()
-
-        self._offset = 0
-        self._raw_content = b""
-        self._content_type = None
-        self._encoding = None
-        self._typed_content = None if no_content else NotImplemented
-
-        return self
-
-    def _finish(self):
-        self._requests.pop(0)
-        if self.version == "HTTP/1.0":
-            connection = self._response_headers.get(b"Connection", b"close")
-        else:
-            connection = self._response_headers.get(b"Connection", b"keep-alive")
-        if connection.lower() == b"close":
-            self.close()
-
-    def readable(self):
-        """ Determine whether a response is currently open for reading. Responses
-        can be opened with the :func:`response` method.
+            http.write(b"")
 
-        :return: :const:`True` if a response is open, :const:`False` otherwise
+        :param chunks: chunks of byte data to add to the request
+        :return: this HTTP instance
         """
-        return bool(self._receiver)
+        assert self._writable, "No chunked request sent"
+        self._put(self._build_chunks(chunks))
+        return self
 
-    def read(self, size=-1):
-        if size == -1:
-            return self.readall()
-        offset = self._offset
-        while self._receiver is not None and len(self._raw_content) - offset < size:
-            try:
-                data = next(self._receiver)
-            except StopIteration:
-                self._receiver = None
-                self._finish()
-            else:
-                self._raw_content += data
-        end = offset + size
-        data = self._raw_content[offset:end]
-        self._offset = end
-        return data
+    def flush(self):
+        """ Send any request data held back by requests made with
+        :code:`flush=False` and by the chunks written for them.
 
-    def readall(self):
-        """ Read and return all available response content.
+        :return: this HTTP instance
         """
-        if self._receiver is not None:
-            data = b"".join(self._receiver)
-            self._receiver = None
-            self._finish()
-            self._raw_content += data
-        data = self._raw_content[self._offset:]
-        self._offset = len(self._raw_content)
+        output = self._take_output()
+        if output:
+            corked = self.cork and self._socket.cork(True)
+            try:
+                self._socket.send_x(output)
+            finally:
+                if corked:
+                    self._socket.cork(False)
+        return self
+
+    def _put(self, data):
+        # Send `data` (a list of byte strings) along with anything already
+        # held back, or hold it back too if the current request is deferred
+        if not self._output and not self._deferred:
+            self._socket.send_x(data)
+            return
+        self._output += data
+        self._output_size += sum(len(b) for b in data)
+        if not self._deferred or self._output_size >= self.flush_threshold:
+            self.flush()
+
+    def _take_output(self):
+        output = self._output
+        if output:
+            self._output = []
+            self._output_size = 0
+        return output
+
+    def _discard_output(self):
+        self._output = []
+        self._output_size = 0
+        self._deferred = False
+
+    def _reset(self):
+        # Forget every exchange on the previous connection, including any
+        # request data still held back from it
+        self._requests.clear()
+        self._discard_output()
+
+    def _build_chunks(self, chunks):
+        # Returns the list of byte strings that encode `chunks`, closing the
+        # request if an empty chunk is found. Compressed content is sent in
+        # chunks as the encoder produces it.
+        data = []
+        encoder = self._encoder
+        for chunk in chunks:
+            assert isinstance(chunk, bytes)
+            if not chunk:
+                if encoder is not None:
+                    chunk = encoder.flush()
+                    if chunk:
+                        data += [hexb(len(chunk)), b"\r\n", chunk, b"\r\n"]
+                    self._encoder = None
+                data.append(b"0\r\n\r\n")
+                self._writable = False
+                break
+            if encoder is not None:
+                chunk = encoder.encode(chunk)
+                if not chunk:
+                    continue
+            data += [hexb(len(chunk)), b"\r\n", chunk, b"\r\n"]
         return data
 
-    def readinto(self, b):
-        # TODO
-        raise NotImplementedError()
+    def response(self, detach=False):
+        """ Read the status line and headers for the next response.
 
-    @property
-    def version(self):
-        """ HTTP version from the last response.
-        """
-        _version = self._version
-        if isinstance(_version, bytes):
-            try:
-                _version = HTTP_VERSIONS[_version]
-            except KeyError:
-                _version = _version.decode("ISO-8859-1")
-            finally:
-                self._version = _version
-        return _version
+        By default, the response is held by this instance, and reading the
+        next response discards any of its content not yet read. A detached
+        :class:`Response` holds its own status, headers and content
+        instead, so that several pipelined responses can be held at once::
 
-    @property
-    def status_code(self):
-        """ Status code from the last response.
-        """
-        return self._status_code
+            for i in range(3):
+                http.get(b"/item/%d" % i, flush=False)
+            responses = [http.response(detach=True) for _ in range(3)]
 
-    @property
-    def reason(self):
-        """ Reason phrase from the last response.
-        """
-        _reason = self._reason
-        if isinstance(_reason, bytes):
-            try:
-                _reason = REASONS[_reason]
-            except KeyError:
-                _reason = _reason.decode("ISO-8859-1")
-            finally:
-                self._reason = _reason
-        return _reason
+        A detached response shares this connection until it has been
+        received in full, and should not be read from another thread
+        until then.
 
-    @property
-    def headers(self):
-        """ Headers from the last response.
+        :param detach: :const:`True` to return a :class:`Response`
+        :return: this HTTP instance, or a detached :class:`Response`
         """
-        return self._response_headers
+        if not self._requests:
+            raise IOError("No requests outstanding")
+        if self._output:
+            self.flush()
 
-    def _parse_content_type(self):
-        try:
-            content_type, params = parse_header(self._response_headers[b"Content-Type"])
-        except KeyError:
-            self._content_type = "application/octet-stream"
-            self._encoding = "ISO-8859-1"
-        else:
-            self._content_type = content_type.decode("ISO-8859-1")
-            self._encoding = params.get(b"charset", b"ISO-8859-1").decode("ISO-8859-1")
+        if self._receiver is not None:
+            # Discard the remainder of the previous response
+            for _ in self._receiver:
+                pass
+            self._receiver = None
+            self._finish()
+        elif self._detached is not None:
+            # Keep the remainder of the previous response for its holder
+            self._detached._receive()
+
+        head, receiver = self._socket.recv_response(self._requests[0][0] == b"HEAD")
+        if receiver is not None:
+            decoder = self._content_decoder(head.headers)
+            if decoder is not None:
+                receiver = DecodedContent(receiver, decoder)
+        if detach:
+            response = Response(head, receiver, self, self.spill_threshold, self.json_codec)
+            if receiver is None:
+                response._finish()
+            else:
+                self._detached = response
+            return response
+        self._receiver = receiver
+        self._start_response(head)
+        if receiver is None:
+            self._finish()
+            self._release()
+        return self
 
-    @property
-    def content_type(self):
-        """ Content type of the last response.
-        """
-        if self._content_type is None:
-            self._parse_content_type()
-        return self._content_type
+    def _content_decoder(self, headers):
+        # Return a ContentDecoder for the content of a response with the
+        # given `headers`, if it is to be decoded
+        if self.decompress:
+            encoding = headers.get(b"Content-Encoding", b"").strip().lower()
+            if encoding in CONTENT_ENCODINGS:
+                return ContentDecoder(encoding, self.max_decompression_ratio)
+        return None
 
-    @property
-    def encoding(self):
-        """ Character encoding of the last response.
-        """
-        if self._encoding is None:
-            self._parse_content_type()
-        return self._encoding
+    def _finish(self):
+        self._end_exchange(self._persistent())
+
+    def _finish_detached(self, response):
+        # Called by a detached response once all of its content is received
+        self._detached = None
+        self._end_exchange(response._persistent())
+        self._release()
+
+    def _end_exchange(self, persistent):
+        self._requests.popleft()
+        if self.timeout is not None:
+            # The next pipelined exchange gets a fresh allowance
+            self._socket.deadline = clock() + self.timeout if self._requests else None
+        if not persistent:
+            self.close()
 
-    @property
-    def content(self):
-        """ Full, typed content from the last response.
+    def _release(self):
+        # Return this connection to its pool once all responses are fully
+        # read, unless it has switched to another protocol
+        if self._pool is not None and not self._requests and not self.readable() and self._detached is None and \
+                self._status_code != 101:
+            self._pool.release(self)
+
+    def events(self, url, last_event_id="", reconnect=True, retry=3000, **headers):
+        """ Subscribe to a stream of Server-Sent Events, yielding each
+        :class:`ServerSentEvent` as soon as the blank line ending it
+        arrives. If the connection is lost or the stream ends, the
+        subscription is renewed after the reconnection time, with the
+        last event ID sent in a Last-Event-ID header so that the server
+        can carry on from where it left off. Subscription ends when the
+        server responds with 204 No Content.
+
+        ::
+
+            for event in http.events(b"/feed"):
+                if event.event == "update":
+                    apply(json_decode(event.data))
+
+        :param url: relative URL of the event stream
+        :param last_event_id: ID of the last event already seen, if any
+        :param reconnect: if :const:`False`, end when the connection is
+                          lost or the stream ends
+        :param retry: milliseconds to wait before reconnecting, unless the
+                      stream sets a reconnection time with :code:`retry:`
+        :param headers: extra headers for each request
+        :raise IOError: if a response is not an event stream
         """
-        if self.readable():
-            self.readall()
-        if self._typed_content is NotImplemented:
-            content_type = self.content_type
-            if content_type == "text/html" and BeautifulSoup:
-                self._typed_content = BeautifulSoup(self._raw_content)
-            elif content_type.startswith("text/"):
-                self._typed_content = self._raw_content.decode(self.encoding)
-            elif content_type == "application/json":
-                self._typed_content = json_loads(self._raw_content.decode(self.encoding))
+        parser = EventStreamParser(last_event_id)
+        headers.setdefault("accept", b"text/event-stream")
+        headers.setdefault("cache_control", b"no-cache")
+        # Kept to restore if the connection is closed at the end of the stream
+        connection_headers = dict(self._connection_headers)
+        connected = True
+        while True:
+            if connected:
+                if parser.last_event_id:
+                    headers["last_event_id"] = bstr(parser.last_event_id, "UTF-8")
+                try:
+                    self.get(url, **headers).response()
+                except (SocketError, socket_error):
+                    if not reconnect:
+                        raise
+                else:
+                    if self.status_code == 204:
+                        return
+                    if self.status_code != 200 or self.content_type != "text/event-stream":
+                        raise IOError("Expected an event stream, received %s %s (%s)" %
+                                      (self.status_code, self.reason, self.content_type))
+                    try:
+                        for chunk in self.iter_content():
+                            for event in parser.feed(chunk):
+                                yield event
+                    except (SocketError, socket_error):
+                        pass    # lost connection, as for the end of the stream
+                if not reconnect:
+                    return
+                parser.reset()
+                self._receiver = None
+            sleep((retry if parser.retry is None else parser.retry) / 1000.0)
+            self._connection_headers.update(connection_headers)
+            try:
+                self.reconnect()
+            except (SocketError, socket_error):
+                connected = False
             else:
-                self._typed_content = self._raw_content
-        return self._typed_content
+                connected = True
 
 try:
     import ssl
 except ImportError:
     pass
 else:
-    if sys.version_info >= (2, 7):
+    if sys.version_info >= (3, 7):
+
+        class HTTPSSocket(HTTPSocket, ssl.SSLSocket):
+            """ Secure counterpart of :class:`HTTPSocket`. Instances are created by
+            an SSL context wrapping a plain socket and the TLS handshake is carried
+            out as part of :meth:`connect`, within the connect timeout.
+            """
+
+            vectored = False
+            zero_copy = False
+
+        class HTTPS(HTTP):
+            """ This class allows communication via SSL.
+            """
+
+            DEFAULT_PORT = 443
+
+            _ssl_context = None
+
+            def __init__(self, *args, **kwargs):
+                self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+                self._ssl_context.options |= ssl.OP_NO_SSLv2
+                self._ssl_context.sslsocket_class = HTTPSSocket
+                super(HTTPS, self).__init__(*args, **kwargs)
+
+            def _connect(self, host, port):
+                server_hostname = host.decode("ISO-8859-1") if ssl.HAS_SNI else None
+                s = self._ssl_context.wrap_socket(socket(AF_INET, SOCK_STREAM), server_hostname=server_hostname)
+                s.connect_timeout = self.connect_timeout
+                s.read_timeout = self.read_timeout
+                s.write_timeout = self.write_timeout
+                s.connect((host, port))
+                self._socket = s
+                self._reset()
+
+    elif sys.version_info >= (2, 7):
 
         class HTTPS(HTTP):
             """ This class allows communication via SSL.
@@ -1064,10 +3849,10 @@ else:
 
             _ssl_context = None
 
-            def __init__(self, authority=None, **headers):
+            def __init__(self, *args, **kwargs):
                 self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
                 self._ssl_context.options |= ssl.OP_NO_SSLv2
-                super(HTTPS, self).__init__(authority, **headers)
+                super(HTTPS, self).__init__(*args, **kwargs)
 
             def _connect(self, host, port):
                 super(HTTPS, self)._connect(host, port)
@@ -1083,8 +3868,8 @@ else:
 
             _ssl_context = None
 
-            def __init__(self, authority=None, **headers):
-                super(HTTPS, self).__init__(authority, **headers)
+            def __init__(self, *args, **kwargs):
+                super(HTTPS, self).__init__(*args, **kwargs)
 
             def _connect(self, host, port):
                 super(HTTPS, self)._connect(host, port)
@@ -1093,68 +3878,1232 @@ else:
     __all__.insert(1, "HTTPS")
 
 
-# TODO: follow redirects
-# TODO: throw exceptions on 400/500
-class Resource(object):
+class HTTPPool(object):
+    """ A thread-safe pool of keep-alive connections, keyed by scheme, host
+    and port. Connections are checked out with :meth:`acquire` and are
+    returned to the pool automatically as soon as the last outstanding
+    response on them has been fully read. Connections closed in the
+    meantime (for example, following a :code:`Connection: close` response)
+    are dropped from the pool instead.
+
+    Idle connections are reused most recently released first, so that
+    surplus connections fall idle and are evicted once they have been
+    idle for longer than `idle_timeout` seconds.
+
+    ::
+
+        >>> pool = HTTPPool(max_connections_per_host=4)
+        >>> http = pool.acquire(b"http", b"httq.io:8080")
+        >>> print(http.get(b"/hello").response().content)
+        hello, world
+
+    :param max_connections_per_host: maximum number of connections (idle
+                                     or in use) to any one host
+    :param max_connections: maximum number of connections overall
+    :param idle_timeout: seconds after which idle connections are closed
+    :param options: connection options (such as `read_timeout`) for each
+                    connection created
+    """
+
+    def __init__(self, max_connections_per_host=10, max_connections=100, idle_timeout=60.0, **options):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._options = options
+        self._condition = Condition(RLock())
+        self._idle = {}         # key -> list of idle connections, most recently released last
+        self._counts = {}       # key -> number of connections, idle or in use
+        self._count = 0
+        self._next_sweep = 0
+
+    def __len__(self):
+        """ Total number of connections, idle or in use.
+        """
+        return self._count
 
-    def __init__(self, uri, **headers):
-        scheme, authority, path, query, fragment = parse_uri(uri)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def acquire(self, scheme, authority, timeout=None, **headers):
+        """ Check out a connection to the host identified by `scheme` and
+        `authority`, reusing an idle connection if one is available. If
+        the pool is full, wait for up to `timeout` seconds for a connection
+        to be released.
+
+        :param scheme: :code:`b"http"` or :code:`b"https"`
+        :param authority: the URI authority to which to connect
+        :param timeout: seconds to wait for a connection when the pool is
+                        full, or :const:`None` to wait indefinitely
+        :param headers: headers to pass into each request on the connection
+        :raise SocketTimeout: if no connection becomes available in time
+        """
+        user_info, host, port = parse_uri_authority(authority)
         if scheme == b"http":
-            self.http = HTTP(authority, **headers)
-            self.path = bstr(path)  # TODO: include querystring
+            cls = HTTP
         elif scheme == b"https":
-            self.http = HTTPS(authority, **headers)
-            self.path = bstr(path)  # TODO: include querystring
+            cls = HTTPS
+        else:
+            raise ValueError("Unsupported scheme %r" % scheme)
+        key = (scheme, host, port or cls.DEFAULT_PORT)
+        deadline = None if timeout is None else clock() + timeout
+
+        condition = self._condition
+        with condition:
+            while True:
+                now = clock()
+                if now >= self._next_sweep:
+                    self._sweep(now)
+                idle = self._idle.get(key)
+                while idle:
+                    http = idle.pop()
+                    if self._usable(http, now):
+                        http._idle_since = None
+                        http._set_connection_headers(user_info, host, port, headers)
+                        return http
+                    self._discard(http)
+                if self._counts.get(key, 0) < self.max_connections_per_host:
+                    if self._count < self.max_connections or self._evict_one():
+                        # Reserve a slot and connect outside of the lock
+                        self._counts[key] = self._counts.get(key, 0) + 1
+                        self._count += 1
+                        break
+                if deadline is None:
+                    condition.wait()
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise SocketTimeout("Timed out waiting for a pooled connection")
+                    condition.wait(remaining)
+
+        try:
+            http = cls(authority, **dict(self._options, **headers))
+        except Exception:
+            with condition:
+                self._forget(key)
+            raise
+        http._pool = self
+        http._pool_key = key
+        return http
+
+    def release(self, http):
+        """ Return a connection to the pool. This is carried out automatically
+        once all responses on the connection have been read, so need only
+        be called for a connection that is no longer required before then.
+        Connections that have been closed, or which have requests
+        outstanding, are dropped from the pool.
+        """
+        with self._condition:
+            if http._pool is not self or http._idle_since is not None:
+                return
+            if http._socket is None or http._requests or self.idle_timeout <= 0:
+                self._discard(http)
+            else:
+                http._idle_since = clock()
+                self._idle.setdefault(http._pool_key, []).append(http)
+            self._condition.notify()
+
+    def close(self):
+        """ Close all idle connections. Connections currently in use are
+        closed when released.
+        """
+        with self._condition:
+            for idle in list(self._idle.values()):
+                while idle:
+                    self._discard(idle.pop())
+            self.idle_timeout = 0
+
+    def _usable(self, http, now):
+        # Checks whether an idle connection can be reused: it must be open,
+        # not idle for too long and have nothing to read, as an idle socket
+        # that is readable has been closed by the peer.
+        s = http._socket
+        if s is None or now - http._idle_since > self.idle_timeout:
+            return False
+        try:
+            ready_to_read, _, _ = select((s,), (), (), 0)
+        except (ValueError, socket_error):
+            return False
+        return not ready_to_read
+
+    def _discard(self, http):
+        # Drops a connection from the pool, closing it if still open
+        if http._pool is not self:
+            return
+        http._pool = None
+        http._idle_since = None
+        self._forget(http._pool_key)
+        if http._socket is not None:
+            try:
+                http.close()
+            except socket_error:
+                pass
+
+    def _forget(self, key):
+        count = self._counts[key] - 1
+        if count:
+            self._counts[key] = count
+        else:
+            del self._counts[key]
+            self._idle.pop(key, None)
+        self._count -= 1
+        self._condition.notify()
+
+    def _evict_one(self):
+        # Closes the longest idle connection, to make room for another
+        oldest = None
+        for idle in self._idle.values():
+            if idle and (oldest is None or idle[0]._idle_since < oldest._idle_since):
+                oldest = idle[0]
+        if oldest is None:
+            return False
+        self._idle[oldest._pool_key].remove(oldest)
+        self._discard(oldest)
+        return True
+
+    def _sweep(self, now):
+        # Closes all connections idle for longer than the idle timeout
+        idle_timeout = self.idle_timeout
+        for idle in list(self._idle.values()):
+            while idle and now - idle[0]._idle_since > idle_timeout:
+                self._discard(idle.pop(0))
+        self._next_sweep = now + min(max(idle_timeout, 0), 1.0)
+
+
+default_pool = HTTPPool()
+
+
+class ResponseFuture(object):
+    """ The eventual response to a request submitted to an
+    :class:`HTTPMultiplexer` or :class:`HTTPPipeline`, delivered as a
+    :class:`Response` that holds the response in full, or an error
+    raised in its place. Waiting for a multiplexed request drives the
+    multiplexer, so that a single thread can submit any number of
+    requests and then collect their responses. Waiting for a pipelined
+    request blocks until the pipeline has read its response.
+    """
+
+    __slots__ = ["method", "url", "_multiplexer", "_key", "_data", "_callbacks", "_response", "_error", "_done",
+                 "_retry", "_event"]
+
+    _lock = Lock()  # guards the completion of futures resolved in other threads
+
+    def __init__(self, multiplexer, key, method, url, data):
+        #: The request method.
+        self.method = method
+        #: The URL requested, relative to the host.
+        self.url = url
+        self._multiplexer = multiplexer
+        self._key = key
+        self._data = data       # the request, as a list of bytes-like objects
+        self._callbacks = []
+        self._response = None
+        self._error = None
+        self._done = False
+        self._retry = True      # whether the request can be sent again on another connection
+        self._event = Event() if multiplexer is None else None
+
+    def __repr__(self):
+        return "<ResponseFuture %s %s (%s)>" % (self.method.decode("ISO-8859-1"), self.url.decode("ISO-8859-1"),
+                                                "done" if self._done else "pending")
+
+    def done(self):
+        """ Whether the response has been received or the request has failed.
+        """
+        return self._done
+
+    def result(self, timeout=None):
+        """ Return the response, waiting until it arrives.
+
+        :param timeout: seconds to wait, or :const:`None` to wait
+                        indefinitely
+        :return: a :class:`Response` holding the response in full
+        :raise SocketTimeout: if the response does not arrive in time
+        """
+        self._wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+    def exception(self, timeout=None):
+        """ Return the error raised in place of a response, or :const:`None`
+        if the response was received, waiting for one or the other.
+
+        :param timeout: seconds to wait, or :const:`None` to wait
+                        indefinitely
+        :raise SocketTimeout: if neither arrives in time
+        """
+        self._wait(timeout)
+        return self._error
+
+    def add_done_callback(self, callback):
+        """ Arrange for `callback` to be called with this future once done,
+        or straight away if it already is. Callbacks for pipelined requests
+        are called from the thread reading responses.
+        """
+        with self._lock:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _wait(self, timeout):
+        if self._event is not None:
+            if not self._event.wait(timeout):
+                raise SocketTimeout("Timed out waiting for a response")
+            return
+        deadline = None if timeout is None else clock() + timeout
+        while not self._done:
+            if deadline is None:
+                self._multiplexer.poll()
+            else:
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    raise SocketTimeout("Timed out waiting for a response")
+                self._multiplexer.poll(remaining)
+
+    def _resolve(self, response, error):
+        with self._lock:
+            self._response = response
+            self._error = error
+            self._done = True
+            self._data = None
+            callbacks, self._callbacks = self._callbacks, []
+        if self._event is not None:
+            self._event.set()
+        for callback in callbacks:
+            callback(self)
+
+
+class MultiplexedConnection(object):
+    """ The state of a non-blocking connection driven by an
+    :class:`HTTPMultiplexer`.
+    """
+
+    __slots__ = ["key", "socket", "parser", "connected", "events", "future", "output", "response", "decoder",
+                 "received", "reused", "recv_size", "deadline", "exchange_deadline", "idle_since"]
+
+    def __init__(self, key, s):
+        self.key = key
+        self.socket = s
+        self.parser = ResponseParser()
+        self.connected = False
+        self.events = EVENT_WRITE       # events for which the socket is registered
+        self.future = None              # the exchange in progress, if any
+        self.output = []                # buffers of the request still to be sent
+        self.response = None            # Response receiving the content
+        self.decoder = None
+        self.received = False           # whether any of the response has arrived
+        self.reused = False             # whether the connection was idle before this exchange
+        self.recv_size = MIN_RECV_SIZE  # adapts to the rate at which data arrives
+        self.deadline = None            # clock time by which further progress must be made
+        self.exchange_deadline = None   # clock time by which the exchange must complete
+        self.idle_since = None
+
+
+class HTTPMultiplexer(object):
+    """ Drives many HTTP connections at once from a single thread, waiting
+    on all of them together with the most efficient selector available
+    (epoll on Linux, kqueue on BSD and macOS). Requests are queued with
+    :meth:`submit` and each is sent as soon as a connection to its host is
+    free. Connections are opened as needed, within the limits given, and
+    kept alive for reuse. All sending and receiving is non-blocking and
+    takes place within :meth:`poll`, which is called by :meth:`run` and
+    while waiting on a :class:`ResponseFuture`::
+
+        mux = HTTPMultiplexer(max_connections_per_host=50)
+        futures = [mux.submit(b"GET", url) for url in urls]
+        mux.run()
+        for future in futures:
+            print(future.url, future.result().status_code)
+
+    Each response is received in full and delivered as a
+    :class:`Response`, which has no connection of its own. Only plain
+    :code:`http` URLs and fixed-length request bodies are supported. Host
+    names are resolved before connecting, which blocks. Instances are not
+    thread-safe and should be driven from one thread only.
+
+    :param max_connections_per_host: most connections to open to any one
+                                     host
+    :param max_connections: most connections to open in total
+    :param idle_timeout: seconds for which an idle connection is kept open
+                         for reuse
+    :param options: options for :class:`HTTP`, including timeouts, applied
+                    to each connection and response
+    """
+
+    def __init__(self, max_connections_per_host=10, max_connections=1000, idle_timeout=60.0, **options):
+        if DefaultSelector is None:
+            raise NotImplementedError("HTTPMultiplexer requires the selectors module")
+        #: Most connections to open to any one host.
+        self.max_connections_per_host = max_connections_per_host
+        #: Most connections to open in total.
+        self.max_connections = max_connections
+        #: Seconds for which an idle connection is kept open for reuse.
+        self.idle_timeout = idle_timeout
+        self._options = options
+        self._connect_timeout = options.get("connect_timeout")
+        self._read_timeout = options.get("read_timeout")
+        self._write_timeout = options.get("write_timeout")
+        self._timeout = options.get("timeout")
+        self._timed = any(timeout is not None for timeout in [self._connect_timeout, self._read_timeout,
+                                                              self._write_timeout, self._timeout])
+        self._selector = DefaultSelector()
+        self._templates = {}    # unconnected HTTP instances for building requests, by authority
+        self._settings = HTTP(**options)    # unconnected HTTP instance for decoding responses
+        self._queues = {}       # futures waiting for a connection, by address
+        self._idle = {}         # idle connections, by address
+        self._counts = {}       # number of open connections, by address
+        self._count = 0
+        self._busy = set()      # connections with an exchange in progress
+        self._pending = 0       # number of futures not yet done
+        self._next_sweep = clock()
+
+    def __len__(self):
+        """ Total number of connections, idle or in use.
+        """
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def pending(self):
+        """ Number of requests submitted that are yet to complete.
+        """
+        return self._pending
+
+    def submit(self, method, url, body=b"", callback=None, **headers):
+        """ Queue a request, to be sent as soon as a connection to its host
+        is free.
+
+        :param method: request method, e.g. :code:`b'GET'`
+        :param url: absolute :code:`http` URL for this request
+        :param body: the byte content to send with this request, or a value
+                     to send as JSON
+        :param callback: function to be called with the
+                         :class:`ResponseFuture` once done
+        :param headers: extra headers for this request
+        :return: a :class:`ResponseFuture`
+        """
+        scheme, authority, path, query, _ = parse_uri(url)
+        if scheme != b"http" or not authority:
+            raise ValueError("Unsupported URL %r" % url)
+        if body is None or isinstance(body, PathLike) or hasattr(body, "read"):
+            raise ValueError("Only fixed-length content can be multiplexed")
+        target = path or b"/"
+        if query is not None:
+            target += b"?" + query
+        template = self._template(authority)
+        method, target, data, _ = template._build_request(method, target, body, headers)
+        future = ResponseFuture(self, (template._host, template._port), method, target, data)
+        if callback is not None:
+            future.add_done_callback(callback)
+        self._pending += 1
+        self._queues.setdefault(future._key, deque()).append(future)
+        self._dispatch(future._key)
+        return future
+
+    def run(self, timeout=None):
+        """ Drive all connections until every request submitted has
+        completed, or until `timeout` seconds have passed.
+
+        :return: the number of requests yet to complete
+        """
+        deadline = None if timeout is None else clock() + timeout
+        while self._pending:
+            if deadline is None:
+                self.poll()
+            else:
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    break
+                self.poll(remaining)
+        return self._pending
+
+    def poll(self, timeout=None):
+        """ Wait for up to `timeout` seconds for any connection to become
+        ready, then make whatever progress can be made on each that is.
+        Callbacks for requests completed are called from here.
+
+        :return: the number of requests yet to complete
+        """
+        now = clock()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        if not self._selector.get_map():
+            return self._pending
+        deadline = self._nearest_deadline() if self._timed else None
+        if deadline is not None:
+            wait = max(deadline - now, 0)
+            if timeout is None or wait < timeout:
+                timeout = wait
+        for key, events in self._selector.select(timeout):
+            connection = key.data
+            if events & EVENT_WRITE and connection.socket is not None:
+                self._writable(connection)
+            if events & EVENT_READ and connection.socket is not None:
+                self._readable(connection)
+        if deadline is not None:
+            self._expire(clock())
+        return self._pending
+
+    def close(self):
+        """ Close all connections, failing any requests yet to complete.
+        """
+        error = SocketError("Multiplexer closed")
+        for key in list(self._selector.get_map().values()):
+            connection = key.data
+            future = connection.future
+            self._close(connection)
+            if future is not None:
+                self._resolve(future, None, error)
+        self._idle.clear()
+        queues, self._queues = self._queues, {}
+        for queue in queues.values():
+            for future in queue:
+                self._resolve(future, None, error)
+        self._selector.close()
+
+    def _template(self, authority):
+        # Return an unconnected HTTP instance with which to build requests
+        # for `authority`
+        http = self._templates.get(authority)
+        if http is None:
+            http = self._templates[authority] = HTTP(**self._options)
+            headers = dict(http._connection_headers)
+            http._set_authority(authority, None)
+            http._connection_headers.update(headers)
+        return http
+
+    def _dispatch(self, key):
+        # Start exchanges queued for `key` on idle connections, or on new
+        # connections while the limits allow
+        queue = self._queues.get(key)
+        idle = self._idle.get(key)
+        while queue:
+            if idle:
+                connection = idle.pop()
+                connection.idle_since = None
+                connection.reused = True
+            elif self._counts.get(key, 0) < self.max_connections_per_host and \
+                    (self._count < self.max_connections or self._evict_one()):
+                try:
+                    connection = self._open(key)
+                except socket_error as error:
+                    self._resolve(queue.popleft(), None, error)
+                    continue
+            else:
+                return
+            self._start(connection, queue.popleft())
+        self._queues.pop(key, None)
+
+    def _dispatch_all(self):
+        # Start whatever queued exchanges can be started, as after a
+        # connection is closed
+        for key in list(self._queues):
+            self._dispatch(key)
+
+    def _open(self, key):
+        s = socket(AF_INET, SOCK_STREAM)
+        try:
+            s.setblocking(False)
+            s.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            error = s.connect_ex(key)
+            if error not in (0, EINPROGRESS, EWOULDBLOCK):
+                raise SocketError("Could not connect to %r (%s)" % (key, os.strerror(error)))
+        except Exception:
+            s.close()
+            raise
+        connection = MultiplexedConnection(key, s)
+        self._selector.register(s, EVENT_WRITE, connection)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._count += 1
+        self._deadline(connection, self._connect_timeout)
+        return connection
+
+    def _start(self, connection, future):
+        connection.future = future
+        connection.output = [memoryview(buffer) for buffer in gather(list(future._data))]
+        connection.received = False
+        connection.parser.start(future.method == b"HEAD")
+        self._busy.add(connection)
+        if self._timeout is not None:
+            connection.exchange_deadline = clock() + self._timeout
+        if connection.connected:
+            self._send(connection)
+        elif self._timeout is not None:
+            self._deadline(connection, self._connect_timeout)
+
+    def _register(self, connection, events):
+        if events != connection.events:
+            self._selector.modify(connection.socket, events, connection)
+            connection.events = events
+
+    def _deadline(self, connection, timeout):
+        # Set the time by which `connection` must make further progress
+        deadline = connection.exchange_deadline
+        if timeout is not None:
+            step = clock() + timeout
+            if deadline is None or step < deadline:
+                deadline = step
+        connection.deadline = deadline
+
+    def _nearest_deadline(self):
+        nearest = None
+        for connection in self._busy:
+            deadline = connection.deadline
+            if deadline is not None and (nearest is None or deadline < nearest):
+                nearest = deadline
+        return nearest
+
+    def _expire(self, now):
+        for connection in [c for c in self._busy if c.deadline is not None and c.deadline <= now]:
+            phase = "sending" if connection.output else "receiving" if connection.connected else "connecting"
+            self._abort(connection, SocketTimeout("Timed out %s" % phase), retry=False)
+
+    def _writable(self, connection):
+        if not connection.connected:
+            error = connection.socket.getsockopt(SOL_SOCKET, SO_ERROR)
+            if error:
+                self._abort(connection, SocketError("Could not connect to %r (%s)" % (connection.key,
+                                                                                      os.strerror(error))))
+                return
+            connection.connected = True
+        if connection.future is None:
+            self._register(connection, EVENT_READ)
+        else:
+            self._send(connection)
+
+    def _send(self, connection):
+        # Send as much of the request as the connection will take
+        s = connection.socket
+        output = connection.output
+        try:
+            while output:
+                if len(output) > 1 and hasattr(s, "sendmsg"):
+                    sent = s.sendmsg(output[:MAX_SEND_BUFFERS])
+                else:
+                    sent = s.send(output[0])
+                # Drop whatever was sent in full and trim a partial send
+                while sent:
+                    size = len(output[0])
+                    if sent < size:
+                        output[0] = output[0][sent:]
+                        break
+                    sent -= size
+                    del output[0]
+        except socket_error as error:
+            if error.errno not in (EAGAIN, EWOULDBLOCK):
+                self._abort(connection, error)
+                return
+        if output:
+            self._deadline(connection, self._write_timeout)
+            self._register(connection, EVENT_READ | EVENT_WRITE)
+        else:
+            self._deadline(connection, self._read_timeout)
+            self._register(connection, EVENT_READ)
+
+    def _readable(self, connection):
+        s = connection.socket
+        parser = connection.parser
+        buffer = parser.buffer
+        size = connection.recv_size
+        try:
+            received = s.recv_into(buffer.get_buffer(size), size)
+        except socket_error as error:
+            if error.errno not in (EAGAIN, EWOULDBLOCK):
+                self._abort(connection, error)
+            return
+        if connection.future is None:
+            # An idle connection only becomes readable once closed by the peer
+            self._idle[connection.key].remove(connection)
+            self._close(connection)
+            self._dispatch_all()
+            return
+        if received:
+            buffer.buffer_updated(received)
+            connection.received = True
+            if received == size:
+                if size < MAX_RECV_SIZE:
+                    connection.recv_size = 2 * size
+            elif 4 * received < size and size > MIN_RECV_SIZE:
+                connection.recv_size = size // 2
         else:
+            parser.feed(b"")
+        try:
+            event = parser.next_event(MAX_RECV_SIZE)
+            while event is not NEED_DATA:
+                if event is END_OF_MESSAGE:
+                    if connection.decoder is not None:
+                        connection.response._append(connection.decoder.flush())
+                    break
+                elif isinstance(event, ResponseHead):
+                    self._head(connection, event)
+                elif not isinstance(event, Trailers):
+                    self._content(connection, event)
+                event = parser.next_event(MAX_RECV_SIZE)
+        except Exception as error:
+            # Anything raised by the parser or decoder, for a malformed
+            # response, fails this exchange alone
+            self._abort(connection, error)
+            return
+        if event is END_OF_MESSAGE:
+            self._complete(connection, closed=not received)
+        else:
+            self._deadline(connection, self._read_timeout)
+
+    def _head(self, connection, head):
+        settings = self._settings
+        response = connection.response = Response(head, None, None, settings.spill_threshold, settings.json_codec)
+        response._raw_content = bytearray()
+        connection.decoder = None if head.framing is None else settings._content_decoder(head.headers)
+
+    def _content(self, connection, data):
+        response = connection.response
+        decoder = connection.decoder
+        if decoder is None:
+            response._append(data)
+        else:
+            data = decoder.decode(data, MAX_RECV_SIZE)
+            while data:
+                response._append(data)
+                data = decoder.more(MAX_RECV_SIZE)
+
+    def _complete(self, connection, closed):
+        response = connection.response
+        future = connection.future
+        connection.future = connection.response = connection.decoder = None
+        connection.deadline = connection.exchange_deadline = None
+        self._busy.discard(connection)
+        if closed or not response._persistent() or self.idle_timeout <= 0:
+            self._close(connection)
+            self._dispatch_all()
+        else:
+            connection.idle_since = clock()
+            self._idle.setdefault(connection.key, []).append(connection)
+            self._dispatch(connection.key)
+        self._resolve(future, response, None)
+
+    def _abort(self, connection, error, retry=True):
+        # Close `connection` and fail its exchange, unless the request can
+        # be sent again on another connection
+        future = connection.future
+        self._close(connection)
+        if future is not None:
+            if retry and future._retry and future.method in IDEMPOTENT_METHODS and \
+                    connection.reused and not connection.received:
+                # The peer may have closed the connection just as it was
+                # reused, so send the request again where that does no harm
+                future._retry = False
+                self._queues.setdefault(future._key, deque()).appendleft(future)
+            else:
+                self._resolve(future, None, error)
+        self._dispatch_all()
+
+    def _close(self, connection):
+        s = connection.socket
+        if s is None:
+            return
+        connection.socket = None
+        self._busy.discard(connection)
+        self._selector.unregister(s)
+        s.close()
+        key = connection.key
+        count = self._counts[key] - 1
+        if count:
+            self._counts[key] = count
+        else:
+            del self._counts[key]
+        self._count -= 1
+
+    def _resolve(self, future, response, error):
+        self._pending -= 1
+        future._resolve(response, error)
+
+    def _evict_one(self):
+        # Closes the longest idle connection, to make room for another
+        oldest = None
+        for idle in self._idle.values():
+            if idle and (oldest is None or idle[0].idle_since < oldest.idle_since):
+                oldest = idle[0]
+        if oldest is None:
+            return False
+        self._idle[oldest.key].remove(oldest)
+        self._close(oldest)
+        return True
+
+    def _sweep(self, now):
+        # Closes all connections idle for longer than the idle timeout
+        idle_timeout = self.idle_timeout
+        for idle in list(self._idle.values()):
+            while idle and now - idle[0].idle_since > idle_timeout:
+                self._close(idle.pop(0))
+        self._next_sweep = now + min(max(idle_timeout, 0), 1.0)
+
+
+class HTTPPipeline(object):
+    """ Shares one keep-alive connection between threads by pipelining
+    requests. Each request is sent as soon as it is submitted, without
+    waiting for the responses to those before it. A background thread
+    reads the responses back in order and routes each to the
+    :class:`ResponseFuture` for its request::
+
+        pipeline = HTTPPipeline(b"graph.example.com:7474", max_depth=16)
+        futures = [pipeline.submit(b"GET", url) for url in urls]
+        nodes = [future.result().content for future in futures]
+
+    Once `max_depth` requests are outstanding, :meth:`submit` blocks until
+    a response arrives. Only idempotent requests (such as GET and PUT) are
+    pipelined. A request with any other method (such as POST) waits for
+    all outstanding responses and is sent alone, and requests after it
+    wait for its response in turn.
+
+    If the connection is lost, or the server closes it after a response,
+    a new connection is made. Outstanding idempotent requests are then
+    sent again, but the request at the head of the pipeline is sent again
+    only once. Other requests are failed, since they may already have
+    been carried out.
+
+    Each response is read in full and delivered as a :class:`Response`,
+    which has no connection of its own and can be handed to any thread.
+    Only fixed-length request bodies are supported.
+
+    :param authority: the URI authority to which to connect
+    :param max_depth: most requests to have outstanding at once
+    :param options: options for :class:`HTTP`, including timeouts, applied
+                    to the connection and each response
+    """
+
+    def __init__(self, authority, max_depth=8, **options):
+        #: Most requests to have outstanding on the connection at once.
+        self.max_depth = max_depth
+        self._options = options
+        self._http = HTTP(authority, **options)
+        self._connected = True
+        self._condition = Condition()
+        self._outstanding = deque()     # futures for requests sent, oldest first
+        self._sending = False           # whether a request is being sent
+        self._broken = False            # whether the connection is being replaced
+        self._closed = False
+        self._reader = Thread(target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def pending(self):
+        """ Number of requests sent that are yet to receive a response.
+        """
+        return len(self._outstanding)
+
+    def submit(self, method, url, body=b"", **headers):
+        """ Send a request once there is room in the pipeline.
+
+        :param method: request method, e.g. :code:`b'GET'`
+        :param url: relative URL for this request
+        :param body: the byte content to send with this request, or a value
+                     to send as JSON
+        :param headers: extra headers for this request
+        :return: a :class:`ResponseFuture`
+        :raise SocketError: if the pipeline has been closed
+        """
+        if body is None or isinstance(body, PathLike) or hasattr(body, "read"):
+            raise ValueError("Only fixed-length content can be pipelined")
+        condition = self._condition
+        with condition:
+            method, url, data, _ = self._http._build_request(method, url, body, headers)
+            future = ResponseFuture(None, None, method, url, data)
+            outstanding = self._outstanding
+            while not self._closed:
+                if not (self._sending or self._broken):
+                    if not outstanding:
+                        break
+                    if len(outstanding) < self.max_depth and method in IDEMPOTENT_METHODS and \
+                            outstanding[-1].method in IDEMPOTENT_METHODS:
+                        break
+                condition.wait()
+            if self._closed:
+                raise SocketError("Pipeline closed")
+            if not self._connected:
+                self._http.reconnect()
+                self._connected = True
+            self._sending = True
+            outstanding.append(future)
+            s = self._http._socket
+            condition.notify_all()
+        try:
+            s.send_x(data)
+        except (IOError, socket_error):
+            # Shut the connection down so that the reader replaces it and
+            # the request is sent again
+            try:
+                s.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass
+        finally:
+            with condition:
+                self._sending = False
+                condition.notify_all()
+        return future
+
+    def close(self):
+        """ Close the connection, failing any requests yet to receive a
+        response.
+        """
+        condition = self._condition
+        with condition:
+            if self._closed:
+                return
+            self._closed = True
+            condition.notify_all()
+            while self._sending:
+                condition.wait()
+            outstanding = list(self._outstanding)
+            self._outstanding.clear()
+        try:
+            self._http.close()
+        except socket_error:
+            pass    # already disconnected
+        error = SocketError("Pipeline closed")
+        for future in outstanding:
+            future._resolve(None, error)
+
+    def _read(self):
+        # Read responses in order, for as long as the pipeline is open
+        condition = self._condition
+        while True:
+            with condition:
+                while not self._outstanding and not self._closed:
+                    condition.wait()
+                if self._closed:
+                    return
+                future = self._outstanding[0]
+                s = self._http._socket
+            try:
+                response = self._receive(s, future.method)
+            except (IOError, socket_error) as error:
+                if not self._closed:
+                    self._reconnect(error)
+                continue
+            except Exception as error:
+                # The response itself is malformed, so fail its request
+                # rather than sending that again, and then start afresh
+                # on a new connection for the rest
+                with condition:
+                    if self._closed:
+                        return
+                    self._outstanding.popleft()
+                future._resolve(None, error)
+                self._reconnect(None)
+                continue
+            with condition:
+                if self._closed:
+                    return
+                self._outstanding.popleft()
+                condition.notify_all()
+            future._resolve(response, None)
+            if not response._persistent():
+                self._reconnect(None)
+
+    def _receive(self, s, method):
+        # Read the next response in full into a Response of its own
+        head, receiver = s.recv_response(method == b"HEAD")
+        http = self._http
+        response = Response(head, None, None, http.spill_threshold, http.json_codec)
+        if receiver is not None:
+            response._raw_content = bytearray()
+            decoder = http._content_decoder(head.headers)
+            if decoder is not None:
+                receiver = DecodedContent(receiver, decoder)
+            for data in receiver:
+                response._append(data)
+        return response
+
+    def _reconnect(self, error):
+        # Replace the connection, after it has been lost with `error` or
+        # closed by the server, and send outstanding requests again where
+        # that is safe
+        condition = self._condition
+        failed = []
+        with condition:
+            self._broken = True
+            while self._sending:
+                condition.wait()
+            outstanding = list(self._outstanding)
+            self._outstanding.clear()
+            resend = []
+            for i, future in enumerate(outstanding):
+                if future.method not in IDEMPOTENT_METHODS:
+                    failed.append((future, error or SocketError("Connection closed with request outstanding")))
+                elif i == 0 and error is not None:
+                    # This request may itself be the cause
+                    if future._retry and not isinstance(error, SocketTimeout):
+                        future._retry = False
+                        resend.append(future)
+                    else:
+                        failed.append((future, error))
+                else:
+                    resend.append(future)
+            try:
+                self._http.reconnect()
+                s = self._http._socket
+                while resend:
+                    future = resend[0]
+                    s.send_x(future._data)
+                    self._outstanding.append(resend.pop(0))
+            except (IOError, socket_error) as reconnect_error:
+                self._connected = False
+                failed.extend((future, reconnect_error) for future in list(self._outstanding) + resend)
+                self._outstanding.clear()
+            self._broken = False
+            condition.notify_all()
+        for future, error in failed:
+            future._resolve(None, error)
+
+
+# TODO: follow redirects
+# TODO: throw exceptions on 400/500
+def range_validator(http):
+    """ Return the validator with which a request for part of the resource
+    whose response is on `http` can be made conditional on it being
+    unchanged (for an :code:`If-Range` header), or :const:`None` if there
+    is no suitable validator. Weak ETags cannot be used.
+    """
+    headers = http.headers
+    etag = headers.get(b"Etag")
+    if etag and not etag.startswith(b"W/"):
+        return etag
+    return headers.get(b"Last-Modified")
+
+
+class Resource(object):
+    """ A remote resource, identified by URI. Requests are carried out over
+    connections drawn from `pool` (the module-level :data:`default_pool`
+    unless otherwise specified) so that connections are reused.
+
+    Each request method returns a detached :class:`Response`, which
+    keeps its own status, headers and content. Once that content has
+    been fully received, the connection it arrived on goes back to the
+    pool for other requests to use. Content of known length up to
+    :data:`MAX_RECV_SIZE` bytes is received straight away for this
+    reason, while a response with more content holds on to its
+    connection until that content is read.
+    """
+
+    #: Seconds to wait for a pooled connection when every connection to
+    #: the host is held by a response whose content is still unread
+    #: (:const:`None` to wait indefinitely).
+    acquire_timeout = 60.0
+
+    def __init__(self, uri, pool=None, **headers):
+        scheme, authority, path, query, fragment = parse_uri(uri)
+        if scheme not in (b"http", b"https"):
             raise ValueError("Unsupported scheme '%s'" % scheme)
+        self.scheme = scheme
+        self.authority = authority
+        self.path = bstr(path)  # TODO: include querystring
+        self.pool = default_pool if pool is None else pool
+        self.headers = headers
+
+    def _request(self, method, body, headers):
+        pool = self.pool
+        retry = True
+        position = None
+        if hasattr(body, "read"):
+            # File content is sent from the current position, to which it
+            # must be returned before the request can be sent again
+            try:
+                position = body.tell()
+            except (AttributeError, IOError, ValueError):
+                retry = False
+        while True:
+            http = pool.acquire(self.scheme, self.authority, self.acquire_timeout, **self.headers)
+            try:
+                response = http.request(method, self.path, body, **headers).response(detach=True)
+                receiver = response._receiver
+                if receiver is not None and receiver.remaining is not None and receiver.remaining <= MAX_RECV_SIZE:
+                    # Receive small content now, so that the connection
+                    # goes back to the pool without waiting for it to be read
+                    response._receive()
+                return response
+            except SocketError:
+                # The connection may have been closed by the peer while idle,
+                # so retry once on another, but only where carrying out the
+                # request twice would do no harm
+                http.close()
+                if not retry or method not in IDEMPOTENT_METHODS:
+                    raise
+                retry = False
+                if position is not None:
+                    body.seek(position)
+            except Exception:
+                http.close()
+                raise
 
     def get(self, **headers):
-        http = self.http
-        try:
-            return http.get(self.path, **headers).response()
-        except SocketError:
-            http.reconnect()
-            return http.get(self.path, **headers).response()
+        return self._request(b"GET", b"", headers)
 
     def head(self, **headers):
-        http = self.http
-        try:
-            return http.head(self.path, **headers).response()
-        except SocketError:
-            http.reconnect()
-            return http.head(self.path, **headers).response()
+        return self._request(b"HEAD", b"", headers)
 
     def put(self, content, **headers):
-        http = self.http
-        try:
-            return http.put(self.path, content, **headers).response()
-        except SocketError:
-            http.reconnect()
-            return http.put(self.path, content, **headers).response()
+        return self._request(b"PUT", content, headers)
 
     def patch(self, content, **headers):
-        http = self.http
-        try:
-            return http.patch(self.path, content, **headers).response()
-        except SocketError:
-            http.reconnect()
-            return http.patch(self.path, content, **headers).response()
+        return self._request(b"PATCH", content, headers)
 
     def post(self, content, **headers):
-        http = self.http
-        try:
-            return http.post(self.path, content, **headers).response()
-        except SocketError:
-            http.reconnect()
-            return http.post(self.path, content, **headers).response()
+        return self._request(b"POST", content, headers)
 
     def delete(self, **headers):
-        http = self.http
+        return self._request(b"DELETE", b"", headers)
+
+    def download(self, file, fsync=False, progress=None, segments=1, retries=2, **headers):
+        """ Save the content of this resource to a file, as for
+        :meth:`HTTP.save`. The status of the response should be checked
+        through the :class:`Response` returned.
+
+        If `segments` is more than one, a HEAD request is made first. When
+        the response advertises :code:`Accept-Ranges: bytes` and a content
+        length, the content is split into that many byte ranges, which are
+        fetched concurrently over separate connections and written into
+        place in a preallocated file. A range whose connection fails is
+        resumed on its own, up to `retries` times. Otherwise, the content
+        is downloaded as a single stream.
+
+        If the connection for a single stream fails part way through, the
+        download is resumed on a new connection, up to `retries` times. The
+        request for the remainder carries a :code:`Range` header from the
+        number of bytes already written, and an :code:`If-Range` header
+        with the strong ETag (or Last-Modified date) of the original
+        response. A :code:`206` response is appended to what has been
+        written while a :code:`200` response, sent if the resource has
+        changed, replaces it. With several segments, any
+        `progress` callable is called from several threads and a failure
+        to fetch a range is raised as an :class:`IOError`.
+
+        ::
+
+            >>> Resource(b"http://example.com/big.iso").download("big.iso", segments=4)
+
+        :return: the :class:`Response` to the GET (or, for a segmented
+                 download, the HEAD) request
+        """
+        if segments > 1 and hasattr(os, "pwrite"):
+            http = self.head(**headers)
+            response_headers = http.headers
+            if http.status_code == 200 and b"Content-Length" in response_headers and \
+                    response_headers.get(b"Accept-Ranges", b"").lower() == b"bytes":
+                size = int(response_headers[b"Content-Length"])
+                writer = ContentWriter(file, size, progress)
+                try:
+                    if writer.fd is None or writer.position is None:
+                        http = self._download_stream(self.get(**headers), writer, retries, headers)
+                    else:
+                        resource_validator = range_validator(http)
+                        if resource_validator:
+                            headers = dict(headers, if_range=resource_validator)
+                        self._download_ranges(writer, size, segments, retries, headers)
+                finally:
+                    writer.close(fsync)
+                return http
+        http = self.get(**headers)
+        writer = ContentWriter(file, http._content_remaining(), progress)
+        try:
+            return self._download_stream(http, writer, retries, headers)
+        finally:
+            writer.close(fsync)
+
+    def _download_stream(self, http, writer, retries, headers):
+        # Save the content of the response `http`, resuming on a new
+        # connection if the one it arrives on fails, and return the last
+        # response received
+        resource_validator = range_validator(http) if http.status_code == 200 else None
+        while True:
+            try:
+                http._save(writer)
+                return http
+            except SocketError:
+                http.close()
+                if not retries:
+                    raise
+                retries -= 1
+            if resource_validator is None:
+                writer.rewind()
+                http = self.get(**headers)
+                continue
+            offset = writer.written
+            http = self.get(**dict(headers, range=b"bytes=" + bstr(offset) + b"-", if_range=resource_validator))
+            if http.status_code == 200:
+                writer.rewind()
+                resource_validator = range_validator(http)
+            elif http.status_code != 206 or \
+                    not http.headers.get(b"Content-Range", b"").startswith(b"bytes " + bstr(offset) + b"-"):
+                http.close()
+                raise IOError("Download could not be resumed from byte %d" % offset)
+
+    def _download_ranges(self, writer, size, segments, retries, headers):
+        # Fetch `size` bytes of content in `segments` ranges, one thread per
+        # range, raising the first error encountered
+        step = -(-size // segments)
+        errors = []
+        threads = [Thread(target=self._download_range, args=(writer, start, min(start + step, size), size,
+                                                             retries, headers, errors))
+                   for start in range(0, size, step)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        if writer.written != size:
+            raise IOError("Downloaded %d of %d bytes" % (writer.written, size))
+
+    def _download_range(self, writer, start, end, size, retries, headers, errors):
+        # Fetch bytes `start` to `end` (exclusive) of the content into place,
+        # resuming from where the last attempt stopped if a connection fails
         try:
-            return http.delete(self.path, **headers).response()
-        except SocketError:
-            http.reconnect()
-            return http.delete(self.path, **headers).response()
+            view = memoryview(bytearray(MAX_RECV_SIZE))
+            offset = start
+            while offset < end:
+                http = self.pool.acquire(self.scheme, self.authority, **self.headers)
+                try:
+                    http.get(self.path, range=b"bytes=" + bstr(offset) + b"-" + bstr(end - 1), **headers).response()
+                    content_range = http.headers.get(b"Content-Range", b"")
+                    if http.status_code != 206 or not content_range.startswith(b"bytes " + bstr(offset) + b"-") \
+                            or not content_range.endswith(b"/" + bstr(size)):
+                        raise IOError("Range %d-%d not served as requested" % (offset, end - 1))
+                    received = http.readinto(view[:min(len(view), end - offset)])
+                    while received:
+                        writer.write_at(view[:received], offset)
+                        offset += received
+                        received = http.readinto(view[:min(len(view), end - offset)])
+                    if offset < end:
+                        raise SocketError("Range %d-%d ended early" % (offset, end - 1))
+                    if http.readable():
+                        # More content than requested
+                        http.close()
+                except SocketError:
+                    http.close()
+                    if not retries:
+                        raise
+                    retries -= 1
+                except Exception:
+                    http.close()
+                    raise
+        except Exception as error:
+            errors.append(error)
 
 
 def get(url, **headers):
@@ -0,0 +1,720 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2015, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" asyncio counterparts of :class:`httq.HTTP` and :class:`httq.HTTPS`.
+
+Request building and response parsing are shared with the blocking classes;
+only the I/O differs. Every method that touches the network is a coroutine,
+so a single event loop can drive many connections at once::
+
+    async with AsyncHTTP(b"httq.io:8080") as http:
+        await http.get(b"/hello")
+        await http.response()
+        print(await http.readall())
+
+This module requires Python 3.6 or above.
+"""
+
+import asyncio
+from socket import IPPROTO_TCP
+
+from httq import HTTP, ContentEncoder, ContentWriter, EventStreamParser, JSONArraySplitter, ResponseParser, SocketError, \
+    SocketTimeout, NEED_DATA, END_OF_MESSAGE, MAX_RECV_SIZE, SEND_FILE_BUFFER_SIZE, TCP_CORK, bstr, clock, get_json_codec, \
+    split_lines
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+
+__all__ = ["AsyncHTTP"]
+
+
+class AsyncContent(object):
+    """ Asynchronous iterator over the content of a response received by
+    an :class:`AsyncHTTP` instance.
+    """
+
+    __slots__ = ["_http"]
+
+    def __init__(self, http):
+        self._http = http
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.read(MAX_RECV_SIZE)
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    @property
+    def remaining(self):
+        """ Number of content bytes still to be received, if known.
+        """
+        return self._http._parser.remaining
+
+    async def read(self, size):
+        """ Receive and return between one and `size` bytes of content, or
+        :code:`b""` if the content is exhausted.
+        """
+        return await self._http._recv_data(size)
+
+    async def readinto(self, b):
+        """ Receive content into the writable buffer `b`, returning the
+        number of bytes received or zero if the content is exhausted.
+        """
+        data = await self.read(len(b))
+        size = len(data)
+        b[:size] = data
+        return size
+
+
+class AsyncDecodedContent(object):
+    """ Asynchronous iterator over decoded response content, wrapping an
+    :class:`AsyncContent` iterator over the encoded content as received.
+    """
+
+    __slots__ = ["_content", "_decoder", "_done"]
+
+    def __init__(self, content, decoder):
+        self._content = content
+        self._decoder = decoder
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.read(MAX_RECV_SIZE)
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    @property
+    def remaining(self):
+        """ Number of content bytes still to be received, which is not known
+        for decoded content.
+        """
+        return None
+
+    async def read(self, size):
+        """ Receive and return between one and `size` bytes of decoded
+        content, or :code:`b""` if the content is exhausted.
+        """
+        decoder = self._decoder
+        data = decoder.more(size)
+        while not data and not self._done:
+            encoded = await self._content.read(MAX_RECV_SIZE)
+            if encoded:
+                data = decoder.decode(encoded, size)
+            else:
+                self._done = True
+                data = decoder.flush()
+        return data
+
+    async def readinto(self, b):
+        """ Receive decoded content into the writable buffer `b`, returning
+        the number of bytes received or zero if the content is exhausted.
+        """
+        data = await self.read(len(b))
+        size = len(data)
+        b[:size] = data
+        return size
+
+
+class AsyncHTTP(HTTP):
+    """ Asynchronous HTTP client built on asyncio streams.
+
+    The interface mirrors that of :class:`httq.HTTP`, except that every
+    method involving network I/O is a coroutine and the content iterators
+    are asynchronous generators. The connection is established on the
+    first request (or on entry to an ``async with`` block) rather than
+    on construction. Timeouts behave as for :class:`httq.HTTP` and are
+    reported by raising :class:`httq.SocketTimeout`.
+    """
+
+    _reader = None
+    _writer = None
+    _parser = None
+    _deadline = None
+
+    def __init__(self, authority=None, connect_timeout=None, read_timeout=None, write_timeout=None,
+                 timeout=None, spill_threshold=None, decompress=False, compress=None, compress_threshold=1024,
+                 json_codec=None, flush_threshold=65536, cork=False, **headers):
+        super(AsyncHTTP, self).__init__(None, connect_timeout, read_timeout, write_timeout, timeout, spill_threshold,
+                                        decompress, compress, compress_threshold, json_codec, flush_threshold, cork)
+        if authority:
+            self._set_authority(authority, headers)
+        elif headers:
+            self._add_connection_headers(**headers)
+
+    def __del__(self):
+        self.close()
+
+    async def __aenter__(self):
+        if self._writer is None:
+            await self._connect(self._host, self._port)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        writer = self._writer
+        self.close()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except (OSError, asyncio.CancelledError):
+                pass
+
+    def _open_connection(self, host, port):
+        return asyncio.open_connection(host.decode("ISO-8859-1"), port, limit=MAX_RECV_SIZE)
+
+    async def _connect(self, host, port):
+        if host is None:
+            raise IOError("No authority specified")
+        try:
+            self._reader, self._writer = await self._wait(self.connect_timeout, self._open_connection, host, port)
+        except SocketTimeout:
+            raise SocketTimeout("Timed out connecting to %r" % ((host, port),))
+        self._parser = ResponseParser()
+        self._requests.clear()
+        self._discard_output()
+
+    async def connect(self, authority, **headers):
+        """ Establish a connection to a remote host.
+
+        :param authority: the URI authority to which to connect
+        :param headers: headers to pass into each request for this connection
+        """
+        self._set_authority(authority, headers)
+        await self._connect(self._host, self._port)
+
+    async def reconnect(self):
+        """ Re-establish a connection to the same remote host.
+        """
+        self._close_writer()
+        await self._connect(self._host, self._port)
+
+    def _close_writer(self):
+        writer = self._writer
+        self._reader = self._writer = None
+        if writer is not None:
+            try:
+                writer.close()
+            except RuntimeError:
+                # The event loop has already been closed
+                pass
+
+    def close(self):
+        """ Close the current connection. Unlike :class:`httq.HTTP`, the
+        connection headers are kept, so the next request will reconnect
+        to the same host.
+        """
+        self._close_writer()
+        self._receiver = None
+        self._deadline = None
+        self._requests.clear()
+        self._discard_output()
+
+    async def _wait(self, timeout, f, *args):
+        # Call `f` and await the result within `timeout` seconds (or within
+        # the time remaining before the request deadline, if sooner)
+        deadline = self._deadline
+        if deadline is not None:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                raise SocketTimeout("Request deadline exceeded")
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        if timeout is None:
+            return await f(*args)
+        try:
+            return await asyncio.wait_for(f(*args), timeout)
+        except asyncio.TimeoutError:
+            raise SocketTimeout("Timed out")
+
+    async def _send(self, data):
+        # As for HTTPSocket.send_x, `data` may be a list of byte strings,
+        # which the transport can send without joining
+        if isinstance(data, list):
+            self._writer.writelines(data)
+        else:
+            self._writer.write(data)
+        try:
+            await self._wait(self.write_timeout, self._writer.drain)
+        except SocketTimeout:
+            raise SocketTimeout("Timed out sending data")
+        except ConnectionError as error:
+            raise SocketError(error)
+
+    def _cork(self, corked):
+        # As for HTTPSocket.cork, applied to the socket under the transport
+        sock = self._writer.get_extra_info("socket")
+        if TCP_CORK is None or sock is None:
+            return False
+        sock.setsockopt(IPPROTO_TCP, TCP_CORK, 1 if corked else 0)
+        return True
+
+    async def _send_file(self, f, size):
+        # Send `size` bytes from the current position of file object `f`,
+        # through the event loop's sendfile where available (Python 3.7+)
+        sendfile = getattr(asyncio.get_event_loop(), "sendfile", None)
+        if sendfile is not None:
+            try:
+                sent = await self._wait(None, sendfile, self._writer.transport, f, f.tell(), size)
+            except ConnectionError as error:
+                raise SocketError(error)
+            if sent < size:
+                raise IOError("File ended with %d bytes still to send" % (size - sent))
+        else:
+            while size:
+                data = f.read(min(size, SEND_FILE_BUFFER_SIZE))
+                if not data:
+                    raise IOError("File ended with %d bytes still to send" % size)
+                await self._send(data)
+                size -= len(data)
+
+    async def _recv(self, size):
+        try:
+            return await self._wait(self.read_timeout, self._reader.read, size)
+        except SocketTimeout:
+            raise SocketTimeout("Timed out receiving data")
+        except ConnectionError as error:
+            raise SocketError(error)
+
+    async def _next_event(self, size=MAX_RECV_SIZE):
+        parser = self._parser
+        event = parser.next_event(size)
+        while event is NEED_DATA:
+            parser.feed(await self._recv(MAX_RECV_SIZE))
+            event = parser.next_event(size)
+        return event
+
+    async def _recv_data(self, size):
+        # Return between 1 and `size` bytes of content, or b"" at the end of
+        # the content. Data arriving after the parsed head is received
+        # straight from the stream rather than through the parser's buffer.
+        parser = self._parser
+        while True:
+            direct = parser.direct()
+            if direct:
+                data = await self._recv(size if direct < 0 else min(size, direct))
+                parser.content_received(len(data))
+                if data:
+                    return data
+            event = await self._next_event(size)
+            if event is END_OF_MESSAGE:
+                return b""
+            elif isinstance(event, bytes):
+                return event
+
+    async def request(self, method, url, body=None, flush=True, **headers):
+        """ Make or initiate a request to the remote host, connecting first
+        if necessary. See :meth:`httq.HTTP.request` for details.
+        """
+        if self._writable:
+            await self.write(b"")
+        if self._writer is None:
+            await self._connect(self._host, self._port)
+
+        method, url, data, request_headers = self._build_request(method, url, body, headers)
+        upload = None if isinstance(data[-1], bytes) else data.pop()
+
+        # Send
+        if self.timeout is not None and not self._requests:
+            self._deadline = clock() + self.timeout
+        self._deferred = not flush
+        if upload is None:
+            await self._put(data)
+        else:
+            corked = self.cork and self._cork(True)
+            try:
+                await self._send(self._take_output() + data)
+                await self._send_file(upload, int(request_headers[b"Content-Length"]))
+            finally:
+                if corked:
+                    self._cork(False)
+                if upload is not body:
+                    upload.close()
+        self._requests.append((method, url, request_headers))
+
+        return self
+
+    async def send(self, prepared, body=None, flush=True, **params):
+        """ Make or initiate a request prepared earlier by :meth:`prepare`,
+        connecting first if necessary. See :meth:`httq.HTTP.send` for details.
+        """
+        if self._writable:
+            await self.write(b"")
+        if self._writer is None:
+            await self._connect(self._host, self._port)
+
+        url, data, request_headers = prepared.render(body, **params)
+        self._writable = b"Transfer-Encoding" in request_headers
+        self._encoder = ContentEncoder(prepared._compress) if self._writable and prepared._compress else None
+
+        # Send
+        if self.timeout is not None and not self._requests:
+            self._deadline = clock() + self.timeout
+        self._deferred = not flush
+        await self._put(data)
+        self._requests.append((prepared.method, url, request_headers))
+
+        return self
+
+    async def write(self, *chunks):
+        """ Write one or more chunks of request data to the remote host.
+        See :meth:`httq.HTTP.write` for details.
+        """
+        assert self._writable, "No chunked request sent"
+        await self._put(self._build_chunks(chunks))
+        return self
+
+    async def flush(self):
+        """ Send any request data held back by deferred requests.
+        See :meth:`httq.HTTP.flush` for details.
+        """
+        output = self._take_output()
+        if output:
+            corked = self.cork and self._cork(True)
+            try:
+                await self._send(output)
+            finally:
+                if corked:
+                    self._cork(False)
+        return self
+
+    async def _put(self, data):
+        if not self._output and not self._deferred:
+            await self._send(data)
+            return
+        self._output += data
+        self._output_size += sum(len(b) for b in data)
+        if not self._deferred or self._output_size >= self.flush_threshold:
+            await self.flush()
+
+    async def response(self):
+        """ Read the status line and headers for the next response.
+
+        :return: this AsyncHTTP instance
+        """
+        if not self._requests:
+            raise IOError("No requests outstanding")
+        if self._output:
+            await self.flush()
+
+        if self._receiver is not None:
+            # Discard the remainder of the previous response
+            async for _ in self._receiver:
+                pass
+            self._receiver = None
+            self._finish()
+
+        self._parser.start(self.request_method == b"HEAD")
+        head = await self._next_event()
+        self._start_response(head)
+        if head.framing is None:
+            await self._next_event()
+            self._receiver = None
+            self._finish()
+        else:
+            decoder = self._content_decoder(head.headers)
+            if decoder is None:
+                self._receiver = AsyncContent(self)
+            else:
+                self._receiver = AsyncDecodedContent(AsyncContent(self), decoder)
+        return self
+
+    def _finish(self):
+        self._requests.popleft()
+        if self.timeout is not None:
+            # The next pipelined exchange gets a fresh allowance
+            self._deadline = clock() + self.timeout if self._requests else None
+        if not self._persistent():
+            self.close()
+
+    async def _receive(self, size=-1):
+        # Receive content into _raw_content until it holds at least `size`
+        # unread bytes, or until all content has been received if `size`
+        # is -1. Content beyond the spill threshold is held in a memory-
+        # mapped temporary file.
+        receiver = self._receiver
+        if not self._filled:
+            self._raw_content = bytearray()
+        end = None if size == -1 else self._offset + size
+        more = True
+        while more and (end is None or self._filled < end):
+            data = await receiver.read(MAX_RECV_SIZE)
+            if data:
+                self._append(data)
+                more = receiver.remaining != 0
+            else:
+                more = False
+        if not more:
+            self._receiver = None
+            self._finish()
+
+    async def read(self, size=-1):
+        """ Read and return up to `size` bytes of response content, waiting
+        until that much is available or the content is exhausted.
+        """
+        if size == -1:
+            return await self.readall()
+        if self._receiver is not None and self._filled - self._offset < size:
+            await self._receive(size)
+        return self._take(size)
+
+    async def readall(self):
+        """ Read and return all available response content.
+        """
+        if self._receiver is not None:
+            await self._receive()
+        return self._take()
+
+    async def readinto(self, b):
+        """ Read response content into a pre-allocated, writable bytes-like
+        object until it is full or the content is exhausted. See
+        :meth:`httq.HTTP.readinto` for details.
+
+        :param b: the buffer to fill
+        :return: the number of bytes read
+        """
+        view = memoryview(b)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast("B")
+        size = len(view)
+        count = 0
+
+        # Any content already received by read()
+        offset = self._offset
+        if offset < self._filled:
+            count = min(size, self._filled - offset)
+            view[:count] = memoryview(self._raw_content)[offset:(offset + count)]
+            self._offset = offset + count
+
+        receiver = self._receiver
+        while count < size and receiver is not None:
+            received = await receiver.readinto(view[count:])
+            if received == 0:
+                self._receiver = receiver = None
+                self._finish()
+            else:
+                count += received
+        if receiver is not None and receiver.remaining == 0:
+            self._receiver = None
+            self._finish()
+        return count
+
+    async def save(self, file, fsync=False, progress=None):
+        """ Save the remaining response content to a file. File writes are
+        made from the event loop thread. See :meth:`httq.HTTP.save` for
+        details.
+        """
+        writer = ContentWriter(file, self._content_remaining(), progress)
+        try:
+            view = memoryview(bytearray(MAX_RECV_SIZE))
+            received = await self.readinto(view)
+            while received:
+                writer.write(view[:received])
+                received = await self.readinto(view)
+        finally:
+            writer.close(fsync)
+        return writer.written
+
+    async def iter_content(self, chunk_size=None, retain=False):
+        """ Asynchronously iterate through response content as it is
+        received. See :meth:`httq.HTTP.iter_content` for details.
+
+        ::
+
+            async for chunk in http.iter_content():
+                out.write(chunk)
+
+        :param chunk_size: maximum number of bytes per chunk, or
+                           :const:`None` for no limit
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        size = chunk_size or MAX_RECV_SIZE
+
+        # Any content already received by read()
+        while self._offset < self._filled:
+            yield self._take(size)
+
+        receiver = self._receiver
+        while receiver is not None:
+            data = await receiver.read(size)
+            if data:
+                if retain:
+                    self._retain(data)
+                yield data
+            else:
+                self._receiver = receiver = None
+                self._finish()
+
+    async def iter_lines(self, retain=False):
+        """ Asynchronously iterate through lines of response content as it
+        is received. See :meth:`httq.HTTP.iter_lines` for details.
+
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        pending = []
+        async for chunk in self.iter_content(retain=retain):
+            for line in split_lines(chunk, pending):
+                yield line
+        if pending:
+            for line in split_lines(b"\n", pending):
+                yield line
+
+    async def iter_ndjson(self, retain=False):
+        """ Asynchronously iterate through the records of NDJSON response
+        content as it is received. See :meth:`httq.HTTP.iter_ndjson` for
+        details.
+
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        loads = get_json_codec(self.json_codec).loads
+        pending = []
+        async for chunk in self.iter_content(retain=retain):
+            # Any trailing carriage return is whitespace to the decoder
+            lines = chunk.split(b"\n")
+            if pending:
+                pending.append(lines[0])
+                lines[0] = b"".join(pending)
+                del pending[:]
+            last = lines.pop()
+            if last:
+                pending.append(last)
+            for line in lines:
+                if line and not line.isspace():
+                    yield loads(line)
+        if pending:
+            line = b"".join(pending)
+            if not line.isspace():
+                yield loads(line)
+
+    async def iter_events(self, last_event_id=""):
+        """ Asynchronously iterate through the events of a
+        :code:`text/event-stream` response as it is received. See
+        :meth:`httq.HTTP.iter_events` for details.
+
+        :param last_event_id: the ID given to events before the stream
+                              sets one
+        """
+        parser = EventStreamParser(last_event_id)
+        async for chunk in self.iter_content():
+            for event in parser.feed(chunk):
+                yield event
+
+    async def events(self, url, last_event_id="", reconnect=True, retry=3000, **headers):
+        """ Asynchronously subscribe to a stream of Server-Sent Events,
+        reconnecting as needed. See :meth:`httq.HTTP.events` for details.
+
+        :param url: relative URL of the event stream
+        :param last_event_id: ID of the last event already seen, if any
+        :param reconnect: if :const:`False`, end when the connection is
+                          lost or the stream ends
+        :param retry: milliseconds to wait before reconnecting, unless the
+                      stream sets a reconnection time with :code:`retry:`
+        :param headers: extra headers for each request
+        :raise IOError: if a response is not an event stream
+        """
+        parser = EventStreamParser(last_event_id)
+        headers.setdefault("accept", b"text/event-stream")
+        headers.setdefault("cache_control", b"no-cache")
+        while True:
+            if parser.last_event_id:
+                headers["last_event_id"] = bstr(parser.last_event_id, "UTF-8")
+            try:
+                await self.get(url, **headers)
+                await self.response()
+            except (SocketError, OSError):
+                if not reconnect:
+                    raise
+            else:
+                if self.status_code == 204:
+                    return
+                if self.status_code != 200 or self.content_type != "text/event-stream":
+                    raise IOError("Expected an event stream, received %s %s (%s)" %
+                                  (self.status_code, self.reason, self.content_type))
+                try:
+                    async for chunk in self.iter_content():
+                        for event in parser.feed(chunk):
+                            yield event
+                except (SocketError, OSError):
+                    pass    # lost connection, as for the end of the stream
+            if not reconnect:
+                return
+            parser.reset()
+            # The next request reconnects
+            self.close()
+            await asyncio.sleep((retry if parser.retry is None else parser.retry) / 1000.0)
+
+    async def iter_json(self, path=(), retain=False):
+        """ Asynchronously iterate through the items of an array within
+        JSON response content as it is received. See
+        :meth:`httq.HTTP.iter_json` for details.
+
+        :param path: sequence of object keys and array indexes leading to
+                     the array, or empty for a top-level array
+        :param retain: if :const:`True`, also retain content so that it is
+                       subsequently available through :attr:`content`
+        """
+        splitter = JSONArraySplitter(path)
+        loads = get_json_codec(self.json_codec).loads
+        async for chunk in self.iter_content(retain=retain):
+            items = splitter.feed(chunk)
+            if items:
+                for item in loads(b"[" + items + b"]"):
+                    yield item
+        splitter.close()
+
+    @property
+    def content(self):
+        """ Full, typed content from the last response. The content must
+        first have been received, for example by awaiting :meth:`readall`
+        or by iterating with `retain` set.
+        """
+        if self._receiver is not None:
+            raise IOError("Response content has not been received")
+        return super(AsyncHTTP, self).content
+
+
+if ssl is not None:
+
+    class AsyncHTTPS(AsyncHTTP):
+        """ Secure counterpart of :class:`AsyncHTTP`.
+        """
+
+        #: The default port for HTTPS traffic.
+        DEFAULT_PORT = 443
+
+        def __init__(self, *args, **kwargs):
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            self._ssl_context.options |= ssl.OP_NO_SSLv2
+            super(AsyncHTTPS, self).__init__(*args, **kwargs)
+
+        def _open_connection(self, host, port):
+            host = host.decode("ISO-8859-1")
+            return asyncio.open_connection(host, port, ssl=self._ssl_context, server_hostname=host,
+                                           limit=MAX_RECV_SIZE)
+
+    __all__.insert(1, "AsyncHTTPS")
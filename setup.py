@@ -32,7 +32,7 @@ setup(
     author=__author__,
     author_email=__email__,
     url="http://httq.io/",
-    py_modules=["httq"],
+    py_modules=["httq", "httq_async"],
     scripts=["httq.py"],
     entry_points={
         "console_scripts": [
@@ -1,9 +1,128 @@
 
-from socket import SHUT_RDWR
+from base64 import b64encode
+from hashlib import sha1
+from io import BytesIO
+from mmap import mmap
+from os import devnull
+from os.path import join as path_join
+from shutil import rmtree
+from socket import socket, SHUT_RDWR, SOL_SOCKET, SO_LINGER, error as socket_error
+from subprocess import call
+from tempfile import NamedTemporaryFile, mkdtemp
+from threading import Event, Thread
+from time import sleep, time
 from unittest import TestCase, main
+from json import dumps as json_dumps, loads as json_loads
+from struct import pack, unpack
+import ssl
 import sys
-
-from httq import bstr, parse_uri, HTTPSocket, HTTP, HTTPS
+import zlib
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import httq
+from httq import bstr, hexb, gather, parse_uri, ReceiveBuffer, ResponseParser, ContentDecoder, ContentEncoder, Trailers, HTTPSocket, HTTP, HTTPS, Response, HTTPPool, \
+    Resource, HTTPMultiplexer, HTTPPipeline, EventStreamParser, JSONArraySplitter, WebSocket, WebSocketParser, JSONCodec, register_json_codec, get_json_codec, set_json_codec, SocketError, SocketTimeout, MessageTooBig, NEED_DATA, END_OF_MESSAGE, READ_CHUNKED, READ_SIZED, READ_UNTIL_CLOSED
+
+
+class LocalServer(Thread):
+    """ Minimal HTTP/1.1 server for behaviour that the public test server
+    does not provide. For each request, `handler` is called with the
+    connection, method, target, headers (a dictionary keyed by lower case
+    name) and body. It should write a complete response and may return
+    :const:`False` to close the connection afterwards. Connections are
+    secured with `ssl_context`, if given.
+    """
+
+    def __init__(self, handler, ssl_context=None):
+        Thread.__init__(self)
+        self.daemon = True
+        self.handler = handler
+        self.ssl_context = ssl_context
+        self.listener = socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.authority = b"127.0.0.1:" + bstr(self.listener.getsockname()[1])
+        self.start()
+
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except socket_error:
+                return
+            thread = Thread(target=self.serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, connection):
+        if self.ssl_context is not None:
+            try:
+                connection = self.ssl_context.wrap_socket(connection, server_side=True)
+            except (ssl.SSLError, socket_error):
+                connection.close()
+                return
+        reader = connection.makefile("rb")
+        try:
+            while True:
+                request_line = reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.split(b" ", 2)
+                headers = {}
+                while True:
+                    header = reader.readline()
+                    if header in (b"\r\n", b""):
+                        break
+                    name, _, value = header.partition(b":")
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get(b"transfer-encoding") == b"chunked":
+                    chunks = []
+                    while True:
+                        size = int(reader.readline(), 16)
+                        if size == 0:
+                            reader.readline()
+                            break
+                        chunks.append(reader.read(size))
+                        reader.readline()
+                    body = b"".join(chunks)
+                else:
+                    body = reader.read(int(headers.get(b"content-length", 0)))
+                if self.handler(connection, method, target, headers, body) is False:
+                    break
+        except socket_error:
+            pass
+        finally:
+            reader.close()
+            connection.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def server_ssl_context():
+    """ Return an SSL context for a :class:`LocalServer`, with a throwaway
+    self-signed certificate, or :const:`None` if one cannot be made.
+    """
+    directory = mkdtemp()
+    try:
+        key, cert = path_join(directory, "key.pem"), path_join(directory, "cert.pem")
+        try:
+            with open(devnull, "wb") as null:
+                status = call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                               "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert], stdout=null, stderr=null)
+        except OSError:
+            return None
+        if status != 0:
+            return None
+        context = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS_SERVER", ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(cert, key)
+        return context
+    finally:
+        rmtree(directory)
 
 
 class HelperTestCase(TestCase):
@@ -54,6 +173,175 @@ class URITestCase(TestCase):
             assert parse_uri(uri) == parts
 
 
+class ReceiveBufferTestCase(TestCase):
+
+    @staticmethod
+    def receive(buffer, data):
+        view = buffer.get_buffer(len(data))
+        view[:len(data)] = data
+        buffer.buffer_updated(len(data))
+
+    def test_can_receive_and_read(self):
+        buffer = ReceiveBuffer()
+        self.receive(buffer, b"hello, world")
+        assert len(buffer) == 12
+        assert buffer.read(5) == b"hello"
+        assert buffer.read(100) == b", world"
+        assert len(buffer) == 0
+
+    def test_can_find_after_partial_consumption(self):
+        buffer = ReceiveBuffer()
+        self.receive(buffer, b"a\r\nb\r\n")
+        assert buffer.find(b"\r\n") == 1
+        buffer.skip(3)
+        assert buffer.find(b"\r\n") == 1
+        assert buffer.find(b"\r\n", 2) == -1
+
+    def test_can_readinto(self):
+        buffer = ReceiveBuffer()
+        self.receive(buffer, b"hello, world")
+        b = bytearray(5)
+        assert buffer.readinto(b) == 5
+        assert b == b"hello"
+        assert buffer.read(100) == b", world"
+
+    def test_unconsumed_data_survives_compaction(self):
+        buffer = ReceiveBuffer(16)
+        self.receive(buffer, b"0123456789abcdef")
+        buffer.skip(10)
+        self.receive(buffer, b"ghijklmnop")
+        assert buffer.read(100) == b"abcdefghijklmnop"
+
+    def test_buffer_grows_to_fit(self):
+        buffer = ReceiveBuffer(16)
+        self.receive(buffer, b"0123456789")
+        self.receive(buffer, b"x" * 100)
+        assert buffer.read(1000) == b"0123456789" + b"x" * 100
+
+
+class ResponseParserTestCase(TestCase):
+
+    @staticmethod
+    def parse(parser, data, split=None, no_content=False):
+        # Feed `data` to the parser in pieces of `split` bytes (or all at
+        # once), followed by end of file, and return the events produced
+        events = []
+        parser.start(no_content)
+        pieces = [data[i:(i + split)] for i in range(0, len(data), split)] if split else [data]
+        pieces.append(b"")
+        for piece in pieces:
+            parser.feed(piece)
+            while True:
+                event = parser.next_event()
+                if event is NEED_DATA:
+                    break
+                events.append(event)
+                if event is END_OF_MESSAGE:
+                    return events
+        return events
+
+    @staticmethod
+    def content(events):
+        return b"".join(event for event in events if isinstance(event, bytes))
+
+    def test_can_parse_sized_response(self):
+        data = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 12\r\n\r\nhello, world"
+        for split in [None, 1, 2, 7]:
+            events = self.parse(ResponseParser(), data, split)
+            head = events[0]
+            assert head.version == b"HTTP/1.1"
+            assert head.status_code == 200
+            assert head.reason == b"OK"
+            assert head.headers == {b"Content-Type": b"text/plain", b"Content-Length": b"12"}
+            assert head.framing is READ_SIZED
+            assert head.content_length == 12
+            assert self.content(events) == b"hello, world"
+            assert events[-1] is END_OF_MESSAGE
+
+    def test_can_parse_chunked_response(self):
+        data = (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"7;name=value\r\nchunk 1\r\n7\r\nchunk 2\r\n0\r\nX-Checksum: 1234\r\n\r\n")
+        for split in [None, 1, 3, 5]:
+            events = self.parse(ResponseParser(), data, split)
+            assert events[0].framing is READ_CHUNKED
+            assert self.content(events) == b"chunk 1chunk 2"
+            assert isinstance(events[-2], Trailers)
+            assert events[-2].headers == {b"X-Checksum": b"1234"}
+            assert events[-1] is END_OF_MESSAGE
+
+    def test_can_parse_response_until_closed(self):
+        data = b"HTTP/1.0 200 OK\r\n\r\nhello, world"
+        for split in [None, 1, 4]:
+            events = self.parse(ResponseParser(), data, split)
+            assert events[0].framing is READ_UNTIL_CLOSED
+            assert self.content(events) == b"hello, world"
+            assert events[-1] is END_OF_MESSAGE
+
+    def test_can_parse_responses_without_content(self):
+        for data, no_content in [(b"HTTP/1.1 200 OK\r\nContent-Length: 12\r\n\r\n", True),
+                                 (b"HTTP/1.1 204 No Content\r\n\r\n", False),
+                                 (b"HTTP/1.1 304 Not Modified\r\nContent-Length: 12\r\n\r\n", False)]:
+            events = self.parse(ResponseParser(), data, no_content=no_content)
+            assert len(events) == 2
+            assert events[0].framing is None
+            assert events[1] is END_OF_MESSAGE
+
+    def test_can_parse_pipelined_responses(self):
+        parser = ResponseParser()
+        parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\na"
+                    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n1\r\nb\r\n0\r\n\r\n"
+                    b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\nc")
+        for expected in [b"a", b"b", b"c"]:
+            parser.start()
+            assert parser.next_event().status_code == 200
+            assert parser.next_event() == expected
+            assert parser.next_event() is END_OF_MESSAGE
+        assert not parser.buffer
+
+    def test_early_close_is_an_error(self):
+        for data in [b"HTTP/1.1 200 OK\r\nContent-Le",
+                     b"HTTP/1.1 200 OK\r\nContent-Length: 12\r\n\r\nhello",
+                     b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n7\r\nchunk"]:
+            with self.assertRaises(SocketError):
+                self.parse(ResponseParser(), data)
+
+    def test_can_limit_size_of_content_events(self):
+        parser = ResponseParser()
+        parser.start()
+        parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 12\r\n\r\nhello, world")
+        parser.next_event()
+        assert parser.next_event(5) == b"hello"
+        assert parser.remaining == 7
+        assert parser.next_event(5) == b", wor"
+        assert parser.next_event(5) == b"ld"
+        assert parser.next_event(5) is END_OF_MESSAGE
+
+    def test_can_receive_content_directly(self):
+        parser = ResponseParser()
+        parser.start()
+        parser.feed(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhel")
+        parser.next_event()
+        assert parser.direct() == 0
+        assert parser.next_event() == b"hel"
+        assert parser.direct() == 2
+        parser.content_received(2)
+        assert parser.direct() == 0
+        assert parser.next_event() is NEED_DATA
+        parser.feed(b"\r\n0\r\n\r\n")
+        assert parser.next_event() is END_OF_MESSAGE
+
+    def test_can_readinto_from_parser(self):
+        parser = ResponseParser()
+        parser.start()
+        parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello, world")
+        parser.next_event()
+        buffer = bytearray(12)
+        assert parser.readinto(memoryview(buffer)) == 5
+        assert buffer[:5] == b"hello"
+        assert parser.next_event() is END_OF_MESSAGE
+        assert len(parser.buffer) == 7
+
+
 class SendTestCase(TestCase):
 
     def test_can_send_request(self):
@@ -355,6 +643,124 @@ class GetMethodTestCase(TestCase):
         assert http.read(5) == b""
         http.close()
 
+    def test_can_readinto_in_bits(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        b = bytearray(5)
+        assert http.readinto(b) == 5
+        assert b == b"hello"
+        assert http.readable()
+        assert http.readinto(b) == 5
+        assert b == b", wor"
+        assert http.readinto(b) == 2
+        assert b[:2] == b"ld"
+        assert not http.readable()
+        assert http.readinto(b) == 0
+        http.close()
+
+    def test_can_readinto_larger_buffer(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        b = bytearray(100)
+        assert http.readinto(b) == 12
+        assert b[:12] == b"hello, world"
+        assert not http.readable()
+        http.close()
+
+    def test_can_readinto_memoryview_slice(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        b = bytearray(b"[" + b" " * 12 + b"]")
+        assert http.readinto(memoryview(b)[1:13]) == 12
+        assert b == b"[hello, world]"
+        http.close()
+
+    def test_can_readinto_mmap(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        m = mmap(-1, 12)
+        assert http.readinto(m) == 12
+        assert m[:] == b"hello, world"
+        m.close()
+        http.close()
+
+    def test_can_read_some_then_readinto(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        assert http.read(5) == b"hello"
+        b = bytearray(7)
+        assert http.readinto(b) == 7
+        assert b == b", world"
+        assert not http.readable()
+        http.close()
+
+    def test_can_readinto_chunks(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/chunks").response()
+        b = bytearray(100)
+        count = 0
+        while http.readable():
+            count += http.readinto(memoryview(b)[count:])
+        assert b[:count] == b"chunk 1\r\nchunk 2\r\nchunk 3\r\n"
+        http.close()
+
+    def test_can_readinto_unsized_content(self):
+        http = HTTP(b"httq.io:8080", user_agent=b"OldBrowser/1.0")
+        http.get(b"/hello").response()
+        b = bytearray(100)
+        assert http.readinto(b) == 12
+        assert b[:12] == b"hello, world"
+        assert not http.readable()
+
+    def test_can_readinto_then_make_another_request(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        assert http.readinto(bytearray(12)) == 12
+        assert http.get(b"/hello").response().content == "hello, world"
+        http.close()
+
+    def test_can_iterate_content(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/chunks").response()
+        assert list(http.iter_content()) == [b"chunk 1\r\n", b"chunk 2\r\n", b"chunk 3\r\n"]
+        assert not http.readable()
+        http.close()
+
+    def test_can_iterate_content_with_chunk_size(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        chunks = list(http.iter_content(5))
+        assert all(len(chunk) <= 5 for chunk in chunks)
+        assert b"".join(chunks) == b"hello, world"
+        http.close()
+
+    def test_can_iterate_content_after_read(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        assert http.read(5) == b"hello"
+        assert b"".join(http.iter_content()) == b", world"
+        http.close()
+
+    def test_iterated_content_is_not_retained_by_default(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        assert b"".join(http.iter_content()) == b"hello, world"
+        assert http.content == ""
+        http.close()
+
+    def test_iterated_content_can_be_retained(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/hello").response()
+        assert b"".join(http.iter_content(retain=True)) == b"hello, world"
+        assert http.content == "hello, world"
+        http.close()
+
+    def test_can_iterate_lines(self):
+        http = HTTP(b"httq.io:8080")
+        http.get(b"/chunks").response()
+        assert list(http.iter_lines()) == [b"chunk 1", b"chunk 2", b"chunk 3"]
+        http.close()
+
     def test_can_get_http_1_0_for_all_requests(self):
         assert HTTP(b"httq.io:8080", user_agent=b"OldBrowser/1.0").get(b"/hello").response().content == "hello, world"
 
@@ -412,7 +818,2042 @@ class JSONTestCase(TestCase):
         http = HTTP(b"httq.io:8080")
         response = http.post(b"/json?foo=bar", {"bee": "bumble"}).response()
         content = response.content
-        assert content == {"method": "POST", "query": "foo=bar", "content": '{"bee": "bumble"}'}
+        assert content["method"] == "POST"
+        assert json_loads(content["content"]) == {"bee": "bumble"}
+
+
+class JSONCodecTestCase(TestCase):
+
+    def setUp(self):
+        self.bodies = []
+
+        def handler(connection, method, target, headers, body):
+            self.bodies.append(body)
+            if target == b"/latin-1":
+                content_type, content = b"application/json; charset=ISO-8859-1", u'{"name": "Andr\xe9"}'.encode("ISO-8859-1")
+            else:
+                content_type, content = b"application/json", u'{"name": "Andr\xe9"}'.encode("UTF-8")
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: " + content_type + b"\r\nContent-Length: " +
+                               bstr(len(content)) + b"\r\n\r\n" + content)
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_json_content_defaults_to_utf_8(self):
+        http = HTTP(self.server.authority)
+        assert http.get(b"/").response().content == {"name": u"Andr\xe9"}
+        assert http.encoding == "UTF-8"
+        http.close()
+
+    def test_json_content_respects_charset(self):
+        http = HTTP(self.server.authority)
+        assert http.get(b"/latin-1").response().content == {"name": u"Andr\xe9"}
+        http.close()
+
+    def test_can_choose_codec_by_name(self):
+        http = HTTP(self.server.authority, json_codec="json")
+        http.post(b"/", {"bee": "bumble"}).response()
+        http.close()
+        assert self.bodies == [b'{"bee": "bumble"}']
+
+    def test_can_register_codec(self):
+        calls = []
+
+        def dumps(value):
+            calls.append("dumps")
+            return json_dumps(value).encode("UTF-8")
+
+        def loads(data):
+            calls.append("loads")
+            return json_loads(bytes(data).decode("UTF-8"))
+
+        codec = register_json_codec("test", dumps, loads)
+        try:
+            assert get_json_codec("test") is codec
+            http = HTTP(self.server.authority, json_codec="test")
+            assert http.post(b"/", [1, 2, 3]).response().content == {"name": u"Andr\xe9"}
+            http.close()
+        finally:
+            del httq.JSON_CODECS["test"]
+        assert calls == ["dumps", "loads"]
+        assert self.bodies == [b"[1, 2, 3]"]
+
+    def test_can_set_default_codec(self):
+        default = get_json_codec()
+        codec = JSONCodec("upper", lambda value: json_dumps(value).upper().encode("UTF-8"), default.loads)
+        set_json_codec(codec)
+        try:
+            assert httq.json_encode({"bee": "bumble"}) == b'{"BEE": "BUMBLE"}'
+            http = HTTP(self.server.authority)
+            http.post(b"/", {"bee": "bumble"}).response()
+            http.close()
+        finally:
+            set_json_codec(default)
+        assert self.bodies == [b'{"BEE": "BUMBLE"}']
+
+    def test_unknown_codec_is_rejected(self):
+        with self.assertRaises(ValueError):
+            get_json_codec("nonesuch")
+
+    def test_every_codec_handles_awkward_values(self):
+        value = {"big": 2 ** 70, "text": u"Andr\xe9", "list": [None, True, 1.5]}
+        for name in httq.JSON_CODECS:
+            codec = get_json_codec(name)
+            data = codec.dumps(value)
+            assert isinstance(data, bytes)
+            assert json_loads(data.decode("UTF-8")) == value
+            assert codec.loads(bytearray(data)) == codec.loads(memoryview(data)) == codec.loads(data.decode("UTF-8"))
+            assert codec.loads(b"[NaN]")[0] != codec.loads(b"[NaN]")[0]
+
+
+class TimeoutTestCase(TestCase):
+
+    def setUp(self):
+        # A listening socket that accepts connections (via its backlog) but never responds
+        self.server = socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.authority = b"127.0.0.1:" + bstr(self.server.getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_read_timeout_raises_socket_timeout(self):
+        http = HTTP(self.authority, read_timeout=0.2)
+        http.get(b"/hello")
+        t0 = time()
+        with self.assertRaises(SocketTimeout):
+            http.response()
+        assert 0.1 < time() - t0 < 2.0
+        http.close()
+
+    def test_request_timeout_raises_socket_timeout(self):
+        http = HTTP(self.authority, timeout=0.2)
+        http.get(b"/hello")
+        with self.assertRaises(SocketTimeout):
+            http.response()
+        http.close()
+
+    def test_request_timeout_is_tighter_than_read_timeout(self):
+        http = HTTP(self.authority, read_timeout=5, timeout=0.2)
+        http.get(b"/hello")
+        t0 = time()
+        with self.assertRaises(SocketTimeout):
+            http.response()
+        assert time() - t0 < 2.0
+        http.close()
+
+    def test_socket_timeout_is_socket_error(self):
+        assert issubclass(SocketTimeout, IOError)
+
+    def test_timeouts_do_not_interfere_with_normal_responses(self):
+        http = HTTP(b"httq.io:8080", connect_timeout=5, read_timeout=5, write_timeout=5, timeout=5)
+        assert http.get(b"/dots").response().content == "..."
+        assert http.get(b"/hello").response().content == "hello, world"
+        http.close()
+
+
+class GatherTestCase(TestCase):
+
+    def test_small_fragments_are_joined(self):
+        assert gather([b"GET ", b"/", b" HTTP/1.1\r\n", b"\r\n"]) == [b"GET / HTTP/1.1\r\n\r\n"]
+
+    def test_large_fragments_are_not_copied(self):
+        body = b"x" * 1048576
+        buffers = gather([b"POST / HTTP/1.1\r\n", b"\r\n", body, b"\r\n"])
+        assert buffers == [b"POST / HTTP/1.1\r\n\r\n", body, b"\r\n"]
+        assert buffers[1] is body
+
+
+class VectoredSendTestCase(TestCase):
+
+    size = 8 * 1048576
+
+    def setUp(self):
+        def handler(connection, method, target, headers, body):
+            content = bstr(len(body)) + b" " + bstr(body.count(b"x"))
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(len(content)) + b"\r\n\r\n" + content)
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_can_post_large_body(self):
+        http = HTTP(self.server.authority)
+        http.post(b"/", b"x" * self.size)
+        assert http.response().content == bstr(self.size) + b" " + bstr(self.size)
+        http.close()
+
+    def test_can_write_large_chunks(self):
+        http = HTTP(self.server.authority)
+        http.post(b"/")
+        http.write(b"x" * self.size, b"x" * 100, b"x" * self.size, b"")
+        assert http.response().content == bstr(2 * self.size + 100) + b" " + bstr(2 * self.size + 100)
+        http.close()
+
+    def test_can_send_without_vectored_io(self):
+        vectored, HTTPSocket.vectored = HTTPSocket.vectored, False
+        try:
+            http = HTTP(self.server.authority)
+        finally:
+            HTTPSocket.vectored = vectored
+        http.post(b"/", b"x" * self.size)
+        assert http.response().content == bstr(self.size) + b" " + bstr(self.size)
+        http.close()
+
+
+class DeferredFlushTestCase(TestCase):
+
+    def setUp(self):
+        self.received = []
+
+        def handler(connection, method, target, headers, body):
+            self.received.append((method, target, body))
+            content = method + b" " + target + b" " + body
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(len(content)) + b"\r\n\r\n" + content)
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def connect(self, **options):
+        # Returns an HTTP instance along with a list of the data passed to
+        # each send call on its connection
+        http = HTTP(self.server.authority, **options)
+        sends = []
+        send_x = http._socket.send_x
+
+        def counting_send_x(data, timeout=None):
+            sends.append(data)
+            send_x(data, timeout)
+
+        http._socket.send_x = counting_send_x
+        return http, sends
+
+    def test_deferred_requests_are_sent_together(self):
+        http, sends = self.connect()
+        for i in range(10):
+            http.get(b"/" + bstr(i), flush=False)
+        assert sends == []
+        http.flush()
+        assert len(sends) == 1
+        for i in range(10):
+            assert http.response().content == b"GET /" + bstr(i) + b" "
+        http.close()
+
+    def test_response_flushes_deferred_requests(self):
+        http, sends = self.connect()
+        http.get(b"/1", flush=False)
+        http.get(b"/2", flush=False)
+        assert http.response().content == b"GET /1 "
+        assert http.response().content == b"GET /2 "
+        assert len(sends) == 1
+        http.close()
+
+    def test_chunks_written_for_deferred_request_are_held_back(self):
+        http, sends = self.connect()
+        http.post(b"/chunked", flush=False)
+        http.write(b"hello, ")
+        http.write(b"world", b"")
+        assert sends == []
+        assert http.response().content == b"POST /chunked hello, world"
+        assert len(sends) == 1
+        http.close()
+
+    def test_request_sends_data_held_back_before_it(self):
+        http, sends = self.connect()
+        http.get(b"/1", flush=False)
+        http.get(b"/2")
+        assert len(sends) == 1
+        assert http.response().content == b"GET /1 "
+        assert http.response().content == b"GET /2 "
+        http.close()
+
+    def test_deferred_data_is_sent_at_flush_threshold(self):
+        http, sends = self.connect(flush_threshold=1000)
+        http.post(b"/small", b"x" * 10, flush=False)
+        assert sends == []
+        http.post(b"/large", b"x" * 1000, flush=False)
+        assert len(sends) == 1
+        assert http.response().content == b"POST /small " + b"x" * 10
+        assert http.response().content == b"POST /large " + b"x" * 1000
+        http.close()
+
+    def test_can_upload_file_after_deferred_requests(self):
+        http, sends = self.connect(cork=True)
+        http.get(b"/1", flush=False)
+        with NamedTemporaryFile() as f:
+            f.write(b"file content")
+            f.flush()
+            f.seek(0)
+            http.put(b"/upload", f, flush=False)
+            assert len(sends) == 1
+            assert http.response().content == b"GET /1 "
+            assert http.response().content == b"PUT /upload file content"
+        http.close()
+
+    def test_can_cork_connection_while_flushing(self):
+        http, sends = self.connect(cork=True)
+        http.get(b"/1", flush=False)
+        http.get(b"/2", flush=False)
+        http.flush()
+        assert http.response().content == b"GET /1 "
+        assert http.response().content == b"GET /2 "
+        http.close()
+
+    def test_reconnect_discards_deferred_requests(self):
+        http, _ = self.connect()
+        http.get(b"/lost", flush=False)
+        http.reconnect()
+        http.get(b"/kept")
+        assert http.response().content == b"GET /kept "
+        assert self.received == [(b"GET", b"/kept", b"")]
+        http.close()
+
+    def test_secure_reconnect_discards_deferred_requests(self):
+        context = server_ssl_context()
+        if context is None:
+            self.skipTest("Cannot create a certificate")
+        server = LocalServer(self.server.handler, context)
+        try:
+            http = HTTPS(server.authority)
+            http.get(b"/lost", flush=False)
+            http.reconnect()
+            http.get(b"/kept")
+            assert http.response().content == b"GET /kept "
+            assert self.received == [(b"GET", b"/kept", b"")]
+            http.close()
+        finally:
+            server.close()
+
+
+class DetachedResponseTestCase(TestCase):
+
+    size = 1048576
+
+    def setUp(self):
+        def handler(connection, method, target, headers, body):
+            if target == b"/large":
+                content = b"x" * self.size
+            else:
+                content = method + b" " + target
+            status = b"404 Not Found" if target == b"/missing" else b"200 OK"
+            close = target == b"/close"
+            connection.sendall(b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain\r\nContent-Length: " +
+                               bstr(len(content)) + (b"\r\nConnection: close" if close else b"") + b"\r\n\r\n" +
+                               (b"" if method == b"HEAD" else content))
+            if close:
+                return False
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_detached_responses_hold_their_own_state(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/found", flush=False)
+        http.get(b"/missing", flush=False)
+        found = http.response(detach=True)
+        missing = http.response(detach=True)
+        assert isinstance(found, Response)
+        assert (missing.status_code, missing.reason, missing.content) == (404, "Not Found", u"GET /missing")
+        assert (found.status_code, found.reason, found.content) == (200, "OK", u"GET /found")
+        assert found.headers[b"Content-Length"] == b"10"
+        http.close()
+
+    def test_unread_content_is_kept_by_detached_response(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/large", flush=False)
+        http.get(b"/small", flush=False)
+        large = http.response(detach=True)
+        assert large.read(5) == b"xxxxx"
+        small = http.response(detach=True)
+        assert small.content == u"GET /small"
+        assert large.readable()
+        assert len(large.readall()) == self.size - 5
+        assert not large.readable()
+        http.close()
+
+    def test_can_stream_detached_response(self):
+        http = HTTP(self.server.authority)
+        response = http.get(b"/large").response(detach=True)
+        assert sum(len(chunk) for chunk in response.iter_content()) == self.size
+        assert http.get(b"/next").response().content == u"GET /next"
+        http.close()
+
+    def test_detached_response_can_be_read_in_another_thread(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/large", flush=False)
+        http.get(b"/small", flush=False)
+        large = http.response(detach=True)
+        small = http.response(detach=True)
+        # Reading the next response has received the first in full, so it
+        # no longer shares the connection
+        sizes = []
+        thread = Thread(target=lambda: sizes.append(len(large.content)))
+        thread.start()
+        thread.join()
+        assert sizes == [self.size]
+        assert small.content == u"GET /small"
+        http.close()
+
+    def test_can_detach_head_response_pipelined_with_get(self):
+        http = HTTP(self.server.authority)
+        http.head(b"/head", flush=False)
+        http.get(b"/get", flush=False)
+        head = http.response(detach=True)
+        get = http.response(detach=True)
+        assert head.headers[b"Content-Length"] == b"10"
+        assert head.content is None
+        assert get.content == u"GET /get"
+        http.close()
+
+    def test_connection_is_closed_after_detached_response_asks(self):
+        http = HTTP(self.server.authority)
+        response = http.get(b"/close").response(detach=True)
+        assert response.content == u"GET /close"
+        assert http._socket is None
+
+    def test_detached_response_has_no_instance_dictionary(self):
+        http = HTTP(self.server.authority)
+        response = http.get(b"/found").response(detach=True)
+        assert not hasattr(response, "__dict__")
+        http.close()
+
+
+class FileUploadTestCase(TestCase):
+
+    size = 4 * 1048576 + 3
+
+    def setUp(self):
+        self.bodies = []
+
+        def handler(connection, method, target, headers, body):
+            self.bodies.append(body)
+            connection.sendall(b"HTTP/1.1 204 No Content\r\n\r\n")
+
+        self.server = LocalServer(handler)
+        self.file = NamedTemporaryFile()
+        self.file.write(bytes(bytearray(range(256))) * (self.size // 256) + b"end")
+        self.file.flush()
+        self.file.seek(0)
+
+    def tearDown(self):
+        self.file.close()
+        self.server.close()
+
+    def content(self):
+        with open(self.file.name, "rb") as f:
+            return f.read()
+
+    def test_can_upload_file_object(self):
+        http = HTTP(self.server.authority)
+        http.put(b"/upload", self.file)
+        assert http.request_headers[b"Content-Length"] == bstr(self.size)
+        http.response()
+        http.close()
+        assert self.bodies == [self.content()]
+        assert not self.file.closed
+
+    def test_can_upload_file_from_current_position(self):
+        http = HTTP(self.server.authority)
+        self.file.seek(1000)
+        http.put(b"/upload", self.file).response()
+        http.close()
+        assert self.bodies == [self.content()[1000:]]
+
+    def test_can_upload_file_by_path(self):
+        if not httq.PathLike:
+            return
+        from pathlib import Path
+        http = HTTP(self.server.authority)
+        http.post(b"/upload", Path(self.file.name)).response()
+        http.close()
+        assert self.bodies == [self.content()]
+
+    def test_can_upload_in_memory_file(self):
+        http = HTTP(self.server.authority)
+        http.post(b"/upload", BytesIO(b"hello, world")).response()
+        http.close()
+        assert self.bodies == [b"hello, world"]
+
+    def test_can_upload_file_without_zero_copy(self):
+        zero_copy, HTTPSocket.zero_copy = HTTPSocket.zero_copy, False
+        try:
+            http = HTTP(self.server.authority)
+        finally:
+            HTTPSocket.zero_copy = zero_copy
+        http.put(b"/upload", self.file).response()
+        http.close()
+        assert self.bodies == [self.content()]
+
+
+class SaveTestCase(TestCase):
+
+    content = bytes(bytearray(range(256))) * 8192 + b"end"
+
+    def setUp(self):
+        content = self.content
+
+        def handler(connection, method, target, headers, _):
+            if target == b"/chunked":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+                for offset in range(0, len(content), 100000):
+                    chunk = content[offset:(offset + 100000)]
+                    connection.sendall(bstr(hex(len(chunk))[2:]) + b"\r\n" + chunk + b"\r\n")
+                connection.sendall(b"0\r\n\r\n")
+            else:
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(len(content)) + b"\r\n\r\n")
+                connection.sendall(content)
+
+        self.server = LocalServer(handler)
+        self.file = NamedTemporaryFile()
+
+    def tearDown(self):
+        self.file.close()
+        self.server.close()
+
+    def saved(self):
+        with open(self.file.name, "rb") as f:
+            return f.read()
+
+    def test_can_save_sized_content_to_path(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/sized").response()
+        assert http.save(self.file.name, fsync=True) == len(self.content)
+        assert not http.readable()
+        assert self.saved() == self.content
+        assert http.get(b"/sized").response().readall() == self.content
+        http.close()
+
+    def test_can_save_chunked_content_to_file_object(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/chunked").response()
+        self.file.write(b"head")
+        assert http.save(self.file) == len(self.content)
+        assert not self.file.closed
+        self.file.flush()
+        assert self.saved() == b"head" + self.content
+        http.close()
+
+    def test_can_save_to_in_memory_file(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/sized").response()
+        assert http.read(10) == self.content[:10]
+        out = BytesIO()
+        http.save(out)
+        assert out.getvalue() == self.content[10:]
+        http.close()
+
+    def test_save_reports_progress(self):
+        reports = []
+        http = HTTP(self.server.authority)
+        http.get(b"/sized").response()
+        http.save(self.file.name, progress=lambda saved, rate: reports.append((saved, rate)))
+        http.close()
+        assert reports[-1][0] == len(self.content)
+        assert [saved for saved, _ in reports] == sorted(saved for saved, _ in reports)
+        assert all(rate >= 0 for _, rate in reports)
+
+    def test_can_download_resource(self):
+        pool = HTTPPool()
+        resource = Resource(b"http://" + self.server.authority + b"/sized", pool=pool)
+        http = resource.download(self.file.name)
+        assert http.status_code == 200
+        assert self.saved() == self.content
+        assert len(pool) == 1
+        pool.close()
+
+
+class SegmentedDownloadTestCase(TestCase):
+
+    content = bytes(bytearray(range(256))) * 4096 + b"end"
+
+    def setUp(self):
+        self.ranges = []
+        self.accept_ranges = True
+        self.honour_ranges = True
+        self.fail_once = set()
+        self.reset = False
+        content = self.content
+
+        def handler(connection, method, target, headers, _):
+            head = b"HTTP/1.1 200 OK\r\n"
+            if self.accept_ranges:
+                head += b"Accept-Ranges: bytes\r\n"
+            if method == b"HEAD":
+                connection.sendall(head + b"Content-Length: " + bstr(len(content)) + b"\r\n\r\n")
+                return
+            byte_range = headers.get(b"range")
+            self.ranges.append(byte_range)
+            if byte_range is None or not self.honour_ranges:
+                connection.sendall(head + b"Content-Length: " + bstr(len(content)) + b"\r\n\r\n" + content)
+                return
+            first, _, last = byte_range[6:].partition(b"-")
+            start, end = int(first), int(last) + 1
+            connection.sendall(b"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes " + first + b"-" + last +
+                               b"/" + bstr(len(content)) + b"\r\nContent-Length: " + bstr(end - start) +
+                               b"\r\n\r\n")
+            if start in self.fail_once:
+                # Send half of the range then drop the connection
+                self.fail_once.discard(start)
+                connection.sendall(content[start:(start + (end - start) // 2)])
+                if self.reset:
+                    connection.setsockopt(SOL_SOCKET, SO_LINGER, pack("ii", 1, 0))
+                return False
+            connection.sendall(content[start:end])
+
+        self.server = LocalServer(handler)
+        self.pool = HTTPPool()
+        self.resource = Resource(b"http://" + self.server.authority + b"/big", pool=self.pool)
+        self.file = NamedTemporaryFile()
+
+    def tearDown(self):
+        self.file.close()
+        self.pool.close()
+        self.server.close()
+
+    def saved(self):
+        with open(self.file.name, "rb") as f:
+            return f.read()
+
+    def test_can_download_in_segments(self):
+        self.resource.download(self.file.name, segments=4)
+        assert self.saved() == self.content
+        assert len(self.ranges) == 4
+        assert None not in self.ranges
+
+    def test_segments_are_retried_on_their_own(self):
+        self.fail_once.add(0)
+        self.resource.download(self.file.name, segments=4)
+        assert self.saved() == self.content
+        assert len(self.ranges) == 5
+        step = -(-len(self.content) // 4)
+        assert len([r for r in self.ranges if r.endswith(b"-" + bstr(step - 1))]) == 2
+
+    def test_reset_segments_are_retried_on_their_own(self):
+        self.fail_once.add(0)
+        self.reset = True
+        self.resource.download(self.file.name, segments=4)
+        assert self.saved() == self.content
+        assert len(self.ranges) == 5
+
+    def test_progress_covers_whole_content(self):
+        reports = []
+        self.resource.download(self.file.name, progress=lambda saved, rate: reports.append(saved), segments=3)
+        assert max(reports) == len(self.content)
+
+    def test_falls_back_to_single_stream_without_accept_ranges(self):
+        self.accept_ranges = False
+        self.resource.download(self.file.name, segments=4)
+        assert self.saved() == self.content
+        assert self.ranges == [None]
+
+    def test_falls_back_to_single_stream_for_in_memory_file(self):
+        out = BytesIO()
+        self.resource.download(out, segments=4)
+        assert out.getvalue() == self.content
+        assert self.ranges == [None]
+
+    def test_ignored_ranges_raise_error(self):
+        self.honour_ranges = False
+        with self.assertRaises(IOError):
+            self.resource.download(self.file.name, segments=2)
+
+
+class ResumableDownloadTestCase(TestCase):
+
+    content = bytes(bytearray(range(256))) * 4096 + b"end"
+
+    def setUp(self):
+        self.requests = []
+        self.etag = b'"v1"'
+        self.failures = 1
+        self.reset = False
+        content = self.content
+
+        def handler(connection, method, target, headers, _):
+            self.requests.append((headers.get(b"range"), headers.get(b"if-range")))
+            validator = b"ETag: " + self.etag + b"\r\n" if self.etag else b""
+            byte_range = headers.get(b"range")
+            if byte_range and self.etag and headers.get(b"if-range") == self.etag:
+                start = int(byte_range[6:].rstrip(b"-"))
+                connection.sendall(b"HTTP/1.1 206 Partial Content\r\n" + validator + b"Content-Range: bytes " +
+                                   bstr(start) + b"-" + bstr(len(content) - 1) + b"/" + bstr(len(content)) +
+                                   b"\r\nContent-Length: " + bstr(len(content) - start) + b"\r\n\r\n")
+            else:
+                start = 0
+                connection.sendall(b"HTTP/1.1 200 OK\r\n" + validator +
+                                   b"Content-Length: " + bstr(len(content)) + b"\r\n\r\n")
+            if self.failures:
+                # Send part of the content then drop the connection
+                self.failures -= 1
+                connection.sendall(content[start:(start + 300000)])
+                if self.reset:
+                    connection.setsockopt(SOL_SOCKET, SO_LINGER, pack("ii", 1, 0))
+                return False
+            connection.sendall(content[start:])
+
+        self.server = LocalServer(handler)
+        self.pool = HTTPPool()
+        self.resource = Resource(b"http://" + self.server.authority + b"/big", pool=self.pool)
+        self.file = NamedTemporaryFile()
+
+    def tearDown(self):
+        self.file.close()
+        self.pool.close()
+        self.server.close()
+
+    def saved(self):
+        with open(self.file.name, "rb") as f:
+            return f.read()
+
+    def test_can_resume_download(self):
+        http = self.resource.download(self.file.name)
+        assert http.status_code == 206
+        assert self.saved() == self.content
+        assert len(self.requests) == 2
+        byte_range, if_range = self.requests[1]
+        assert int(byte_range[6:].rstrip(b"-")) > 0
+        assert if_range == b'"v1"'
+
+    def test_can_resume_download_after_connection_reset(self):
+        self.reset = True
+        self.resource.download(self.file.name)
+        assert self.saved() == self.content
+        assert len(self.requests) == 2
+
+    def test_can_resume_download_more_than_once(self):
+        self.failures = 2
+        self.resource.download(self.file.name)
+        assert self.saved() == self.content
+        assert len(self.requests) == 3
+
+    def test_download_restarts_if_resource_changes(self):
+        def change(saved, rate):
+            self.etag = b'"v2"'
+
+        self.resource.download(self.file.name, progress=change)
+        assert self.saved() == self.content
+        assert len(self.requests) == 2
+        assert self.requests[1][1] == b'"v1"'
+
+    def test_download_restarts_without_validator(self):
+        self.etag = None
+        out = BytesIO()
+        out.write(b"head")
+        self.resource.download(out)
+        assert out.getvalue() == b"head" + self.content
+        assert self.requests == [(None, None), (None, None)]
+
+    def test_weak_etag_is_not_used_to_resume(self):
+        self.etag = b'W/"v1"'
+        self.resource.download(self.file.name)
+        assert self.saved() == self.content
+        assert self.requests[1] == (None, None)
+
+    def test_download_fails_when_retries_are_exhausted(self):
+        self.failures = 3
+        with self.assertRaises(SocketError):
+            self.resource.download(self.file.name, retries=2)
+
+
+class SpillTestCase(TestCase):
+
+    content = bytes(bytearray(range(256))) * 8192 + b"end"
+
+    def setUp(self):
+        content = self.content
+
+        def handler(connection, method, target, headers, _):
+            body = b"hello, world" if target == b"/small" else content
+            content_type = b"text/plain" if target == b"/text" else b"application/octet-stream"
+            if target == b"/text":
+                body = b"x" * len(content)
+            head = b"HTTP/1.1 200 OK\r\nContent-Type: " + content_type + b"\r\n"
+            if target == b"/chunked":
+                connection.sendall(head + b"Transfer-Encoding: chunked\r\n\r\n")
+                for offset in range(0, len(body), 100000):
+                    chunk = body[offset:(offset + 100000)]
+                    connection.sendall(bstr(hex(len(chunk))[2:]) + b"\r\n" + chunk + b"\r\n")
+                connection.sendall(b"0\r\n\r\n")
+            else:
+                connection.sendall(head + b"Content-Length: " + bstr(len(body)) + b"\r\n\r\n" + body)
+
+        self.server = LocalServer(handler)
+        self.http = HTTP(self.server.authority, spill_threshold=1048576)
+
+    def tearDown(self):
+        self.http.close()
+        self.server.close()
+
+    def test_small_content_is_held_in_memory(self):
+        assert self.http.get(b"/small").response().content == b"hello, world"
+        assert isinstance(self.http.content, bytes)
+        assert self.http.get(b"/small").response().readall() == b"hello, world"
+
+    def test_large_sized_content_is_spilled(self):
+        content = self.http.get(b"/sized").response().content
+        assert isinstance(content, memoryview)
+        assert content == self.content
+
+    def test_large_chunked_content_is_spilled(self):
+        content = self.http.get(b"/chunked").response().readall()
+        assert isinstance(content, memoryview)
+        assert content == self.content
+
+    def test_can_read_spilled_content_in_pieces(self):
+        self.http.get(b"/chunked").response()
+        assert self.http.read(10) == self.content[:10]
+        assert self.http.read(2000000) == self.content[10:2000010]
+        assert self.http.readall() == self.content[2000010:]
+
+    def test_retained_content_is_spilled(self):
+        self.http.get(b"/chunked").response()
+        assert b"".join(self.http.iter_content(retain=True)) == self.content
+        assert self.http.content == self.content
+
+    def test_spilled_text_is_decoded(self):
+        assert self.http.get(b"/text").response().content == "x" * len(self.content)
+
+    def test_spilled_content_outlives_next_response(self):
+        content = self.http.get(b"/sized").response().content
+        assert self.http.get(b"/small").response().content == b"hello, world"
+        assert content == self.content
+
+
+class ContentDecoderTestCase(TestCase):
+
+    data = b"".join(b'{"row": %d}\n' % i for i in range(20000))
+
+    @staticmethod
+    def compress(data, wbits):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+        return compressor.compress(data) + compressor.flush()
+
+    @staticmethod
+    def decode(decoder, encoded, split=1000, size=4096):
+        decoded = []
+        for i in range(0, len(encoded), split):
+            data = decoder.decode(encoded[i:(i + split)], size)
+            while data:
+                assert len(data) <= size
+                decoded.append(data)
+                data = decoder.more(size)
+        decoded.append(decoder.flush())
+        return b"".join(decoded)
+
+    def test_can_decode_gzip(self):
+        encoded = self.compress(self.data, 16 + zlib.MAX_WBITS)
+        assert self.decode(ContentDecoder(b"gzip"), encoded) == self.data
+
+    def test_can_decode_zlib_deflate(self):
+        encoded = self.compress(self.data, zlib.MAX_WBITS)
+        assert self.decode(ContentDecoder(b"deflate"), encoded) == self.data
+
+    def test_can_decode_raw_deflate(self):
+        encoded = self.compress(self.data, -zlib.MAX_WBITS)
+        assert self.decode(ContentDecoder(b"deflate"), encoded) == self.data
+
+    def test_decompression_ratio_is_capped(self):
+        encoded = self.compress(b"\x00" * 16777216, 16 + zlib.MAX_WBITS)
+        with self.assertRaises(IOError):
+            self.decode(ContentDecoder(b"gzip", max_ratio=100), encoded)
+
+    def test_invalid_content_raises_io_error(self):
+        with self.assertRaises(IOError):
+            self.decode(ContentDecoder(b"gzip"), b"this is not gzip data")
+
+    def test_unsupported_encoding_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ContentDecoder(b"br")
+
+
+class DecompressTestCase(TestCase):
+
+    rows = [{"row": i} for i in range(20000)]
+
+    def setUp(self):
+        self.accept_encodings = []
+        body = json_dumps(self.rows).encode("UTF-8")
+
+        def handler(connection, method, target, headers, _):
+            accept_encoding = headers.get(b"accept-encoding")
+            self.accept_encodings.append(accept_encoding)
+            if target == b"/bomb":
+                content = ContentDecoderTestCase.compress(b"\x00" * 16777216, 16 + zlib.MAX_WBITS)
+                encoding = b"gzip"
+            elif accept_encoding and b"gzip" in accept_encoding:
+                content = ContentDecoderTestCase.compress(body, 16 + zlib.MAX_WBITS)
+                encoding = b"gzip"
+            else:
+                content, encoding = body, None
+            head = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            if encoding:
+                head += b"Content-Encoding: " + encoding + b"\r\n"
+            if target == b"/chunked":
+                connection.sendall(head + b"Transfer-Encoding: chunked\r\n\r\n")
+                for offset in range(0, len(content), 1000):
+                    chunk = content[offset:(offset + 1000)]
+                    connection.sendall(bstr(hex(len(chunk))[2:]) + b"\r\n" + chunk + b"\r\n")
+                connection.sendall(b"0\r\n\r\n")
+            else:
+                connection.sendall(head + b"Content-Length: " + bstr(len(content)) + b"\r\n\r\n" + content)
+
+        self.body = body
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_compression_is_opt_in(self):
+        http = HTTP(self.server.authority)
+        assert http.get(b"/sized").response().content == self.rows
+        assert b"Content-Encoding" not in http.headers
+        http.close()
+        assert self.accept_encodings == [None]
+
+    def test_can_decode_content(self):
+        http = HTTP(self.server.authority, decompress=True)
+        for target in [b"/sized", b"/chunked"]:
+            assert http.get(target).response().content == self.rows
+            assert http.headers[b"Content-Encoding"] == b"gzip"
+        http.close()
+        assert self.accept_encodings[0] == httq.ACCEPT_ENCODING
+
+    def test_can_read_decoded_content_in_pieces(self):
+        http = HTTP(self.server.authority, decompress=True)
+        http.get(b"/chunked").response()
+        assert http.read(10) == self.body[:10]
+        assert http.read(100000) == self.body[10:100010]
+        assert http.readall() == self.body[100010:]
+        http.close()
+
+    def test_can_iterate_decoded_content(self):
+        http = HTTP(self.server.authority, decompress=True)
+        http.get(b"/sized").response()
+        assert b"".join(http.iter_content(chunk_size=4096)) == self.body
+        http.close()
+
+    def test_can_readinto_from_decoded_content(self):
+        http = HTTP(self.server.authority, decompress=True)
+        http.get(b"/sized").response()
+        buffer = bytearray(len(self.body) + 10)
+        assert http.readinto(buffer) == len(self.body)
+        assert buffer[:len(self.body)] == self.body
+        http.close()
+
+    def test_decompression_bomb_is_rejected(self):
+        http = HTTP(self.server.authority, decompress=True)
+        http.get(b"/bomb").response()
+        with self.assertRaises(IOError):
+            http.readall()
+        http.close()
+
+    def test_prepared_request_asks_for_compression(self):
+        http = HTTP(self.server.authority, decompress=True)
+        assert http.send(http.prepare(b"GET", b"/sized", b"")).response().content == self.rows
+        http.close()
+        assert self.accept_encodings == [httq.ACCEPT_ENCODING]
+
+
+class CompressTestCase(TestCase):
+
+    rows = [{"row": i} for i in range(20000)]
+
+    def setUp(self):
+        self.requests = []
+
+        def handler(connection, method, target, headers, body):
+            encoding = headers.get(b"content-encoding")
+            if encoding == b"gzip":
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            self.requests.append((encoding, headers.get(b"content-length"), body))
+            connection.sendall(b"HTTP/1.1 204 No Content\r\n\r\n")
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_compression_is_opt_in(self):
+        http = HTTP(self.server.authority)
+        http.post(b"/ingest", self.rows).response()
+        http.close()
+        assert self.requests[0][0] is None
+
+    def test_can_compress_json_body(self):
+        http = HTTP(self.server.authority, compress=b"gzip")
+        http.post(b"/ingest", self.rows).response()
+        http.close()
+        encoding, content_length, body = self.requests[0]
+        assert encoding == b"gzip"
+        assert int(content_length) < len(body) // 4
+        assert json_loads(body.decode("UTF-8")) == self.rows
+
+    def test_small_body_is_not_compressed(self):
+        http = HTTP(self.server.authority, compress=b"gzip", compress_threshold=100)
+        http.post(b"/ingest", b"x" * 99).response()
+        http.post(b"/ingest", b"x" * 100).response()
+        http.close()
+        assert [encoding for encoding, _, _ in self.requests] == [None, b"gzip"]
+        assert self.requests[1][2] == b"x" * 100
+
+    def test_explicit_content_encoding_is_respected(self):
+        http = HTTP(self.server.authority, compress=b"gzip")
+        http.post(b"/ingest", b"x" * 2000, content_encoding=b"identity").response()
+        http.close()
+        assert self.requests[0] == (b"identity", b"2000", b"x" * 2000)
+
+    def test_can_compress_chunked_body(self):
+        lines = [b'{"row": %d}\n' % i for i in range(20000)]
+        http = HTTP(self.server.authority, compress=b"gzip")
+        http.post(b"/ingest")
+        for i in range(0, len(lines), 1000):
+            http.write(*lines[i:(i + 1000)])
+        http.write(b"")
+        http.response()
+        http.post(b"/ingest", b"").response()
+        http.close()
+        assert self.requests[0] == (b"gzip", None, b"".join(lines))
+        assert self.requests[1] == (None, None, b"")
+
+    def test_can_compress_prepared_body(self):
+        http = HTTP(self.server.authority, compress=b"gzip")
+        ingest = http.prepare(b"POST", b"/ingest", self.rows)
+        http.send(ingest).response()
+        http.send(ingest, b"x" * 2000).response()
+        http.close()
+        encoding, content_length, body = self.requests[0]
+        assert encoding == b"gzip"
+        assert int(content_length) < len(body) // 4
+        assert json_loads(body.decode("UTF-8")) == self.rows
+        assert self.requests[1][0] == b"gzip"
+        assert self.requests[1][2] == b"x" * 2000
+
+    def test_small_prepared_body_is_not_compressed(self):
+        http = HTTP(self.server.authority, compress=b"gzip", compress_threshold=100)
+        http.send(http.prepare(b"POST", b"/ingest", b"x" * 99)).response()
+        http.close()
+        assert self.requests[0] == (None, b"99", b"x" * 99)
+
+    def test_can_compress_prepared_chunked_body(self):
+        http = HTTP(self.server.authority, compress=b"gzip")
+        http.send(http.prepare(b"POST", b"/ingest"))
+        http.write(b"hello, ", b"world", b"")
+        http.response()
+        http.close()
+        assert self.requests[0] == (b"gzip", None, b"hello, world")
+
+    def test_can_encode_and_decode(self):
+        encoder = ContentEncoder(b"gzip")
+        data = b"".join(encoder.encode(b"hello, world %d\n" % i) for i in range(1000)) + encoder.flush()
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == b"".join(b"hello, world %d\n" % i for i in range(1000))
+
+
+class PreparedRequestTestCase(TestCase):
+
+    def setUp(self):
+        self.requests = []
+
+        def handler(connection, method, target, headers, body):
+            self.requests.append((method, target, headers, body))
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(len(body)) + b"\r\n\r\n" + body)
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_can_send_prepared_request_repeatedly(self):
+        http = HTTP(self.server.authority, user_agent=b"httq/0")
+        commit = http.prepare(b"POST", b"/commit", b"hello", content_type=b"text/plain")
+        for _ in range(3):
+            assert http.send(commit).response().content == b"hello"
+        http.close()
+        assert len(self.requests) == 3
+        method, target, headers, body = self.requests[-1]
+        assert method == b"POST"
+        assert target == b"/commit"
+        assert headers[b"user-agent"] == b"httq/0"
+        assert headers[b"content-type"] == b"text/plain"
+        assert headers[b"content-length"] == b"5"
+        assert body == b"hello"
+
+    def test_prepared_request_matches_request(self):
+        http = HTTP(self.server.authority)
+        http.post(b"/json", {"one": 1}, x_thing=b"yes").response()
+        http.send(http.prepare(b"POST", b"/json", {"one": 1}, x_thing=b"yes")).response()
+        http.close()
+        assert self.requests[0] == self.requests[1]
+
+    def test_can_substitute_body(self):
+        http = HTTP(self.server.authority)
+        echo = http.prepare(b"POST", b"/echo", b"hello")
+        http.send(echo, b"goodbye").response()
+        assert http.request_headers[b"Content-Length"] == b"7"
+        assert http.content == b"goodbye"
+        http.send(echo, b"").response()
+        assert b"Content-Length" not in http.request_headers
+        assert http.content == b""
+        assert http.send(echo).response().content == b"hello"
+        http.close()
+
+    def test_can_substitute_url_parameters(self):
+        http = HTTP(self.server.authority)
+        item = http.prepare(b"GET", b"/item/{id}/{name}", b"")
+        http.send(item, id=42, name=b"foo").response()
+        assert http.request_url == b"/item/42/foo"
+        http.close()
+        assert self.requests[0][1] == b"/item/42/foo"
+
+    def test_can_send_prepared_chunked_request(self):
+        http = HTTP(self.server.authority)
+        upload = http.prepare(b"POST", b"/upload")
+        http.send(upload)
+        assert http.writable()
+        http.write(b"hel", b"lo")
+        http.write(b"")
+        assert http.response().content == b"hello"
+        http.send(upload, b"inline").response()
+        assert b"Transfer-Encoding" not in http.request_headers
+        assert http.content == b"inline"
+        http.close()
+
+
+class PoolTestCase(TestCase):
+
+    def setUp(self):
+        self.count = 0
+        self.received = []
+
+        def handler(connection, method, target, headers, body):
+            self.count += 1
+            self.received.append((method, target, len(body)))
+            if target.startswith(b"/drop") and self.received.count((method, target, len(body))) == 1:
+                return False
+            if target == b"/large":
+                content = b"x" * (httq.MAX_RECV_SIZE + 1)
+            elif target == b"/hello":
+                content = b"hello, world"
+            else:
+                content = target + b" " + bstr(self.count)
+            close = target == b"/close"
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: " +
+                               bstr(len(content)) + (b"\r\nConnection: close" if close else b"") + b"\r\n\r\n" +
+                               content)
+            if close:
+                return False
+
+        self.server = LocalServer(handler)
+        self.other_server = LocalServer(handler)
+        self.authority = self.server.authority
+
+    def tearDown(self):
+        self.server.close()
+        self.other_server.close()
+
+    def test_connection_is_reused_once_response_is_read(self):
+        with HTTPPool() as pool:
+            http_1 = pool.acquire(b"http", self.authority)
+            assert http_1.get(b"/hello").response().content == "hello, world"
+            http_2 = pool.acquire(b"http", self.authority)
+            assert http_2 is http_1
+            assert len(pool) == 1
+
+    def test_connection_is_not_reused_until_response_is_read(self):
+        with HTTPPool() as pool:
+            http_1 = pool.acquire(b"http", self.authority)
+            http_1.get(b"/hello").response()
+            http_2 = pool.acquire(b"http", self.authority)
+            assert http_2 is not http_1
+            assert len(pool) == 2
+            http_1.readall()
+            http_2.close()
+            assert len(pool) == 1
+
+    def test_connections_are_reused_most_recently_released_first(self):
+        with HTTPPool() as pool:
+            http_1 = pool.acquire(b"http", self.authority)
+            http_2 = pool.acquire(b"http", self.authority)
+            pool.release(http_1)
+            pool.release(http_2)
+            assert pool.acquire(b"http", self.authority) is http_2
+            assert pool.acquire(b"http", self.authority) is http_1
+
+    def test_closed_connection_is_not_reused(self):
+        with HTTPPool() as pool:
+            http_1 = pool.acquire(b"http", self.authority)
+            assert http_1.get(b"/close").response().content == "/close 1"
+            assert len(pool) == 0
+            http_2 = pool.acquire(b"http", self.authority)
+            assert http_2 is not http_1
+            assert http_2.get(b"/hello").response().content == "hello, world"
+
+    def test_idle_connection_is_evicted(self):
+        with HTTPPool(idle_timeout=0.05) as pool:
+            http_1 = pool.acquire(b"http", self.authority)
+            pool.release(http_1)
+            sleep(0.1)
+            http_2 = pool.acquire(b"http", self.authority)
+            assert http_2 is not http_1
+            assert len(pool) == 1
+
+    def test_connection_headers_are_reset_on_reuse(self):
+        with HTTPPool() as pool:
+            http_1 = pool.acquire(b"http", self.authority, user_agent=b"Test/1.0")
+            assert http_1.request_headers[b"User-Agent"] == b"Test/1.0"
+            pool.release(http_1)
+            http_2 = pool.acquire(b"http", self.authority)
+            assert http_2 is http_1
+            assert http_2.request_headers == {b"Host": self.authority}
+
+    def test_acquire_waits_for_connection_when_host_is_at_limit(self):
+        with HTTPPool(max_connections_per_host=1) as pool:
+            http = pool.acquire(b"http", self.authority)
+            with self.assertRaises(SocketTimeout):
+                pool.acquire(b"http", self.authority, timeout=0.05)
+            pool.release(http)
+            assert pool.acquire(b"http", self.authority, timeout=0.05) is http
+
+    def test_idle_connection_is_evicted_when_pool_is_at_limit(self):
+        with HTTPPool(max_connections=1) as pool:
+            http_1 = pool.acquire(b"http", self.other_server.authority)
+            pool.release(http_1)
+            http_2 = pool.acquire(b"http", self.authority)
+            assert http_2 is not http_1
+            assert len(pool) == 1
+
+    def test_pool_can_be_shared_between_threads(self):
+        errors = []
+
+        with HTTPPool(max_connections_per_host=3) as pool:
+
+            def run():
+                try:
+                    resource = Resource(b"http://" + self.authority + b"/hello", pool=pool)
+                    for _ in range(20):
+                        assert resource.get().content == "hello, world"
+                        assert len(pool) <= 3
+                except Exception as error:
+                    errors.append(error)
+
+            threads = [Thread(target=run) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert not errors
+            assert len(pool) <= 3
+
+    def test_module_functions_use_default_pool(self):
+        httq.default_pool.close()
+        httq.default_pool = HTTPPool()
+        assert httq.get(b"http://" + self.authority + b"/hello").content == "hello, world"
+        assert httq.get(b"http://" + self.authority + b"/hello").content == "hello, world"
+        assert len(httq.default_pool) == 1
+
+    def test_module_functions_do_not_wait_for_unread_small_responses(self):
+        httq.default_pool.close()
+        httq.default_pool = HTTPPool()
+        url = b"http://" + self.authority + b"/count"
+        responses = [httq.get(url) for _ in range(httq.default_pool.max_connections_per_host + 2)]
+        assert len(httq.default_pool) == 1
+        assert [response.content for response in responses] == \
+            ["/count " + str(i + 1) for i in range(len(responses))]
+
+    def test_unread_large_response_holds_connection_for_limited_time(self):
+        with HTTPPool(max_connections_per_host=1) as pool:
+            resource = Resource(b"http://" + self.authority + b"/large", pool=pool)
+            resource.acquire_timeout = 0.05
+            large = resource.get()
+            with self.assertRaises(SocketTimeout):
+                resource.get()
+            assert len(large.content) == httq.MAX_RECV_SIZE + 1
+            assert len(resource.get().content) == httq.MAX_RECV_SIZE + 1
+
+    def test_idempotent_request_is_sent_again_when_connection_drops(self):
+        with HTTPPool() as pool:
+            resource = Resource(b"http://" + self.authority + b"/drop", pool=pool)
+            assert resource.put(b"x" * 5000).content == "/drop 2"
+            assert self.received == [(b"PUT", b"/drop", 5000), (b"PUT", b"/drop", 5000)]
+
+    def test_file_upload_is_sent_again_in_full_when_connection_drops(self):
+        with HTTPPool() as pool:
+            resource = Resource(b"http://" + self.authority + b"/drop", pool=pool)
+            with NamedTemporaryFile() as f:
+                f.write(b"header" + b"x" * 5000)
+                f.flush()
+                f.seek(6)
+                assert resource.put(f).content == "/drop 2"
+            assert self.received == [(b"PUT", b"/drop", 5000), (b"PUT", b"/drop", 5000)]
+
+    def test_non_idempotent_request_is_not_sent_again_when_connection_drops(self):
+        with HTTPPool() as pool:
+            resource = Resource(b"http://" + self.authority + b"/drop", pool=pool)
+            with self.assertRaises(SocketError):
+                resource.post(b"x" * 5000)
+            assert self.received == [(b"POST", b"/drop", 5000)]
+
+    def test_responses_are_not_changed_by_reuse_of_connection(self):
+        with HTTPPool() as pool:
+            resource = Resource(b"http://" + self.authority + b"/count", pool=pool)
+            response_1 = resource.get()
+            assert response_1.content == "/count 1"
+            response_2 = resource.get()
+            assert response_2 is not response_1
+            assert response_2.content == "/count 2"
+            assert response_1.content == "/count 1"
+            assert len(pool) == 1
+
+
+class StreamingTestCase(TestCase):
+
+    size = 64 * 1024 * 1024
+
+    def setUp(self):
+        body = b"x" * 1048576
+        size = self.size
+
+        def handler(connection, method, target, headers, _):
+            if target == b"/lines":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                                   b"4\r\none\r\r\n5\r\n\ntwo\n\r\n6\r\nthree\n\r\n"
+                                   b"5\r\nfour\r\r\n1\r\n\n\r\n4\r\nfive\r\n0\r\n\r\n")
+            else:
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(size) + b"\r\n\r\n")
+                for _ in range(size // len(body)):
+                    connection.sendall(body)
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_can_iterate_lines_split_across_chunks(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/lines").response()
+        assert list(http.iter_lines()) == [b"one", b"two", b"three", b"four", b"five"]
+        http.close()
+
+    def test_streaming_large_content_uses_constant_memory(self):
+        if tracemalloc is None:
+            return
+        http = HTTP(self.server.authority)
+        http.get(b"/large").response()
+        tracemalloc.start()
+        try:
+            received = 0
+            for chunk in http.iter_content():
+                received += len(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        http.close()
+        assert received == self.size
+        assert peak < 4 * 1024 * 1024
+
+
+class JSONStreamingTestCase(TestCase):
+
+    rows = [{"row": [i, u"node \\ \"%d\" [{" % i], "meta": [{"id": i}]} for i in range(20000)]
+    document = {"results": [{"columns": ["n", "name"], "data": rows}], "errors": []}
+
+    def setUp(self):
+        body = json_dumps(self.document).encode("UTF-8")
+
+        def handler(connection, method, target, headers, _):
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                               b"Transfer-Encoding: chunked\r\n\r\n")
+            for i in range(0, len(body), 1000):
+                chunk = body[i:(i + 1000)]
+                connection.sendall(hexb(len(chunk)) + b"\r\n" + chunk + b"\r\n")
+            connection.sendall(b"0\r\n\r\n")
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    @staticmethod
+    def split(path, document, size):
+        splitter = JSONArraySplitter(path)
+        items = []
+        for i in range(0, len(document), size):
+            data = splitter.feed(document[i:(i + size)])
+            if data:
+                items.extend(json_loads(b"[" + data + b"]"))
+        splitter.close()
+        return items
+
+    def test_can_split_array_in_any_size_of_piece(self):
+        rows = self.rows[:100]
+        document = json_dumps({"results": [{"columns": ["n", "name"], "data": rows}]}, indent=1).encode("UTF-8")
+        for size in [1, 2, 3, 7, 100, len(document)]:
+            assert self.split(("results", 0, "data"), document, size) == rows
+
+    def test_can_split_scalars_and_empty_arrays(self):
+        document = json_dumps({"a": [[], 1, -2.5e10, True, None, u"x,]", {}], "b": []}).encode("UTF-8")
+        for size in [1, 5, len(document)]:
+            assert self.split(("a",), document, size) == [[], 1, -2.5e10, True, None, u"x,]", {}]
+            assert self.split(("b",), document, size) == []
+
+    def test_can_split_strings_escaped_across_pieces(self):
+        item = u'\\ "quoted" \\\\ ,]}' * 20
+        document = json_dumps({u"skip \\\"": [u"x\\\"" * 10, {u"k": u"]\\"}], "a": [item, {"s": item}, item]}).encode("UTF-8")
+        for size in [1, 2, 3, 5, len(document)]:
+            assert self.split(("a",), document, size) == [item, {"s": item}, item]
+
+    def test_large_item_is_split_in_linear_time(self):
+        item = u"x\\" * 1048576
+        document = json_dumps({"skipped": item, "a": [item, [item]]}).encode("UTF-8")
+        t0 = time()
+        assert self.split(("a",), document, 512) == [item, [item]]
+        assert time() - t0 < 2
+
+    def test_missing_array_yields_nothing(self):
+        document = json_dumps(self.document).encode("UTF-8")
+        for path in [("results", 1, "data"), ("errors", 0), ("results", 0, "data", "row"), ("nonesuch",)]:
+            splitter = JSONArraySplitter(path)
+            assert splitter.feed(document) == b""
+            assert not splitter.found
+
+    def test_incomplete_array_is_rejected(self):
+        splitter = JSONArraySplitter(("a",))
+        assert splitter.feed(b'{"a": [1, 2, 3') == b"1, 2"
+        with self.assertRaises(ValueError):
+            splitter.close()
+
+    def test_can_iterate_json_rows(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/").response()
+        assert list(http.iter_json(("results", 0, "data"))) == self.rows
+        http.get(b"/").response()
+        assert list(http.iter_json(("results", 0, "columns"), retain=True)) == ["n", "name"]
+        assert http.content == self.document
+        http.close()
+
+
+class NDJSONTestCase(TestCase):
+
+    records = [{"id": i, "name": u"caf\xe9 %d" % i} for i in range(2000)]
+
+    def setUp(self):
+        body = b"".join(json_dumps(record).encode("UTF-8") + (b"\r\n" if i % 2 else b"\n\n")
+                        for i, record in enumerate(self.records))
+
+        def handler(connection, method, target, headers, _):
+            if target == b"/close":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/jsonl\r\n"
+                                   b"Connection: close\r\n\r\n" + body[:-2])
+                return False
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                               b"Transfer-Encoding: chunked\r\n\r\n")
+            for i in range(0, len(body), 777):
+                chunk = body[i:(i + 777)]
+                connection.sendall(hexb(len(chunk)) + b"\r\n" + chunk + b"\r\n")
+            connection.sendall(b"0\r\n\r\n")
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_can_iterate_records(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/").response()
+        assert list(http.iter_ndjson()) == self.records
+        http.get(b"/close").response()
+        assert list(http.iter_ndjson()) == self.records
+        http.close()
+
+    def test_content_streams_records(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/").response()
+        content = http.content
+        assert not isinstance(content, list)
+        assert next(content) == self.records[0]
+        assert http.readable()
+        assert list(content) == self.records[1:]
+        assert not http.readable()
+        http.get(b"/").response()
+        assert next(http.content) == self.records[0]
+        http.close()
+
+    def test_content_decodes_received_records_lazily(self):
+        for spill_threshold in [None, 1024]:
+            http = HTTP(self.server.authority, spill_threshold=spill_threshold)
+            http.get(b"/").response()
+            http.readall()
+            content = http.content
+            assert not isinstance(content, list)
+            assert list(content) == self.records
+            http.get(b"/").response()
+            assert [record["id"] for record in http.iter_ndjson(retain=True)] == list(range(2000))
+            assert list(http.content) == self.records
+            http.close()
+
+    def test_content_of_received_records_can_be_iterated_again(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/").response()
+        http.readall()
+        assert list(http.content) == self.records
+        assert list(http.content) == self.records
+        http.close()
+
+    def test_content_cannot_be_streamed_twice(self):
+        http = HTTP(self.server.authority)
+        http.get(b"/").response()
+        assert list(http.content) == self.records
+        with self.assertRaises(IOError):
+            _ = http.content
+        http.close()
+
+
+class ServerSentEventsTestCase(TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.sent = Event()
+        self.received = Event()
+
+        def handler(connection, method, target, headers, _):
+            self.requests.append((target, headers.get(b"last-event-id"), headers.get(b"accept")))
+            if target == b"/plain":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 0\r\n\r\n")
+                return
+            if len(self.requests) == 3:
+                connection.sendall(b"HTTP/1.1 204 No Content\r\n\r\n")
+                return
+            if target == b"/chunked":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                                   b"Transfer-Encoding: chunked\r\n\r\n")
+                send = lambda data: connection.sendall(hexb(len(data)) + b"\r\n" + data + b"\r\n")
+            else:
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                                   b"Connection: close\r\n\r\n")
+                send = connection.sendall
+            if len(self.requests) == 1:
+                send(b"retry: 10\n: keep-alive\n\nid: 1\nevent: greeting\ndata: hello,\ndata: world\n\n")
+                # Nothing more is sent until the first event has been received
+                self.sent.set()
+                self.received.wait(5)
+                send(b"id: 2\r\ndata: two\r\n\r\ndata: incomplete")
+            else:
+                send(b"id: 3\ndata: three\n\n")
+            return False
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_can_parse_event_stream_in_any_size_of_piece(self):
+        stream = (b"\xef\xbb\xbf: comment\r\nretry: 250\nevent: add\ndata: one\ndata:two\r\nid: 7\r\n\r\n"
+                  b"data: x\n\nevent: dropped\n\nid: a\x00b\ndata: 3\rdata\r\r")
+        for size in [1, 2, 3, len(stream)]:
+            parser = EventStreamParser()
+            events = []
+            for i in range(0, len(stream), size):
+                events.extend(parser.feed(stream[i:(i + size)]))
+            assert [(event.event, event.data, event.id) for event in events] == \
+                [("add", "one\ntwo", "7"), ("message", "x", "7"), ("message", "3\n", "7")]
+            assert parser.retry == 250
+            assert parser.last_event_id == "7"
+
+    def test_incomplete_event_is_discarded_on_reset(self):
+        parser = EventStreamParser()
+        assert parser.feed(b"id: 5\ndata: partial\n") == []
+        parser.reset()
+        assert parser.feed(b"\n") == []
+        assert parser.last_event_id == "5"
+
+    def test_events_are_delivered_without_waiting_for_more_content(self):
+        for target in [b"/chunked", b"/until-closed"]:
+            del self.requests[:]
+            self.sent.clear()
+            self.received.clear()
+            http = HTTP(self.server.authority, read_timeout=2)
+            events = http.events(target)
+            event = next(events)
+            assert self.sent.is_set()
+            self.received.set()
+            assert (event.event, event.data, event.id) == ("greeting", "hello,\nworld", "1")
+            assert [(event.data, event.id) for event in events] == [("two", "2"), ("three", "3")]
+            assert self.requests == [(target, None, b"text/event-stream"),
+                                     (target, b"2", b"text/event-stream"),
+                                     (target, b"3", b"text/event-stream")]
+            http.close()
+
+    def test_can_iterate_events_without_reconnecting(self):
+        self.received.set()
+        http = HTTP(self.server.authority)
+        assert [event.data for event in http.events(b"/chunked", reconnect=False)] == ["hello,\nworld", "two"]
+        assert len(self.requests) == 1
+        http.close()
+
+    def test_other_content_is_rejected(self):
+        http = HTTP(self.server.authority)
+        with self.assertRaises(IOError):
+            next(http.events(b"/plain"))
+        http.close()
+
+
+def websocket_frame(opcode, payload, fin=True):
+    # An unmasked frame, as sent by a server
+    first = 0x80 | opcode if fin else opcode
+    if len(payload) < 126:
+        return pack(">BB", first, len(payload)) + payload
+    elif len(payload) < 65536:
+        return pack(">BBH", first, 126, len(payload)) + payload
+    else:
+        return pack(">BBQ", first, 127, len(payload)) + payload
+
+
+def read_websocket_frame(reader):
+    # Read a masked frame, as sent by a client, unmasking byte by byte, or
+    # return None if the connection has been closed
+    head = reader.read(2)
+    if len(head) < 2:
+        return None
+    first, second = bytearray(head)
+    size = second & 0x7F
+    if size == 126:
+        size, = unpack(">H", reader.read(2))
+    elif size == 127:
+        size, = unpack(">Q", reader.read(8))
+    assert second & 0x80
+    key = bytearray(reader.read(4))
+    payload = bytearray(reader.read(size))
+    for i in range(size):
+        payload[i] ^= key[i % 4]
+    return bool(first & 0x80), first & 0x0F, bytes(payload)
+
+
+class WebSocketTestCase(TestCase):
+
+    def setUp(self):
+        self.frames = []
+        self.close_payloads = []
+        self.closed = Event()
+
+        def handler(connection, method, target, headers, _):
+            accept = b64encode(sha1(headers[b"sec-websocket-key"] + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11").digest())
+            if target == b"/refused":
+                connection.sendall(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n")
+                return
+            elif target == b"/bad-accept":
+                accept = b"x" + accept
+            self.protocols = headers.get(b"sec-websocket-protocol")
+            self.version = headers.get(b"sec-websocket-version")
+            # The first frame is sent along with the handshake
+            if target == b"/close":
+                frame = websocket_frame(0x8, pack(">H", 1001) + b"going away")
+            else:
+                frame = websocket_frame(0x1, u"welcome \u2603".encode("UTF-8"))
+            if target == b"/huge":
+                # Announce a frame far larger than any client should buffer
+                frame += pack(">BBQ", 0x82, 127, 2 ** 40)
+            connection.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                               b"Sec-WebSocket-Accept: " + accept + b"\r\nSec-WebSocket-Protocol: v2.telemetry\r\n\r\n" +
+                               frame)
+            reader = connection.makefile("rb")
+            message = []
+            while True:
+                frame = read_websocket_frame(reader)
+                if frame is None:
+                    return False
+                fin, opcode, payload = frame
+                self.frames.append((fin, opcode, len(payload)))
+                if opcode == 0x8:
+                    self.close_payloads.append(payload)
+                    if target != b"/close":
+                        connection.sendall(websocket_frame(0x8, payload))
+                    self.closed.set()
+                    return False
+                elif opcode in (0x1, 0x2, 0x0):
+                    message.append(payload)
+                    if opcode:
+                        message_opcode = opcode
+                    if fin:
+                        # Echo the message in two fragments with a ping between them
+                        payload = b"".join(message)
+                        del message[:]
+                        half = len(payload) // 2
+                        connection.sendall(websocket_frame(message_opcode, payload[:half], fin=False) +
+                                           websocket_frame(0x9, b"heartbeat") +
+                                           websocket_frame(0x0, payload[half:]))
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_masking_matches_bytewise_xor(self):
+        key = b"\x01\x80\xfe\x37"
+        for size in [0, 1, 3, 4, 5, 127, 70000]:
+            data = bytes(bytearray(i % 251 for i in range(size)))
+            expected = bytes(bytearray(b ^ bytearray(key)[i % 4] for i, b in enumerate(bytearray(data))))
+            assert httq.mask(data, key) == expected
+            assert httq.mask(expected, key) == data
+
+    def test_can_parse_frames_in_any_size_of_piece(self):
+        payloads = [b"", b"x" * 125, b"y" * 126, b"z" * 65536]
+        stream = b"".join(b"".join(WebSocket._frame(0x2, payload)) for payload in payloads) + \
+            websocket_frame(0x1, b"partial", fin=False)
+        for size in [1, 7, len(stream)]:
+            parser = WebSocketParser()
+            frames = []
+            for i in range(0, len(stream), size):
+                parser.feed(stream[i:(i + size)])
+                frame = parser.next_frame()
+                while frame is not NEED_DATA:
+                    frames.append(frame)
+                    frame = parser.next_frame()
+            assert frames == [(True, 0x2, payload) for payload in payloads] + [(False, 0x1, b"partial")]
+
+    def test_reserved_bits_are_rejected(self):
+        parser = WebSocketParser()
+        parser.feed(b"\xc1\x00")
+        with self.assertRaises(IOError):
+            parser.next_frame()
+
+    def test_oversized_frame_is_rejected_before_its_payload_arrives(self):
+        parser = WebSocketParser()
+        parser.feed(pack(">BBQ", 0x82, 127, 2 ** 62))
+        with self.assertRaises(MessageTooBig):
+            parser.next_frame(max_size=1024)
+        assert parser.next_frame(max_size=None) is NEED_DATA
+
+    def test_oversized_frame_closes_connection(self):
+        http = HTTP(self.server.authority, read_timeout=5)
+        ws = http.websocket(b"/huge")
+        assert ws.receive() == u"welcome \u2603"
+        with self.assertRaises(MessageTooBig):
+            ws.receive()
+        assert ws.closed
+        assert self.closed.wait(5)
+        assert self.close_payloads == [pack(">H", 1009)]
+
+    def test_oversized_fragmented_message_closes_connection(self):
+        http = HTTP(self.server.authority, read_timeout=5)
+        ws = http.websocket(b"/echo", max_size=600)
+        assert ws.receive() == u"welcome \u2603"
+        ws.send(b"x" * 1000)
+        with self.assertRaises(MessageTooBig):
+            ws.receive()
+        assert ws.closed
+        assert self.closed.wait(5)
+        assert self.close_payloads == [pack(">H", 1009)]
+
+    def test_can_exchange_messages(self):
+        http = HTTP(self.server.authority, read_timeout=5)
+        ws = http.websocket(b"/echo", protocols=["v2.telemetry", "v1.telemetry"])
+        assert http._socket is None
+        assert ws.subprotocol == "v2.telemetry"
+        assert self.protocols == b"v2.telemetry, v1.telemetry"
+        assert self.version == b"13"
+        assert ws.receive() == u"welcome \u2603"
+        ws.send(u"caf\u00e9")
+        assert ws.receive() == u"caf\u00e9"
+        data = bytes(bytearray(i % 256 for i in range(200000)))
+        ws.send(data, fragment_size=65536)
+        assert ws.receive() == data
+        ws.ping(b"are you there?")
+        ws.close()
+        assert ws.closed
+        assert ws.receive() is None
+        assert self.frames == [(True, 0x1, 5), (True, 0xA, 9),
+                               (False, 0x2, 65536), (False, 0x0, 65536), (False, 0x0, 65536), (True, 0x0, 3392),
+                               (True, 0xA, 9), (True, 0x9, 14), (True, 0x8, 2)]
+        http.close()
+
+    def test_server_can_close(self):
+        http = HTTP(self.server.authority, read_timeout=5)
+        with http.websocket(b"/close") as ws:
+            assert list(ws) == []
+            assert ws.closed
+            assert (ws.close_code, ws.close_reason) == (1001, "going away")
+        assert self.closed.wait(5)
+        assert self.frames == [(True, 0x8, 2)]
+        http.reconnect()
+        with self.assertRaises(IOError):
+            http.websocket(b"/refused")
+        http.close()
+
+    def test_invalid_handshake_is_rejected(self):
+        http = HTTP(self.server.authority, read_timeout=5)
+        with self.assertRaises(IOError):
+            http.websocket(b"/bad-accept")
+        assert http._socket is None
+
+    def test_upgraded_connection_is_not_returned_to_pool(self):
+        pool = HTTPPool()
+        http = pool.acquire(b"http", self.server.authority)
+        ws = http.websocket(b"/echo")
+        assert len(pool) == 0
+        assert ws.receive() == u"welcome \u2603"
+        ws.close()
+        pool.close()
+
+
+class MultiplexerTestCase(TestCase):
+
+    def setUp(self):
+        self.connections = set()
+        self.received = []
+
+        def handler(connection, method, target, headers, body):
+            self.connections.add(connection)
+            self.received.append((method, target))
+            if target.startswith(b"/slow"):
+                sleep(0.3)
+            elif target in (b"/hang", b"/drop"):
+                if target == b"/hang":
+                    sleep(1)
+                return False
+            if target == b"/json":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: " +
+                                   bstr(len(body)) + b"\r\n\r\n" + body)
+                return
+            malformed = {b"/bad-chunk": b"Transfer-Encoding: chunked\r\n\r\nzz\r\n",
+                         b"/bad-length": b"Content-Length: abc\r\n\r\n",
+                         b"/bad-gzip": b"Content-Encoding: gzip\r\nContent-Length: 9\r\n\r\nnot gzip!"}.get(target)
+            if malformed:
+                connection.sendall(b"HTTP/1.1 200 OK\r\n" + malformed)
+                return False
+            content = method + b" " + target
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: " +
+                               bstr(len(content)) + b"\r\n\r\n" + (b"" if method == b"HEAD" else content))
+            if target == b"/close-after":
+                return False
+
+        self.server = LocalServer(handler)
+        self.url = b"http://" + self.server.authority
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_malformed_responses_fail_their_own_futures(self):
+        with HTTPMultiplexer(decompress=True) as mux:
+            bad = [mux.submit(b"GET", self.url + target) for target in [b"/bad-chunk", b"/bad-length", b"/bad-gzip"]]
+            good = mux.submit(b"GET", self.url + b"/good")
+            assert mux.run() == 0
+            assert mux.pending == 0
+            for future in bad:
+                with self.assertRaises(Exception):
+                    future.result()
+            assert good.result().content == u"GET /good"
+
+    def test_requests_proceed_concurrently(self):
+        with HTTPMultiplexer(max_connections_per_host=20) as mux:
+            t0 = time()
+            futures = [mux.submit(b"GET", self.url + b"/slow/" + bstr(i)) for i in range(20)]
+            assert mux.run() == 0
+            assert time() - t0 < 2
+            assert len(mux) == 20
+            assert [future.result().content for future in futures] == \
+                [u"GET /slow/" + str(i) for i in range(20)]
+
+    def test_connections_are_limited_and_reused(self):
+        done = []
+        with HTTPMultiplexer(max_connections_per_host=4) as mux:
+            futures = [mux.submit(b"GET", self.url + b"/" + bstr(i), callback=done.append) for i in range(50)]
+            assert mux.pending == 50
+            mux.run()
+            assert mux.pending == 0
+            assert len(mux) == 4
+        assert len(self.connections) == 4
+        assert sorted(done, key=futures.index) == futures
+        assert [future.result().readall() for future in futures] == [b"GET /" + bstr(i) for i in range(50)]
+
+    def test_result_drives_multiplexer(self):
+        with HTTPMultiplexer() as mux:
+            json_future = mux.submit(u"POST", self.url + b"/json", {"answer": [4, 2]})
+            head_future = mux.submit(b"HEAD", self.url + b"/head")
+            assert json_future.result(timeout=5).content == {"answer": [4, 2]}
+            response = head_future.result(timeout=5)
+            assert response.status_code == 200
+            assert response.readall() == b""
+
+    def test_slow_response_times_out(self):
+        with HTTPMultiplexer(read_timeout=0.2) as mux:
+            hanging = mux.submit(b"GET", self.url + b"/hang")
+            quick = mux.submit(b"GET", self.url + b"/quick")
+            assert quick.result().status_code == 200
+            assert isinstance(hanging.exception(), SocketTimeout)
+            with self.assertRaises(SocketTimeout):
+                hanging.result()
+
+    def test_refused_connection_fails_request(self):
+        listener = socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        with HTTPMultiplexer() as mux:
+            future = mux.submit(b"GET", b"http://127.0.0.1:" + bstr(port) + b"/")
+            assert mux.run(timeout=5) == 0
+            assert isinstance(future.exception(), IOError)
+
+    def test_request_is_resent_if_reused_connection_was_closed(self):
+        with HTTPMultiplexer() as mux:
+            assert mux.submit(b"GET", self.url + b"/close-after").result().status_code == 200
+            sleep(0.1)
+            assert mux.submit(b"GET", self.url + b"/again").result(timeout=5).content == u"GET /again"
+        assert len(self.connections) == 2
+
+    def test_non_idempotent_request_is_not_resent_if_reused_connection_drops(self):
+        with HTTPMultiplexer() as mux:
+            assert mux.submit(b"GET", self.url + b"/first").result(timeout=5).status_code == 200
+            future = mux.submit(b"POST", self.url + b"/drop", b"charge")
+            assert isinstance(future.exception(timeout=5), SocketError)
+        assert self.received == [(b"GET", b"/first"), (b"POST", b"/drop")]
+
+    def test_closing_fails_outstanding_requests(self):
+        mux = HTTPMultiplexer()
+        future = mux.submit(b"GET", self.url + b"/hang")
+        mux.poll(0.1)
+        mux.close()
+        assert future.done()
+        assert isinstance(future.exception(), SocketError)
+
+    def test_only_plain_http_urls_are_supported(self):
+        with HTTPMultiplexer() as mux:
+            with self.assertRaises(ValueError):
+                mux.submit(b"GET", b"https://example.com/")
+            with self.assertRaises(ValueError):
+                mux.submit(b"GET", b"/relative")
+
+
+class PipelineTestCase(TestCase):
+
+    def setUp(self):
+        self.connections = set()
+        self.received = []
+
+        def handler(connection, method, target, headers, body):
+            self.connections.add(connection)
+            self.received.append((method, target))
+            if target.startswith(b"/slow"):
+                sleep(0.2)
+            elif target == b"/hang":
+                sleep(1)
+                return False
+            elif target == b"/bad-chunk":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n")
+                return False
+            elif target == b"/bad-length":
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: abc\r\n\r\n")
+                return False
+            content = method + b" " + target + b" " + body
+            close = target.endswith(b"/last")
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: " +
+                               bstr(len(content)) + (b"\r\nConnection: close" if close else b"") + b"\r\n\r\n" +
+                               (b"" if method == b"HEAD" else content))
+            if close:
+                return False
+
+        self.server = LocalServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_requests_are_sent_without_waiting_for_responses(self):
+        with HTTPPipeline(self.server.authority) as pipeline:
+            t0 = time()
+            futures = [pipeline.submit(b"GET", b"/slow/" + bstr(i)) for i in range(4)]
+            assert time() - t0 < 0.1
+            assert pipeline.pending == 4
+            assert [future.result(timeout=5).content for future in futures] == \
+                [u"GET /slow/" + str(i) + u" " for i in range(4)]
+            assert pipeline.pending == 0
+        assert len(self.connections) == 1
+
+    def test_pipeline_depth_is_bounded(self):
+        with HTTPPipeline(self.server.authority, max_depth=2) as pipeline:
+            t0 = time()
+            futures = [pipeline.submit(b"GET", b"/slow/" + bstr(i)) for i in range(3)]
+            assert time() - t0 >= 0.15
+            assert futures[0].done()
+            assert not futures[2].done()
+            assert futures[2].result(timeout=5).status_code == 200
+
+    def test_non_idempotent_requests_are_not_pipelined(self):
+        with HTTPPipeline(self.server.authority) as pipeline:
+            first = pipeline.submit(b"GET", b"/slow/1")
+            t0 = time()
+            post = pipeline.submit(b"POST", b"/post", b"data")
+            assert first.done()
+            after = pipeline.submit(b"HEAD", b"/after")
+            assert post.done()
+            assert time() - t0 >= 0.15
+            assert post.result().content == u"POST /post data"
+            assert after.result(timeout=5).status_code == 200
+        assert self.received == [(b"GET", b"/slow/1"), (b"POST", b"/post"), (b"HEAD", b"/after")]
+
+    def test_responses_are_routed_to_each_thread(self):
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(20):
+                    url = b"/" + bstr(n) + b"/" + bstr(i)
+                    response = pipeline.submit(b"GET", url).result(timeout=5)
+                    assert response.content == u"GET " + url.decode("ASCII") + u" "
+            except Exception as error:
+                errors.append(error)
+
+        with HTTPPipeline(self.server.authority, max_depth=4) as pipeline:
+            threads = [Thread(target=work, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert not errors
+        assert len(self.received) == 160
+        assert len(self.connections) == 1
+
+    def test_requests_are_sent_again_when_server_closes_connection(self):
+        done = []
+        with HTTPPipeline(self.server.authority) as pipeline:
+            futures = [pipeline.submit(b"GET", b"/slow/last")] + \
+                [pipeline.submit(b"GET", b"/" + bstr(i)) for i in range(3)]
+            futures[-1].add_done_callback(done.append)
+            assert [future.result(timeout=5).content for future in futures] == \
+                [u"GET /slow/last ", u"GET /0 ", u"GET /1 ", u"GET /2 "]
+            assert done == futures[-1:]
+        assert len(self.connections) == 2
+
+    def test_slow_response_times_out(self):
+        with HTTPPipeline(self.server.authority, read_timeout=0.2) as pipeline:
+            hanging = pipeline.submit(b"GET", b"/hang")
+            after = pipeline.submit(b"GET", b"/after")
+            assert isinstance(hanging.exception(timeout=5), SocketTimeout)
+            assert after.result(timeout=5).content == u"GET /after "
+
+    def test_malformed_response_fails_only_its_request(self):
+        with HTTPPipeline(self.server.authority) as pipeline:
+            bad_chunk = pipeline.submit(b"GET", b"/bad-chunk")
+            after = pipeline.submit(b"GET", b"/after")
+            assert isinstance(bad_chunk.exception(timeout=5), ValueError)
+            assert after.result(timeout=5).content == u"GET /after "
+            bad_length = pipeline.submit(b"GET", b"/bad-length")
+            assert isinstance(bad_length.exception(timeout=5), RuntimeError)
+            assert pipeline.submit(b"GET", b"/again").result(timeout=5).content == u"GET /again "
+        assert self.received.count((b"GET", b"/bad-chunk")) == 1
+
+    def test_closing_fails_outstanding_requests(self):
+        pipeline = HTTPPipeline(self.server.authority)
+        future = pipeline.submit(b"GET", b"/hang")
+        pipeline.close()
+        assert isinstance(future.exception(timeout=5), SocketError)
+        with self.assertRaises(SocketError):
+            pipeline.submit(b"GET", b"/")
 
 
 if __name__ == "__main__":
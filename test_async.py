@@ -0,0 +1,396 @@
+import asyncio
+import json
+from socket import socket
+from tempfile import TemporaryFile
+from time import time
+from unittest import IsolatedAsyncioTestCase, main
+import zlib
+
+from httq import bstr, SocketTimeout
+from httq_async import AsyncHTTP
+
+
+class AsyncGetMethodTestCase(IsolatedAsyncioTestCase):
+
+    async def test_can_use_get_method_long_hand(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.get(b"/hello")
+        await http.response()
+        assert http.readable()
+        assert http.status_code == 200
+        assert http.reason == "OK"
+        assert http.content_type == "text/plain"
+        assert await http.readall() == b"hello, world"
+        assert not http.readable()
+        assert http.content == "hello, world"
+        http.close()
+
+    async def test_can_use_async_with(self):
+        async with AsyncHTTP(b"httq.io:8080") as http:
+            await http.get(b"/hello")
+            await http.response()
+            assert await http.readall() == b"hello, world"
+
+    async def test_can_pipeline_multiple_get_requests(self):
+        count = 3
+        turns = range(1, count + 1)
+        http = AsyncHTTP(b"httq.io:8080")
+        for i in turns:
+            await http.get("/echo?%d" % i)
+            assert len(http._requests) == i
+        for i in turns:
+            await http.response()
+            assert http.status_code == 200
+            assert await http.readall() == bstr(i)
+        assert len(http._requests) == 0
+        http.close()
+
+    async def test_can_read_in_bits(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.get(b"/hello")
+        await http.response()
+        assert await http.read(5) == b"hello"
+        assert http.readable()
+        assert await http.read(2) == b", "
+        assert await http.read() == b"world"
+        assert not http.readable()
+        http.close()
+
+    async def test_can_readinto(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.get(b"/hello")
+        await http.response()
+        buffer = bytearray(12)
+        assert await http.readinto(buffer) == 12
+        assert buffer == b"hello, world"
+        assert not http.readable()
+        http.close()
+
+    async def test_can_get_chunks(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.get(b"/chunks")
+        await http.response()
+        assert await http.readall() == b"chunk 1\r\nchunk 2\r\nchunk 3\r\n"
+        http.close()
+
+    async def test_can_iterate_lines(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.get(b"/chunks")
+        await http.response()
+        assert [line async for line in http.iter_lines()] == [b"chunk 1", b"chunk 2", b"chunk 3"]
+        http.close()
+
+    async def test_can_iterate_content_and_retain_it(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.get(b"/hello")
+        await http.response()
+        assert b"".join([chunk async for chunk in http.iter_content(retain=True)]) == b"hello, world"
+        assert http.content == "hello, world"
+        http.close()
+
+    async def test_content_is_unavailable_until_received(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.get(b"/hello")
+        await http.response()
+        with self.assertRaises(IOError):
+            _ = http.content
+        http.close()
+
+    async def test_can_get_http_1_0(self):
+        http = AsyncHTTP(b"httq.io:8080", user_agent=b"OldBrowser/1.0")
+        await http.get(b"/hello")
+        await http.response()
+        assert await http.readall() == b"hello, world"
+        http.close()
+
+    async def test_can_make_concurrent_requests(self):
+        count = 20
+
+        async def get_dots():
+            async with AsyncHTTP(b"httq.io:8080") as http:
+                await http.get(b"/dots")
+                await http.response()
+                return await http.readall()
+
+        t0 = time()
+        results = await asyncio.gather(*[get_dots() for _ in range(count)])
+        elapsed = time() - t0
+        assert results == [b"..."] * count
+
+        t0 = time()
+        await get_dots()
+        single = time() - t0
+        assert elapsed < count * single / 2
+
+
+class AsyncJSONTestCase(IsolatedAsyncioTestCase):
+
+    async def test_can_post_json(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.post(b"/json?foo=bar", b"bumblebee")
+        await http.response()
+        await http.readall()
+        assert http.content == {"method": "POST", "query": "foo=bar", "content": "bumblebee"}
+        http.close()
+
+    async def test_can_post_json_in_chunks(self):
+        http = AsyncHTTP(b"httq.io:8080")
+        await http.post(b"/json?foo=bar")
+        await http.write(b"bum", b"ble")
+        await http.write(b"bee", b"")
+        await http.response()
+        await http.readall()
+        assert http.content == {"method": "POST", "query": "foo=bar", "content": "bumblebee"}
+        http.close()
+
+
+class AsyncFileTestCase(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.bodies = []
+
+        async def handle(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.lower().partition(b"content-length:")[2].partition(b"\r\n")[0])
+            self.bodies.append(await reader.readexactly(length))
+            writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+            await writer.drain()
+            writer.close()
+
+        self.server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        self.authority = b"127.0.0.1:" + bstr(self.server.sockets[0].getsockname()[1])
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_can_upload_file(self):
+        content = b"x" * 1048576 + b"end"
+        with TemporaryFile() as f:
+            f.write(content)
+            f.seek(0)
+            async with AsyncHTTP(self.authority) as http:
+                await http.put(b"/upload", f)
+                await http.response()
+        assert self.bodies == [content]
+
+    async def test_can_save_content(self):
+        content = b"x" * 1048576 + b"end"
+
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(len(content)) + b"\r\n\r\n" + content)
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        authority = b"127.0.0.1:" + bstr(server.sockets[0].getsockname()[1])
+        with TemporaryFile() as f:
+            async with AsyncHTTP(authority) as http:
+                await http.get(b"/download")
+                await http.response()
+                assert await http.save(f) == len(content)
+            f.seek(0)
+            assert f.read() == content
+        server.close()
+        await server.wait_closed()
+
+
+class AsyncDeferredFlushTestCase(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        async def handle(reader, writer):
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                target = head.split(b" ", 2)[1]
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(len(target)) + b"\r\n\r\n" + target)
+                await writer.drain()
+            writer.close()
+
+        self.server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        self.authority = b"127.0.0.1:" + bstr(self.server.sockets[0].getsockname()[1])
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_deferred_requests_are_sent_together(self):
+        async with AsyncHTTP(self.authority) as http:
+            sends = []
+            send = http._send
+
+            async def counting_send(data):
+                sends.append(data)
+                await send(data)
+
+            http._send = counting_send
+            for i in range(5):
+                await http.get(b"/" + bstr(i), flush=False)
+            assert sends == []
+            await http.flush()
+            assert len(sends) == 1
+            for i in range(5):
+                await http.response()
+                assert await http.readall() == b"/" + bstr(i)
+
+
+class AsyncSpillTestCase(IsolatedAsyncioTestCase):
+
+    async def test_large_content_is_spilled(self):
+        content = b"x" * 1048576 + b"end"
+
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: " + bstr(len(content)) + b"\r\n\r\n" + content)
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        authority = b"127.0.0.1:" + bstr(server.sockets[0].getsockname()[1])
+        async with AsyncHTTP(authority, spill_threshold=65536) as http:
+            await http.get(b"/large")
+            await http.response()
+            data = await http.readall()
+            assert isinstance(data, memoryview)
+            assert data == content
+        server.close()
+        await server.wait_closed()
+
+
+class AsyncDecompressTestCase(IsolatedAsyncioTestCase):
+
+    async def test_can_decode_content(self):
+        content = b"".join(b"hello, world %d\n" % i for i in range(100000))
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        encoded = compressor.compress(content) + compressor.flush()
+        accept_encodings = []
+
+        async def handle(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            accept_encodings.append(b"Accept-Encoding: gzip" in head)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: " +
+                         bstr(len(encoded)) + b"\r\n\r\n" + encoded)
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        authority = b"127.0.0.1:" + bstr(server.sockets[0].getsockname()[1])
+        async with AsyncHTTP(authority, decompress=True) as http:
+            await http.get(b"/compressed")
+            await http.response()
+            assert await http.read(5) == b"hello"
+            assert await http.readall() == content[5:]
+        assert accept_encodings == [True]
+        server.close()
+        await server.wait_closed()
+
+
+class AsyncJSONStreamingTestCase(IsolatedAsyncioTestCase):
+
+    async def test_can_iterate_json_rows(self):
+        rows = [{"row": [i, "node %d" % i]} for i in range(20000)]
+        content = json.dumps({"results": [{"columns": ["n"], "data": rows}], "errors": []}).encode("UTF-8")
+
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: " +
+                         bstr(len(content)) + b"\r\n\r\n" + content)
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        authority = b"127.0.0.1:" + bstr(server.sockets[0].getsockname()[1])
+        async with AsyncHTTP(authority) as http:
+            await http.get(b"/rows")
+            await http.response()
+            assert [row async for row in http.iter_json(("results", 0, "data"))] == rows
+        server.close()
+        await server.wait_closed()
+
+
+class AsyncNDJSONTestCase(IsolatedAsyncioTestCase):
+
+    async def test_can_iterate_records(self):
+        records = [{"id": i} for i in range(2000)]
+        content = b"".join(json.dumps(record).encode("UTF-8") + b"\n" for record in records)
+
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n\r\n")
+            for i in range(0, len(content), 1000):
+                writer.write(content[i:(i + 1000)])
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        authority = b"127.0.0.1:" + bstr(server.sockets[0].getsockname()[1])
+        async with AsyncHTTP(authority) as http:
+            await http.get(b"/events")
+            await http.response()
+            assert [record async for record in http.iter_ndjson()] == records
+        server.close()
+        await server.wait_closed()
+
+
+class AsyncServerSentEventsTestCase(IsolatedAsyncioTestCase):
+
+    async def test_can_receive_events_and_reconnect(self):
+        last_event_ids = []
+
+        async def handle(reader, writer):
+            head = await reader.readuntil(b"\r\n\r\n")
+            last_event_ids.append(head.partition(b"Last-Event-ID: ")[2].partition(b"\r\n")[0])
+            if len(last_event_ids) == 3:
+                writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+            else:
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+                writer.write(b"retry: 10\nid: %d\ndata: event %d\n\n" % (len(last_event_ids), len(last_event_ids)))
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        authority = b"127.0.0.1:" + bstr(server.sockets[0].getsockname()[1])
+        http = AsyncHTTP(authority)
+        assert [(event.data, event.id) async for event in http.events(b"/feed")] == [("event 1", "1"), ("event 2", "2")]
+        assert last_event_ids == [b"", b"1", b"2"]
+        http.close()
+        server.close()
+        await server.wait_closed()
+
+
+class AsyncTimeoutTestCase(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        # A listening socket that accepts connections (via its backlog) but never responds
+        self.server = socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.authority = b"127.0.0.1:" + bstr(self.server.getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+
+    async def test_read_timeout_raises_socket_timeout(self):
+        http = AsyncHTTP(self.authority, read_timeout=0.2)
+        await http.get(b"/hello")
+        t0 = time()
+        with self.assertRaises(SocketTimeout):
+            await http.response()
+        assert 0.1 < time() - t0 < 2.0
+        http.close()
+
+    async def test_request_timeout_raises_socket_timeout(self):
+        http = AsyncHTTP(self.authority, read_timeout=5, timeout=0.2)
+        await http.get(b"/hello")
+        t0 = time()
+        with self.assertRaises(SocketTimeout):
+            await http.response()
+        assert time() - t0 < 2.0
+        http.close()
+
+
+if __name__ == "__main__":
+    main()